@@ -8,31 +8,47 @@
 默认Python版本支持：3.6
 """
 
+import atexit
 import datetime
 import glob
+import hashlib
 import json
 import logging
 import os
-import random
 import re
 import shutil
 import time
 import traceback
-from collections import defaultdict
+import uuid
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from distutils.version import LooseVersion
-from threading import RLock
+from threading import Lock, RLock
 from urllib.parse import urljoin
 
-import psutil
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
 import master.settings as settings
+from master.alerts import AlertEvaluator, describe_incident
+from master.models import DispatchModel, DispatchStatus, JobPriority
 from master.models import JobStatus, JobsModel, JobsExceptionsModel
+from master.models import JobsStatsModel
 from master.models import NodesModel, NodesExceptionsModel
 from master.models import ProjectsModel, SpidersModel
 from master.models import SystemSettingsModel
-from master.utils import get_md5
+from master.health import NodeHealth, HEALTHY, HALF_OPEN, OPEN, retry_delay
+from master.models import db
+from master.placement import parse_strategy, select_node, free_slots
+from master.sampler import PerformanceSampler
+from master.timeseries import tsdb
+from master.utils import get_md5, MultipartFileStream, read_search_line
+
+if settings.AGENT_ENGINE == "asyncio":
+    from master.async_agents import aio_agent
+else:
+    aio_agent = None
 
 LOCK = RLock()  # 线程锁
 
@@ -43,22 +59,90 @@ class ProxySpider(object):
     # http://scrapyd.readthedocs.io/en/stable/api.html
     """
 
-    def __init__(self, host='localhost', port=6800, username=None, password=''):
+    def __init__(self, host='localhost', port=6800, username=None, password='',
+                 pool_size=None, timeouts=None, health=None):
         """
         实例化后的初始化函数
         :param host: 域名
         :param port: 端口
         :param username: 用户
         :param password: 密码
+        :param pool_size: keep-alive连接池大小
+        :param timeouts: 接口超时时间，{action: (connect, read)}
+        :param health: 节点健康状态 NodeHealth
         """
         self._base_url = 'http://{}:{}'.format(host, port)
+        self.health = health
         # 创建认证Authorization
         if username:
             self.auth = HTTPBasicAuth(username, password if password else '')
         else:
             self.auth = None
+        # 节点独享的keep-alive连接池，避免每次请求重建TCP连接
+        self.pool_size = pool_size or settings.SLAVE_POOL_SIZE
+        self.timeouts = dict(settings.SLAVE_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self._adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.auth = self.auth
+        # 请求统计
+        self._stats_lock = Lock()
+        self._requests_num = 0
+        self._failures_num = 0
+        self._timeouts_num = 0
         pass
 
+    def _count(self, requests_num=0, failures_num=0, timeouts_num=0):
+        """累加请求统计（并发调用时线程安全）"""
+        with self._stats_lock:
+            self._requests_num += requests_num
+            self._failures_num += failures_num
+            self._timeouts_num += timeouts_num
+        pass
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+        pass
+
+    @property
+    def pool_stats(self):
+        """
+        连接池统计，reused即复用已有连接的请求数
+        :return: {}
+        """
+        connections_num = requests_num = idle_num = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections_num += pool.num_connections
+            requests_num += pool.num_requests
+            idle_num += pool.pool.qsize() if pool.pool else 0
+        return {
+            "pool_size": self.pool_size,
+            "requests": self._requests_num,
+            "failures": self._failures_num,
+            "timeouts": self._timeouts_num,
+            "connections": connections_num,
+            "reused": max(requests_num - connections_num, 0),
+            "reuse_rate": round(
+                1 - connections_num / requests_num, 4) if requests_num else 0,
+            "idle": idle_num,
+        }
+        pass
+
+    def get_timeout(self, action):
+        """
+        获取接口超时时间
+        :param action: 链接动作
+        :return: (connect, read)
+        """
+        return self.timeouts.get(action, self.timeouts.get("default"))
+
     @staticmethod
     def __check_data(json_data):
         """
@@ -77,28 +161,49 @@ class ProxySpider(object):
         :param action: 链接动作
         :param method: 请求方法 get/post
         :param retries: 重试次数
-        :param kwargs: 请求参数 params/data/json/headers/cookies/auth/timeout
+        :param kwargs: 请求参数 params/data/json/headers/cookies/timeout
                                 /proxies/verify
         :return: requests.Response.json()
         """
 
         url = urljoin(self._base_url, action)
-        kwargs["auth"] = self.auth  # 增加请求验证信息
+        if method not in ('get', 'post'):
+            raise ValueError('Unsupported request method:{}'.format(method))
+        kwargs.setdefault("timeout", self.get_timeout(action))
+        health = self.health
+        if health is not None:
+            # 熔断中的节点直接失败，不再发起请求
+            if not health.allow():
+                logging.debug('request rejected, node is {}: {}'.format(
+                    health.state, url))
+                return None
+            retries = health.retries or retries
+        error = None
         for i in range(retries):
+            if i:
+                time.sleep(retry_delay(i - 1))  # 抖动退避，避免连续重试
+            self._count(requests_num=1)
+            if hasattr(kwargs.get("data"), "seek"):
+                kwargs["data"].seek(0)  # 流式请求体，重试前回到开头
             try:
-                if method == 'get':
-                    with requests.get(url, **kwargs) as response:
-                        return response.json()
-                elif method == 'post':
-                    with requests.post(url, **kwargs) as response:
-                        return response.json()
-                else:
-                    raise ValueError(
-                        'Unsupported request method:{}'.format(method))
+                with self.session.request(method, url, **kwargs) as response:
+                    json_data = response.json()
+                if health is not None:
+                    health.record_success()
+                return json_data
+            except requests.Timeout as e:
+                error = e
+                self._count(failures_num=1, timeouts_num=1)
+                logging.warning('request timeout:{}=>{}, retry {}'.format(
+                    type(e), e, url))
             except Exception as e:
+                error = e
+                self._count(failures_num=1)
                 logging.warning('request error:{}=>{}, retry {}'.format(
                     type(e), e, url))
                 # print(traceback.format_exc())
+        if health is not None:
+            health.record_failure('{}: {}'.format(type(error).__name__, error))
         pass
 
     # 检查节点状态
@@ -155,6 +260,63 @@ class ProxySpider(object):
         return []
         pass
 
+    # 获取节点快照
+    def get_node_snapshot(self, since=None, history_since=None,
+                          history_step=None):
+        """
+        获取节点快照：负载状态、全部项目任务、性能指标及EGG摘要清单
+        curl http://localhost:6800/node_snapshot.json
+        :param since: 任务变更游标，指定时以增量变更代替全部任务列表
+        :param history_since: 性能指标历史游标，指定时附带该时间后的历史
+        :param history_step: 性能指标历史聚合间隔，单位：秒
+        :return: 快照字典，请求失败时返回None
+        """
+        action = "node_snapshot.json"
+        params = {}
+        if since is not None:
+            params['since'] = since
+        if history_since is not None:
+            params['history_since'] = history_since
+            if history_step:
+                params['history_step'] = history_step
+        json_data = self.__retry_request(action, params=params)
+        return json_data if self.__check_data(json_data) else None
+
+    # 获取任务状态变更
+    def get_job_changes(self, since=None, limit=1000):
+        """
+        获取任务状态变更
+        curl http://localhost:6800/job_changes.json?since=41
+        {"status": "ok", "changes": [{"seq": 42, "job": "...",
+            "state": "running", ...}], "seq": 42, "last_seq": 42,
+            "epoch": "...", "reset": false}
+        :param since: 任务变更游标，未指定时仅返回当前游标
+        :param limit: 单次返回变更数上限
+        :return: 变更字典，请求失败时返回None
+        """
+        action = "job_changes.json"
+        params = {'since': since, 'limit': limit} if since is not None \
+            else None
+        json_data = self.__retry_request(action, params=params)
+        return json_data if self.__check_data(json_data) else None
+
+    # 获取节点EGG摘要清单
+    def get_list_manifest(self, project_name=None):
+        """
+        获取节点EGG摘要清单
+        curl http://localhost:6800/list_manifest.json
+        {"status": "ok", "manifest": [{"project": "myProject",
+            "version": "r99", "sha256": "9f86d08...", "size": 10240}]}
+        :param project_name: 项目名称，默认全部项目
+        :return: 清单列表，请求失败时返回None
+        """
+        action = "list_manifest.json"
+        params = {'project': project_name} if project_name else None
+        json_data = self.__retry_request(action, params=params)
+        if self.__check_data(json_data):
+            return json_data.get('manifest', [])
+        return None
+
     # 获取项目爬虫列表
     def get_list_spiders(self, project_name):
         """
@@ -252,6 +414,23 @@ class ProxySpider(object):
         json_data = self.__retry_request(action, method='post', data=data)
         return json_data.get('job') if self.__check_data(json_data) else None
 
+    # 批量启动爬虫
+    def start_spiders(self, jobs):
+        """
+        批量启动爬虫，一次请求
+        curl http://localhost:6800/schedule_batch.json -H "Content-Type: application/json" -d '{"jobs": [{"project": "my", "spider": "some"}]}'
+        {"status": "ok", "jobs": ["6487ec79..."], "errors": []}
+        :param jobs: [{"project", "spider", "job", "_version", "setting",
+                       ...爬虫参数}]
+        :return: [job_id]，与jobs顺序一致，启动失败为None
+        """
+        action = "schedule_batch.json"
+        json_data = self.__retry_request(
+            action, method='post', json={"jobs": jobs})
+        if self.__check_data(json_data):
+            return json_data.get('jobs', [])
+        return [None] * len(jobs)
+
     # 终止爬虫
     def cancel_spider(self, project_name, job_id):
         """
@@ -271,38 +450,70 @@ class ProxySpider(object):
         return True if self.__check_data(json_data) else False
 
     # 部署项目
-    def deploy_project(self, egg_data, project_name, version_name=None):
+    def deploy_project(self, egg_path, project_name, version_name=None):
         """
         Add a version to a project, creating the project if it does not exist.
         curl http://localhost:6800/addversion.json -F project=my -F version=r23 -F egg=@myproject.egg
         {"status": "ok", "spiders": 3}
-        :param egg_data: EGG文件数据
+        :param egg_path: EGG文件路径
         :param project_name: 项目名称
         :param version_name: 版本名称
         :return:
         """
+        report = self.deploy_egg(egg_path, project_name, version_name)
+        return report.get("status") == "ok"
+
+    # 流式发布EGG文件
+    def deploy_egg(self, egg_path, project_name, version_name=None):
+        """
+        流式发布EGG文件，文件按块从磁盘读取后以multipart发送
+        :param egg_path: EGG文件路径
+        :param project_name: 项目名称
+        :param version_name: 版本名称
+        :return: {"status": "ok"/"error", "spiders": 爬虫数,
+                  "elapsed": 耗时（秒）, "message": 错误信息}
+        """
         action = "add_version.json"
-        data = {
-            'project': project_name,
-            'version': version_name if version_name else str(int(time.time())),
-            'egg': egg_data,
+        version_name = version_name if version_name else str(int(time.time()))
+        start_time = time.time()
+        body = MultipartFileStream(
+            {'project': project_name, 'version': version_name},
+            'egg', egg_path, file_name='{}.egg'.format(project_name))
+        try:
+            json_data = self.__retry_request(
+                action, method='post', retries=3, data=body,
+                headers={'Content-Type': body.content_type})
+        finally:
+            body.close()
+        report = {
+            "status": "error",
+            "spiders": 0,
+            "elapsed": round(time.time() - start_time, 3),
+            "message": "",
         }
-        json_data = self.__retry_request(action, method='post', data=data)
-        return True if self.__check_data(json_data) else False
+        if self.__check_data(json_data):
+            report["status"] = "ok"
+            report["spiders"] = json_data.get("spiders", 0)
+        elif isinstance(json_data, dict):
+            report["message"] = json_data.get("message", "")
+        else:
+            report["message"] = "no response"
+        return report
 
-    def get_job_exception(self, project_name, spider_name, job_id, offset=0):
-        action = "job_exception.json"
-        params = {
-            "project": project_name,
-            "spider": spider_name,
-            "job": job_id,
-            "offset": offset,
-        }
-        json_data = self.__retry_request(action, method='post', params=params)
+    def get_jobs_exception(self, jobs):
+        """
+        批量检索任务异常，一次请求
+        :param jobs: [{"project", "spider", "job", "offset"}]
+        :return: [(whence, eof, errors)]，与jobs顺序一致，失败为None
+        """
+        action = "job_exceptions_batch.json"
+        json_data = self.__retry_request(
+            action, method='post', json={"jobs": jobs})
         if self.__check_data(json_data):
-            return json_data.get('whence', 0), json_data.get('errors', [])
-        return 0, []
-        pass
+            return [(r["whence"], r["eof"], r["errors"]) if (
+                r and "whence" in r) else None
+                for r in json_data.get('results', [])]
+        return [None] * len(jobs)
 
     def get_sys_performance(self):
         action = "sys_performance.json"
@@ -312,6 +523,56 @@ class ProxySpider(object):
         return []
         pass
 
+    # 获取性能指标历史
+    def get_sys_performance_history(self, since=None, step=None):
+        """
+        获取节点保留的性能指标历史（每秒一个采样）
+        curl http://localhost:6800/sys_performance_history.json?since=0&step=5
+        :param since: 时间戳，只返回该时间之后的采样
+        :param step: 聚合间隔，单位：秒
+        :return: {"times": [], "samples": {metric: []}}，请求失败时返回None
+        """
+        action = "sys_performance_history.json"
+        params = {k: v for k, v in (('since', since), ('step', step))
+                  if v is not None}
+        json_data = self.__retry_request(action, params=params)
+        return json_data if self.__check_data(json_data) else None
+
+    # 跨任务检索运行日志
+    def search_logs(self, params):
+        """
+        跨任务检索运行日志，节点按行返回NDJSON，逐行读取
+        curl http://localhost:6800/search_logs.json -d project=my -d pattern=Traceback -d literal=1
+        :param params: 检索参数 pattern/literal/ignore_case/project/spider/
+                       since/until/limit
+        :return: {"matches": [{"project", "spider", "job", "line", "offset",
+                  "text"}], "summary": {"logs", "searched", "matches",
+                  "truncated"}}，请求失败时返回None
+        """
+        action = "search_logs.json"
+        url = urljoin(self._base_url, action)
+        health = self.health
+        if health is not None and not health.allow():
+            return None
+        self._count(requests_num=1)
+        result = {"matches": [], "summary": None}
+        try:
+            with self.session.post(
+                    url, data=params, stream=True,
+                    timeout=self.get_timeout(action)) as response:
+                for line in response.iter_lines():
+                    read_search_line(result, line)
+        except Exception as e:
+            self._count(failures_num=1)
+            logging.warning('search logs error:{}=>{}, {}'.format(
+                type(e), e, url))
+            if health is not None:
+                health.record_failure('{}: {}'.format(type(e).__name__, e))
+            return None
+        if health is not None:
+            health.record_success()
+        return result
+
     # 运行日志网络路径
     def log_url(self, project_name, spider_name, job_id):
         """
@@ -324,6 +585,62 @@ class ProxySpider(object):
         return self._base_url + '/logs/%s/%s/%s.log' % (
             project_name, spider_name, job_id)
 
+    def read_log(self, project_name, spider_name, job_id, start=0,
+                 length=None, tail=None):
+        """
+        按字节范围读取运行日志（HTTP Range），内存占用不超过窗口大小
+        curl -H "Range: bytes=0-1023" http://localhost:6800/logs/my/some/6487.log
+        :param project_name: 项目名称
+        :param spider_name: 爬虫名称
+        :param job_id: 爬虫运行ID
+        :param start: 开始字节
+        :param length: 读取字节数，默认LOG_WINDOW_SIZE
+        :param tail: 读取最后tail字节，指定时忽略start
+        :return: {"data": bytes, "start": 0, "end": 1024, "size": 4096}，
+                 end为下次读取的开始字节；失败时返回None
+        """
+        length = min(length or settings.LOG_WINDOW_SIZE,
+                     settings.LOG_WINDOW_MAX)
+        if tail:
+            tail = min(tail, settings.LOG_WINDOW_MAX)
+            byte_range = 'bytes=-{}'.format(tail)
+        else:
+            start = max(int(start or 0), 0)
+            byte_range = 'bytes={}-{}'.format(start, start + length - 1)
+        url = self.log_url(project_name, spider_name, job_id)
+        try:
+            with self.session.get(
+                    url, headers={'Range': byte_range}, stream=True,
+                    timeout=self.get_timeout("logs")) as response:
+                content_range = response.headers.get('Content-Range', '')
+                match = re.match(
+                    r'bytes (?:(\d+)-(\d+)|\*)/(\d+)', content_range)
+                if response.status_code == 416 and match:
+                    # 开始字节超出文件大小，暂无新内容
+                    size = int(match.group(3))
+                    return {"data": b'', "start": min(start, size),
+                            "end": min(start, size), "size": size}
+                if response.status_code == 206 and match and match.group(1):
+                    start, size = int(match.group(1)), int(match.group(3))
+                elif response.status_code == 200:
+                    # 不支持Range时只读取窗口内的字节
+                    start = 0
+                    size = int(response.headers.get('Content-Length', 0))
+                else:
+                    return None
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data.extend(chunk)
+                    if len(data) >= (tail or length):
+                        break
+                data = bytes(data[:tail or length])
+        except Exception as e:
+            logging.warning('read log error:{}=>{}, {}'.format(
+                type(e), e, url))
+            return None
+        return {"data": data, "start": start, "end": start + len(data),
+                "size": max(size, start + len(data))}
+
     pass
 
 
@@ -331,6 +648,7 @@ class FilesystemEggStorage(object):
 
     def __init__(self, eggs_dir="eggs"):
         self.basedir = eggs_dir
+        self._digests = {}  # {egg_path: (mtime, size, sha256)}
 
     @property
     def projects(self):
@@ -352,6 +670,14 @@ class FilesystemEggStorage(object):
                 return None, None
         return version, open(self._egg_path(project, version), 'rb')
 
+    def get_path(self, project, version=None):
+        if version is None:
+            try:
+                version = self.list(project)[-1]
+            except IndexError:
+                return None, None
+        return version, self._egg_path(project, version)
+
     def list(self, project):
         egg_dir = os.path.join(self.basedir, project)
         versions = [os.path.splitext(os.path.basename(x))[0] for x in
@@ -366,6 +692,27 @@ class FilesystemEggStorage(object):
             if not self.list(project):  # remove project if no versions left
                 self.delete(project)
 
+    def digest(self, project, version):
+        """
+        EGG文件sha256摘要，按文件mtime/size缓存，文件未变化时不重新读取
+        :return: sha256，文件不存在时返回None
+        """
+        egg_path = self._egg_path(project, version)
+        try:
+            stat = os.stat(egg_path)
+        except OSError:
+            return None
+        cached = self._digests.get(egg_path)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        sha256 = hashlib.sha256()
+        with open(egg_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha256.update(chunk)
+        self._digests[egg_path] = (
+            stat.st_mtime, stat.st_size, sha256.hexdigest())
+        return sha256.hexdigest()
+
     def _egg_path(self, project, version):
         sanitized_version = re.sub(r'[^a-zA-Z0-9_-]', '_', version)
         x = os.path.join(self.basedir, project, "%s.egg" % sanitized_version)
@@ -386,19 +733,29 @@ class SpiderAgent(object):
         self.proxies = {}  # 节点代理字典
         self.slaves = {}  # 节点字典
         self.projects = {}  # 项目字典
-
-        # system performance indicators
-        self.disk_io_read_speed = None
-        self.disk_io_write_speed = None
-        self.net_io_sent_speed = None
-        self.net_io_receive_speed = None
-        self._last_time = None
-        # Disk I/O
-        self._last_disk_io_read_bytes = None
-        self._last_disk_io_write_bytes = None
-        # Net I/O
-        self._last_net_io_sent_bytes = None
-        self._last_net_io_receive_bytes = None
+        self.performances = {}  # 节点性能指标缓存 {host_port: (time, {})}
+        self.history_cursors = {}  # 节点性能指标历史游标 {host_port: time}
+        self.job_cursors = {}  # 节点任务变更游标 {host_port: (epoch, seq)}
+        self._jobs_lock = RLock()  # 轮询与推送并发写入任务变更
+        self._dispatching = set()  # 启动请求中的运行请求 {vc_md5}
+        self.healths = {}  # 节点健康状态 {host_port: NodeHealth}
+        self.alerts = AlertEvaluator()  # 节点性能告警状态
+        self._transitions = []  # 待写入数据库的健康状态变化
+        self._transitions_lock = Lock()
+        # 节点请求线程池，并发请求各节点，数据库写入仍在调用线程
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.SLAVE_CONCURRENCY,
+            thread_name_prefix="SpiderAgent")
+        # 后台任务（例如项目发布），按提交顺序保存
+        self.task_executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="SpiderTask")
+        self.tasks = OrderedDict()
+        self._tasks_lock = Lock()
+
+        # 主节点性能指标采样，后台线程按固定间隔生成只读快照
+        self.sampler = PerformanceSampler(
+            settings.SAMPLER_INTERVAL,
+            on_sample=lambda t, snapshot: tsdb.add("Master", snapshot, t))
         pass
 
     def register(self):
@@ -434,8 +791,66 @@ class SpiderAgent(object):
             )
         pass
 
+    def get_instances(self, *host_ports, alive=True):
+        """
+        获取节点代理实例
+        :param host_ports: 节点地址，默认全部节点
+        :param alive: 是否仅返回状态正常的节点
+        :return: {host_port: ProxySpider}
+        """
+        instances = {}
+        for host_port, proxies_detail in list(self.proxies.items()):
+            if host_ports and host_port not in host_ports:
+                continue
+            if alive and not proxies_detail.get("status"):
+                continue
+            instance = proxies_detail.get("instance")
+            if isinstance(instance, ProxySpider):
+                instances[host_port] = instance
+        return instances
+        pass
+
+    def fan_out(self, method, calls, limit=None):
+        """
+        并发调用各节点代理方法，等待全部完成后返回结果
+        耗时取决于最慢的节点，而非节点数量；结果在调用线程中合并
+        :param method: ProxySpider方法名
+        :param calls: {key: (host_port, args, kwargs)}
+        :param limit: 本次调用的并发节点数上限，默认使用共享线程池
+        :return: {key: result}，调用失败的结果为None
+        """
+        if aio_agent is not None:
+            # asyncio引擎：由事件循环线程并发完成全部请求
+            return aio_agent.fan_out(method, calls, limit)
+        # 限定并发时使用独立线程池，避免长耗时请求占满共享线程池
+        executor = ThreadPoolExecutor(
+            max_workers=limit,
+            thread_name_prefix="SpiderAgentLimited") if limit else self.executor
+        futures = {}
+        for key, (host_port, args, kwargs) in calls.items():
+            instance = self.proxies.get(host_port, {}).get("instance")
+            if not isinstance(instance, ProxySpider):
+                continue
+            futures[key] = executor.submit(
+                getattr(instance, method), *args, **kwargs)
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                logging.warning('fan out error:{}=>{}, {} {}'.format(
+                    type(e), e, method, key))
+                results[key] = None
+        if executor is not self.executor:
+            executor.shutdown(wait=False)
+        return results
+        pass
+
     def get_salve_performance(self, host_port):
-        """获取从节点性能指数"""
+        """获取从节点性能指数，优先使用节点快照中的缓存"""
+        cached_time, performance = self.performances.get(host_port, (0, {}))
+        if time.time() - cached_time < settings.SNAPSHOT_CACHE_SECONDS:
+            return performance
         proxies_detail = self.proxies.get(host_port, {})
         if proxies_detail.get("status"):
             instance = proxies_detail.get("instance")
@@ -444,59 +859,132 @@ class SpiderAgent(object):
         return {}
         pass
 
-    def get_master_performance(self):
-        """获取主节点性能指数"""
+    def get_pool_stats(self):
+        """获取各节点连接池统计"""
         return {
-            'cpu': psutil.cpu_percent(),
-            'virtual_memory': psutil.virtual_memory().percent,
-            'swap_memory': psutil.swap_memory().percent,
-            'disk_usage': psutil.disk_usage('/').percent,
-            'disk_io_read': self.disk_io_read_speed,
-            'disk_io_write': self.disk_io_write_speed,
-            'net_io_sent': self.net_io_sent_speed,
-            'net_io_receive': self.net_io_receive_speed,
+            host_port: proxies_detail["instance"].pool_stats
+            for host_port, proxies_detail in self.proxies.items()
+            if isinstance(proxies_detail.get("instance"), ProxySpider)
         }
         pass
 
+    def get_health(self):
+        """获取各节点健康状态"""
+        return {host_port: health.to_dict()
+                for host_port, health in list(self.healths.items())}
+        pass
+
+    def _on_health_transition(self, transition):
+        """
+        节点健康状态变化回调，可能在任意请求线程中调用，仅暂存
+        首次熔断及熔断后恢复写入节点异常，用于发现抖动节点
+        """
+        to_state, from_state = transition["to"], transition["from"]
+        if (to_state == OPEN and transition["opens"] == 1) or (
+                to_state == HEALTHY and from_state == HALF_OPEN):
+            with self._transitions_lock:
+                self._transitions.append(transition)
+        pass
+
+    def flush_health_transitions(self):
+        """将暂存的健康状态变化写入节点异常"""
+        with self._transitions_lock:
+            transitions, self._transitions = self._transitions, []
+        NodesExceptionsModel.merge_many([dict(
+            host_port=t["host_port"],
+            node_type="slave",
+            exc_time=datetime.datetime.fromtimestamp(int(t["time"])),
+            exc_key="{}->{}".format(t["from"], t["to"]),
+            exc_level="WARNING" if t["to"] == OPEN else "INFO",
+            exc_message="Health state changed {} -> {}: {}".format(
+                t["from"], t["to"], t["reason"])
+        ) for t in transitions])
+        pass
+
+    def get_master_performance(self):
+        """获取主节点性能指数（最新采样快照，只读）"""
+        return self.sampler.latest()
+
     def get_default_version(self, project_name):
         versions = self.egg_storage.list(project_name)
         return str(versions[0]) if versions else None
         pass
 
-    def poll_system_performance(self):
+    def get_loads(self, *host_ports):
         """
-        轮询函数，计算本地磁盘IO读写速度及网络IO收发速度
-        :return:
+        获取可运行任务的节点负载（状态正常且未熔断）
+        :param host_ports: 节点地址，默认全部节点
+        :return: {host_port: {pending, running, max_proc, free_slots, cpu,
+                              virtual_memory}}
         """
-        curr_time = time.time()  # 当前时间
-        disk_io = psutil.disk_io_counters()  # 磁盘IO状态
-        net_io = psutil.net_io_counters()  # 网络IO状态
-
-        timedelta = curr_time - self._last_time if self._last_time else None
-        if timedelta:
-            # 分母 单位：KB/s
-            denominator = 1024 * timedelta
-            read_bytes = disk_io.read_bytes - self._last_disk_io_read_bytes
-            write_bytes = disk_io.write_bytes - self._last_disk_io_write_bytes
-            self.disk_io_read_speed = round(read_bytes / denominator, 2)
-            self.disk_io_write_speed = round(write_bytes / denominator, 2)
-            # 分母 单位：Kb/s
-            denominator = 1000 * timedelta
-            sent_bytes = net_io.bytes_sent - self._last_net_io_sent_bytes
-            receive_bytes = net_io.bytes_recv - self._last_net_io_receive_bytes
-            self.net_io_sent_speed = round(sent_bytes / denominator, 2)
-            self.net_io_receive_speed = round(receive_bytes / denominator, 2)
+        loads = {}
+        for host_port, proxies_detail in list(self.proxies.items()):
+            if host_ports and host_port not in host_ports:
+                continue
+            if not proxies_detail.get("status"):
+                continue
+            health = self.healths.get(host_port)
+            if health is not None and health.state == OPEN:
+                continue
+            load = dict(proxies_detail.get("load") or {})
+            performance = self.performances.get(host_port, (0, {}))[1]
+            load["cpu"] = performance.get("cpu")
+            load["virtual_memory"] = performance.get("virtual_memory")
+            loads[host_port] = load
+        return loads
+        pass
 
-        self._last_time = curr_time
-        self._last_disk_io_read_bytes = disk_io.read_bytes
-        self._last_disk_io_write_bytes = disk_io.write_bytes
-        self._last_net_io_sent_bytes = net_io.bytes_sent
-        self._last_net_io_receive_bytes = net_io.bytes_recv
+    def load_balance(self, strategy=None, *host_ports):
+        """
+        负载均衡函数，按策略选择运行节点
+        选中后先在本地计入一个等待任务，同一轮内连续启动的任务不会集中到同一节点
+        :param strategy: 策略名称，见placement.py
+        :param host_ports: 候选节点地址，默认全部节点
+        :return: host_port，无可用节点时返回None
+        """
+        with LOCK:
+            host_port = select_node(self.get_loads(*host_ports), strategy)
+            self._reserve_slot(host_port)
+        return host_port
+        pass
 
+    def _reserve_slot(self, host_port):
+        """在本地负载缓存中计入一个等待任务，下一次快照时以节点数据为准"""
+        load = self.proxies.get(host_port, {}).get("load")
+        if load is not None:
+            load["pending"] = (load.get("pending") or 0) + 1
+            if load.get("free_slots"):
+                load["free_slots"] -= 1
         pass
 
-    def load_balance(self):
-        """负载均衡函数"""
+    def _update_load(self, host_port, rows):
+        """
+        按任务变更调整本地负载缓存，任务结束即释放空闲进程，无需等待下一次快照
+        等待中的任务在分配时已计入，pending变更不再重复计数
+        :param host_port: 节点地址
+        :param rows: 任务变更数据项 [{"job_status": ...}]
+        :return:
+        """
+        load = self.proxies.get(host_port, {}).get("load")
+        if not load:
+            return
+        with LOCK:
+            pending = load.get("pending") or 0
+            running = load.get("running") or 0
+            for row in rows:
+                job_status = row.get("job_status")
+                if job_status == JobStatus.RUNNING.value:
+                    pending, running = pending - 1, running + 1
+                elif job_status in (JobStatus.FINISHED.value,
+                                    JobStatus.CANCELED.value):
+                    if running > 0:
+                        running -= 1
+                    else:
+                        pending -= 1
+            load["pending"], load["running"] = max(pending, 0), running
+            if load.get("max_proc"):
+                load["free_slots"] = max(
+                    load["max_proc"] - load["running"] - load["pending"], 0)
         pass
 
     def set_slaves_value(self, slave_name, project_name=None, *version_names):
@@ -539,17 +1027,28 @@ class SpiderAgent(object):
         :return:
         """
         host, port = host_port.split(":")
+        # 修改节点时保留健康状态
+        health = self.healths.get(host_port)
+        if health is None:
+            health = NodeHealth(
+                host_port, on_transition=self._on_health_transition)
+            self.healths[host_port] = health
         # 创建爬虫代理操作实例
-        instance = ProxySpider(
-            host=host, port=port, username=username, password=password)
+        instance = ProxySpider(host=host, port=port, username=username,
+                               password=password, health=health)
         slave_name = host_port
         if host_port in self.proxies:
+            old_instance = self.proxies[host_port].get("instance")
+            if isinstance(old_instance, ProxySpider):
+                old_instance.close()
             self.proxies[host_port]["instance"] = instance
         else:
             self.proxies[host_port] = {
                 "status": False,
                 "instance": instance,
             }
+        if aio_agent is not None:
+            aio_agent.merge_client(host_port, username, password, health)
         self.set_slaves_value(slave_name)
         pass
 
@@ -562,8 +1061,18 @@ class SpiderAgent(object):
         """
         slave_name = host_port
         self.del_slaves_value(slave_name)
+        self.job_cursors.pop(host_port, None)
+        self.performances.pop(host_port, None)
+        self.history_cursors.pop(host_port, None)
+        self.healths.pop(host_port, None)
+        tsdb.drop(host_port)
+        self.alerts.drop(host_port)
         if slave_name in self.proxies:
-            del self.proxies[slave_name]
+            instance = self.proxies.pop(slave_name).get("instance")
+            if isinstance(instance, ProxySpider):
+                instance.close()
+        if aio_agent is not None:
+            aio_agent.delete_client(host_port)
         pass
 
     # 发布项目
@@ -573,26 +1082,63 @@ class SpiderAgent(object):
         :param egg_file: 蛇蛋文件
         :param project_name: 项目名称
         :param version_name: 版本名称，默认时间戳
-        :return:
+        :return: 发布报告，见publish_project
+        """
+        version_name = version_name if version_name else str(int(time.time()))
+        self.egg_storage.put(egg_file, project_name, version_name)
+        return self.publish_project(project_name, version_name)
+        pass
+
+    # 后台发布项目
+    def submit_deploy(self, egg_file, project_name, version_name=None):
+        """
+        保存蛇蛋文件后在后台发布项目，立即返回任务ID
+        :param egg_file: 蛇蛋文件
+        :param project_name: 项目名称
+        :param version_name: 版本名称，默认时间戳
+        :return: task_id
         """
         version_name = version_name if version_name else str(int(time.time()))
         self.egg_storage.put(egg_file, project_name, version_name)
-        _, egg_file = self.egg_storage.get(project_name, version_name)
+        return self.submit_task(
+            "deploy", self.publish_project, project_name, version_name)
+        pass
+
+    # 发布已保存的项目版本至全部节点
+    def publish_project(self, project_name, version_name):
+        """
+        并发流式发布已保存的项目版本至全部正常节点
+        :param project_name: 项目名称
+        :param version_name: 版本名称
+        :return: {
+            "project_name": 项目名称,
+            "version_name": 版本名称,
+            "spiders": 爬虫列表,
+            "nodes": {host_port: {"status", "spiders", "elapsed", "message"}}
+        }
+        """
+        _, egg_path = self.egg_storage.get_path(project_name, version_name)
         versions = self.egg_storage.list(project_name)  # 版本列表
-        with egg_file as f:  # with open(file_path, 'rb') as f:
-            egg_data = f.read()
+        instances = self.get_instances()
+        reports = self.fan_out("deploy_egg", {
+            slave_name: (slave_name, (egg_path, project_name, version_name), {})
+            for slave_name in instances}, limit=settings.DEPLOY_CONCURRENCY)
         spiders = []  # 爬虫列表
-        for slave_name, proxies_detail in self.proxies.items():
-            if not proxies_detail.get("status"):
+        for slave_name in instances:
+            report = reports.get(slave_name)
+            if not report:
+                reports[slave_name] = {
+                    "status": "error",
+                    "spiders": 0,
+                    "elapsed": 0,
+                    "message": "deploy request failed",
+                }
                 continue
-            instance = proxies_detail.get("instance")
-            if not isinstance(instance, ProxySpider):
+            if report.get("status") != "ok":
                 continue
-            flag = instance.deploy_project(egg_data, project_name, version_name)
-            if flag:
-                self.set_slaves_value(slave_name, project_name, version_name)
+            self.set_slaves_value(slave_name, project_name, version_name)
             if not spiders:
-                spiders = instance.get_list_spiders(project_name)
+                spiders = instances[slave_name].get_list_spiders(project_name)
             pass
 
         default_version = versions[0]  # 默认版本
@@ -605,7 +1151,69 @@ class SpiderAgent(object):
             versions=json.dumps(versions),
         )
         SpidersModel.sync_spiders(project_name, default_version, *spiders)
-        return True
+        return {
+            "project_name": project_name,
+            "version_name": version_name,
+            "spiders": spiders,
+            "nodes": reports,
+        }
+        pass
+
+    # 提交后台任务
+    def submit_task(self, task_type, func, *args, **kwargs):
+        """
+        提交后台任务，任务状态可通过get_task查询
+        :param task_type: 任务类型，例如"deploy"
+        :param func: 任务函数
+        :return: task_id
+        """
+        task_id = uuid.uuid4().hex
+        task = {
+            "task_id": task_id,
+            "task_type": task_type,
+            "status": "pending",  # pending/running/finished/failed
+            "result": None,
+            "message": "",
+            "submit_time": time.time(),
+            "start_time": None,
+            "end_time": None,
+        }
+
+        def run_task():
+            task["status"] = "running"
+            task["start_time"] = time.time()
+            try:
+                task["result"] = func(*args, **kwargs)
+                task["status"] = "finished"
+            except Exception as e:
+                task["status"] = "failed"
+                task["message"] = '{}=>{}'.format(type(e), e)
+                logging.error(traceback.format_exc())
+            finally:
+                task["end_time"] = time.time()
+                db.session.remove()  # 释放后台线程的数据库会话
+            pass
+
+        with self._tasks_lock:
+            self.tasks[task_id] = task
+            # 仅保留最近的已结束任务
+            ended = [k for k, v in self.tasks.items()
+                     if v["status"] in ("finished", "failed")]
+            for key in ended[:max(len(ended) - settings.TASKS_KEEP, 0)]:
+                self.tasks.pop(key, None)
+        self.task_executor.submit(run_task)
+        return task_id
+        pass
+
+    # 查询后台任务
+    def get_task(self, task_id):
+        """
+        查询后台任务
+        :param task_id: 任务ID
+        :return: 任务状态字典，不存在时返回None
+        """
+        task = self.tasks.get(task_id)
+        return dict(task) if task else None
         pass
 
     # 删除项目
@@ -657,25 +1265,12 @@ class SpiderAgent(object):
     def start_spider(self, project_name, spider_name,
                      version_name=None, exec_args=None,
                      host_port=None, plan_name=None, **kwargs):
-        # 爬虫运行参数
-        arguments = defaultdict(list)
-        if kwargs.get("spider_setting"):
-            arguments["setting"] = kwargs.get("spider_setting")
-        if kwargs.get("job_id"):
-            arguments["job"] = kwargs.get("job_id")
-        if not version_name:
-            version_name = self.get_default_version(project_name)
-        if version_name:
-            arguments["_version"] = version_name
-        if exec_args:
-            for k, v in list(map(
-                    lambda x: x.split('=', 1), exec_args.split(','))):
-                arguments[k].append(v)
-        # 选择运行节点
-        client_list = [k for k, v in self.proxies.items() if v.get("status")]
-        if client_list and (not host_port or host_port == "auto"
-                            or host_port not in client_list):
-            host_port = random.choice(client_list)
+        version_name, arguments = self._spider_arguments(
+            project_name, version_name, exec_args, **kwargs)
+        # 选择运行节点：auto[:strategy]或指定节点不可用时按负载选择
+        strategy = parse_strategy(host_port)
+        if strategy or not self.proxies.get(host_port, {}).get("status"):
+            host_port = self.load_balance(strategy)
         if not host_port:
             return
         instance = self.proxies.get(host_port, {}).get("instance")
@@ -683,6 +1278,8 @@ class SpiderAgent(object):
             return
         # 运行爬虫
         job_id = instance.start_spider(project_name, spider_name, **arguments)
+        if not job_id:
+            return
         JobsModel.merge_one(
             plan_name=plan_name,
             host_port=host_port,
@@ -690,12 +1287,217 @@ class SpiderAgent(object):
             version_name=version_name,
             spider_name=spider_name,
             job_id=job_id,
-            create_time=datetime.datetime.now(),
+            create_time=kwargs.get("create_time") or datetime.datetime.now(),
             job_status=JobStatus.PENDING.value,
         )
         return job_id
         pass
 
+    def _spider_arguments(self, project_name, version_name=None,
+                          exec_args=None, **kwargs):
+        """
+        爬虫运行参数
+        :return: (version_name, {name: [value]})
+        """
+        arguments = defaultdict(list)
+        if kwargs.get("spider_setting"):
+            arguments["setting"] = kwargs.get("spider_setting")
+        if kwargs.get("job_id"):
+            arguments["job"] = kwargs.get("job_id")
+        if not version_name:
+            version_name = self.get_default_version(project_name)
+        if version_name:
+            arguments["_version"] = version_name
+        if exec_args:
+            for k, v in list(map(
+                    lambda x: x.split('=', 1), exec_args.split(','))):
+                arguments[k].append(v)
+        return version_name, arguments
+        pass
+
+    # 批量启动爬虫
+    def start_spiders(self, items):
+        """
+        批量启动爬虫，每个节点只请求一次schedule_batch.json
+        :param items: [{project_name, spider_name, host_port, version_name,
+                        exec_args, plan_name, job_id, create_time}]，
+                      host_port须为具体节点
+        :return: [job_id]，与items顺序一致，启动失败为None
+        """
+        batches = defaultdict(list)  # {host_port: [(index, version, job)]}
+        for index, item in enumerate(items):
+            version_name, arguments = self._spider_arguments(
+                item["project_name"], item.get("version_name"),
+                item.get("exec_args"), job_id=item.get("job_id"),
+                spider_setting=item.get("spider_setting"))
+            job = dict(arguments)
+            job.update(project=item["project_name"],
+                       spider=item["spider_name"])
+            batches[item["host_port"]].append((index, version_name, job))
+        results = self.fan_out("start_spiders", {
+            host_port: (host_port, ([job for _, _, job in batch],), {})
+            for host_port, batch in batches.items()})
+        job_ids = [None] * len(items)
+        rows = []
+        now = datetime.datetime.now()
+        for host_port, batch in batches.items():
+            node_job_ids = results.get(host_port) or []
+            for (index, version_name, job), job_id in zip(
+                    batch, node_job_ids):
+                if not job_id:
+                    continue
+                item = items[index]
+                job_ids[index] = job_id
+                rows.append(dict(
+                    plan_name=item.get("plan_name"),
+                    host_port=host_port,
+                    project_name=item["project_name"],
+                    version_name=version_name,
+                    spider_name=item["spider_name"],
+                    job_id=job_id,
+                    create_time=item.get("create_time") or now,
+                    job_status=JobStatus.PENDING.value))
+        JobsModel.merge_many(rows)
+        return job_ids
+        pass
+
+    # 提交运行请求至调度队列
+    def submit_spider(self, project_name, spider_name, version_name=None,
+                      exec_args=None, host_port=None, plan_name=None,
+                      priority=None, **kwargs):
+        """
+        提交运行请求至调度队列，节点有空闲进程时由dispatch_queue启动
+        :param project_name: 项目名称
+        :param spider_name: 爬虫名称
+        :param version_name: 版本名称
+        :param exec_args: 运行参数
+        :param host_port: 节点地址、auto或auto:<strategy>
+        :param plan_name: 计划名称
+        :param priority: 优先级，见JobPriority
+        :return: job_id，启动时使用该作业ID
+        """
+        return self.submit_spiders([dict(
+            project_name=project_name,
+            spider_name=spider_name,
+            version_name=version_name,
+            exec_args=exec_args,
+            host_port=host_port,
+            plan_name=plan_name,
+            priority=priority,
+            job_id=kwargs.get("job_id"),
+        )])[0]
+        pass
+
+    def submit_spiders(self, items):
+        """
+        批量提交运行请求至调度队列，一个事务内写入
+        :param items: [{project_name, spider_name, version_name, exec_args,
+                        host_port, plan_name, priority, job_id}]
+        :return: [job_id]
+        """
+        now = datetime.datetime.now()
+        rows = [dict(
+            job_id=item.get("job_id") or uuid.uuid1().hex,
+            plan_name=item.get("plan_name"),
+            project_name=item["project_name"],
+            version_name=item.get("version_name"),
+            spider_name=item["spider_name"],
+            host_port=item.get("host_port"),
+            exec_args=item.get("exec_args"),
+            priority=item.get("priority") or JobPriority.NORMAL.value,
+            submit_time=now,
+            dispatch_status=DispatchStatus.QUEUED.value,
+            attempts=0,
+        ) for item in items]
+        DispatchModel.merge_many(rows)
+        return [row["job_id"] for row in rows]
+        pass
+
+    # 调度队列分配
+    def dispatch_queue(self):
+        """
+        按优先级、提交时间将排队的运行请求分配至有空闲进程的节点
+        指定节点繁忙时继续排队，指定节点不可用时按默认策略选择节点
+        分配完成后每个节点批量启动一次
+        加锁只用于分配节点、记录结果，启动请求期间不持有LOCK，
+        启动中的运行请求记入self._dispatching，不会被重复分配或取消
+        :return: 本轮启动的运行请求数
+        """
+        with LOCK:
+            loads = self.get_loads()
+            free = {k: free_slots(v) for k, v in loads.items()}
+            if not any(n > 0 for n in free.values()):
+                return 0
+            models, items = [], []
+            for model in DispatchModel.get_queued(
+                    settings.DISPATCH_BATCH_SIZE):
+                if model.vc_md5 in self._dispatching:
+                    continue  # 其他线程启动中
+                candidates = [k for k, n in free.items() if n > 0]
+                if not candidates:
+                    break
+                strategy = parse_strategy(model.host_port)
+                if strategy is None and model.host_port in loads:
+                    if model.host_port not in candidates:
+                        continue  # 指定节点繁忙，继续排队
+                    host_port = model.host_port
+                    self._reserve_slot(host_port)
+                else:
+                    host_port = self.load_balance(strategy, *candidates)
+                free[host_port] -= 1
+                models.append(model)
+                items.append(dict(
+                    project_name=model.project_name,
+                    spider_name=model.spider_name,
+                    version_name=model.version_name,
+                    exec_args=model.exec_args,
+                    host_port=host_port,
+                    plan_name=model.plan_name,
+                    job_id=model.job_id,
+                    create_time=model.submit_time))
+            if not items:
+                return 0
+            self._dispatching.update(model.vc_md5 for model in models)
+        try:
+            job_ids = self.start_spiders(items)
+        except Exception:
+            job_ids = [None] * len(items)
+            logging.exception("dispatch queue start spiders error")
+        with LOCK:
+            now = datetime.datetime.now()
+            for model, item, job_id in zip(models, items, job_ids):
+                self._dispatching.discard(model.vc_md5)
+                host_port = item["host_port"]
+                if job_id:
+                    model.dispatch_status = DispatchStatus.DISPATCHED.value
+                    model.dispatch_host_port = host_port
+                    model.dispatch_time = now
+                    continue
+                model.attempts = (model.attempts or 0) + 1
+                model.message = "start failed on {}".format(host_port)
+                if model.attempts >= settings.DISPATCH_MAX_ATTEMPTS:
+                    model.dispatch_status = DispatchStatus.FAILED.value
+                    model.dispatch_time = now
+            db.session.commit()
+            return len([job_id for job_id in job_ids if job_id])
+        pass
+
+    # 取消排队中的运行请求
+    def cancel_queued(self, vc_md5):
+        with LOCK:
+            if vc_md5 in self._dispatching:
+                return False  # 启动中，结果以节点为准
+            model = DispatchModel.get_first(
+                vc_md5=vc_md5, dispatch_status=DispatchStatus.QUEUED.value)
+            if not model:
+                return False
+            DispatchModel.update_one(
+                model=model,
+                dispatch_status=DispatchStatus.CANCELED.value,
+                dispatch_time=datetime.datetime.now())
+            return True
+        pass
+
     # 终止爬虫
     def cancel_spider(self, host_port, project_name, job_id):
         proxies_detail = self.proxies.get(host_port, {})
@@ -720,183 +1522,457 @@ class SpiderAgent(object):
         return instance.log_url(project_name, spider_name, job_id)
         pass
 
-    # 同步节点状态
-    def sync_slaves_status(self):
+    def read_log(self, host_port, project_name, spider_name, job_id,
+                 **kwargs):
+        """按字节范围读取运行日志，参数见ProxySpider.read_log"""
+        instance = self.proxies.get(host_port, {}).get("instance")
+        if not isinstance(instance, ProxySpider):
+            return
+        return instance.read_log(project_name, spider_name, job_id, **kwargs)
+
+    def search_logs(self, params, host_ports=None):
         """
-        检查运行节点
+        跨节点检索运行日志，并发请求全部正常节点
+        :param params: 检索参数，见ProxySpider.search_logs
+        :param host_ports: 节点地址列表，默认全部节点
+        :return: ([match]，每项附带host_port及日志页execution_id，
+                  {host_port: summary}，请求失败的节点summary为None)
+        """
+        instances = self.get_instances(*(host_ports or ()))
+        results = self.fan_out("search_logs", {
+            host_port: (host_port, (params,), {}) for host_port in instances})
+        matches, summaries = [], {}
+        for host_port in sorted(instances):
+            result = results.get(host_port)
+            summaries[host_port] = result and result["summary"]
+            for match in (result or {}).get("matches", []):
+                match.update(host_port=host_port, execution_id=get_md5(
+                    host_port, match["project"], match["job"]))
+                matches.append(match)
+        return matches, summaries
+
+    def _update_slave_status(self, host_port, daemon_status):
+        """
+        更新节点状态
+        :param host_port: 节点地址
+        :param daemon_status: 节点负载状态，请求失败时为None
         :return:
         """
-        for host_port, proxies_detail in self.proxies.items():
-            instance = proxies_detail.get("instance")
-            if not isinstance(instance, ProxySpider):
+        daemon_status = daemon_status or {}
+        status = daemon_status.get("status", False)
+        if host_port in self.proxies:
+            self.proxies[host_port]["status"] = status
+            self.proxies[host_port]["load"] = {
+                k: daemon_status.get(k) for k in
+                ("pending", "running", "max_proc", "free_slots")}
+        health = self.healths.get(host_port)
+        if status:
+            status_label = '运行正常'
+        elif health is not None and health.state == OPEN:
+            status_label = '熔断'
+        else:
+            status_label = '链接失败'
+        NodesModel.update_one(
+            vc_md5=get_md5(host_port),
+            node_name=daemon_status.get("node_name", False),
+            status=status_label,
+            pending=daemon_status.get("pending"),
+            running=daemon_status.get("running"),
+            finished=daemon_status.get("finished")
+        )
+        pass
+
+    # 同步节点快照
+    def sync_nodes_snapshot(self):
+        """
+        每个节点每轮仅请求一次node_snapshot.json，
+        同时完成节点状态、任务状态、性能指标缓存及项目部署对账
+        :return:
+        """
+        instances = self.get_instances(alive=False)
+        results = self.fan_out("get_node_snapshot", {
+            host_port: (host_port, (), {
+                "since": self.job_cursors.get(host_port, (None, None))[1],
+                "history_since": self.history_cursors.get(host_port, 0),
+                "history_step": settings.SLAVE_HISTORY_STEP})
+            for host_port in instances})
+        now = time.time()
+        manifests = {}
+        for host_port in instances:
+            snapshot = results.get(host_port)
+            daemon_status = None
+            if snapshot:
+                daemon_status = dict(snapshot.get("daemon_status", {}))
+                daemon_status.update(
+                    status=snapshot.get("status"),
+                    node_name=snapshot.get("node_name"))
+            self._update_slave_status(host_port, daemon_status)
+            if not snapshot:
+                self.performances.pop(host_port, None)
                 continue
-            daemon_status = instance.get_daemon_status() or {}
-            status = daemon_status.get("status", False)
-            proxies_detail["status"] = status
-            NodesModel.update_one(
-                vc_md5=get_md5(host_port),
-                node_name=daemon_status.get("node_name", False),
-                status='运行正常' if status else "链接失败",
-                pending=daemon_status.get("pending"),
-                running=daemon_status.get("running"),
-                finished=daemon_status.get("finished")
-            )
+            self.performances[host_port] = (
+                now, snapshot.get("performance") or {})
+            history = snapshot.get("history")
+            if history is not None:
+                # 节点保留的采样整段写入，不受轮询间隔影响
+                if history.get("times"):
+                    tsdb.add_columns(
+                        host_port, history["times"], history["samples"])
+                    self.history_cursors[host_port] = history["times"][-1]
+            elif snapshot.get("performance"):
+                tsdb.add(host_port, snapshot["performance"], now)
+            changes = snapshot.get("changes") or {}
+            if "jobs" in snapshot:
+                # 首次同步或游标失效：全量同步后以当前游标开始增量同步
+                for project_name, jobs in snapshot["jobs"].items():
+                    self._merge_jobs(host_port, project_name, jobs)
+                self.job_cursors[host_port] = (
+                    changes.get("epoch"), changes.get("last_seq", 0))
+            elif self._apply_job_changes(host_port, changes) and \
+                    changes.get("seq", 0) < changes.get("last_seq", 0):
+                self._drain_job_changes(host_port)  # 快照中的变更未取完
+            manifests[host_port] = snapshot.get("manifest")
+            pass
+        self._sync_spiders_list()
+        self._reconcile_eggs(manifests)
+        self.flush_health_transitions()
         pass
 
     # 同步节点异常（性能指标）
     def sync_nodes_exception(self):
-        """同步节点异常（性能指标）"""
+        """
+        同步节点异常（性能指标）
+        按时序存储中最近ALERT_WINDOW秒的窗口统计值评估全部节点，
+        每个节点+指标只保留一条开启中的告警，峰值升高时原地更新，
+        统计值回落到阈值*ALERT_CLEAR_RATIO以下时关闭
+        """
         system_settings = SystemSettingsModel.get_settings()
-        # Master
-        for key, value in self.get_master_performance().items():
-            threshold = system_settings.get("threshold_{}".format(key))
-            if not threshold or threshold > value:
-                continue
-            NodesExceptionsModel.merge_one(
-                host_port="Master",
-                node_type="master",
-                exc_time=datetime.datetime.now(),
+        thresholds = {
+            key[len("threshold_"):]: value
+            for key, value in system_settings.items()
+            if key.startswith("threshold_")}
+        if not self.alerts.loaded:
+            self.alerts.load([{
+                "host_port": m.host_port,
+                "metric": m.exc_metric,
+                "stat": settings.ALERT_STAT,
+                "threshold": thresholds.get(m.exc_metric),
+                "open_time": m.exc_time.timestamp(),
+                "clear_time": None,
+                "value": m.exc_value,
+                "peak": m.exc_value or 0,
+            } for m in NodesExceptionsModel.query.filter(
+                NodesExceptionsModel.exc_metric.isnot(None),
+                NodesExceptionsModel.clear_time.is_(None)).all()])
+        now = time.time()
+        windows = tsdb.window(now - settings.ALERT_WINDOW, now, [
+            metric for metric, threshold in thresholds.items() if threshold])
+        rows = []
+        for action, incident in self.alerts.evaluate(thresholds, windows, now):
+            host_port, metric = incident["host_port"], incident["metric"]
+            clear_time = incident["clear_time"]
+            rows.append(dict(
+                host_port=host_port,
+                node_type="master" if host_port == "Master" else "slave",
+                exc_time=datetime.datetime.fromtimestamp(
+                    int(incident["open_time"])),
                 exc_level="WARNING",
-                exc_message="Current {} is {}(>={})!".format(
-                    key, value, threshold)
-            )
-            pass
-        # Slave
-        for host_port in self.slaves:
-            for key, value in self.get_salve_performance(host_port).items():
-                threshold = system_settings.get("threshold_{}".format(key))
-                if not threshold or threshold > value:
-                    continue
-                NodesExceptionsModel.merge_one(
-                    host_port=host_port,
-                    node_type="slave",
-                    exc_time=datetime.datetime.now(),
-                    exc_level="WARNING",
-                    exc_message="Current {} is {}(>={})!".format(
-                        key, value, threshold)
-                )
-                pass
+                exc_metric=metric,
+                exc_value=round(incident["peak"], 2),
+                clear_time=datetime.datetime.fromtimestamp(
+                    int(clear_time)) if clear_time else None,
+                exc_message=describe_incident(
+                    incident, settings.ALERT_WINDOW)
+            ))
+        NodesExceptionsModel.merge_many(rows)
         pass
 
     # 同步项目部署
     def sync_projects_list(self):
         """
         同步项目(初始化执行或手动执行)
+        对比节点EGG摘要清单与本地摘要，仅发布缺失或内容不一致的版本，
+        并以清单重建节点部署记录，master重启后无需重新发布
         :return:
         """
-        for project_name, project_detail in self.projects.items():
-            for version_name, version_detail in project_detail.items():
-                # spiders = version_detail.get("spiders", [])
-                # slaves = version_detail.get("slaves", set())
-                _, egg_file = self.egg_storage.get(project_name, version_name)
-                with egg_file as f:  # with open(file_path, 'rb') as f:
-                    egg_data = f.read()
-                for slave_name, proxies_detail in self.proxies.items():
-                    # 若节点异常
-                    if not proxies_detail.get("status"):
-                        continue
-                    instance = proxies_detail.get("instance")
-                    if not isinstance(instance, ProxySpider):
-                        continue
-                    if not version_detail:
-                        spiders = instance.get_list_spiders(project_name)
-                        if spiders:
-                            # set().update(set())
-                            version_detail.update(set(spiders))
-                            SpidersModel.sync_spiders(
-                                project_name, version_name, *spiders)
-                    # 若未部署,重新部署
-                    if version_name in self.slaves.get(slave_name, {}).get(
-                            project_name, set()):
-                        continue
-                    if not instance.deploy_project(
-                            egg_data, project_name, version_name):
-                        continue
-                    self.set_slaves_value(slave_name, project_name,
-                                          version_name)
-                    pass
+        instances = self.get_instances()
+        if not instances:
+            return
+        manifests = self.fan_out("get_list_manifest", {
+            host_port: (host_port, (), {}) for host_port in instances})
+        self._sync_spiders_list()
+        self._reconcile_eggs(manifests)
+        pass
+
+    def _sync_spiders_list(self):
+        """补全未知爬虫列表的项目版本"""
+        instances = self.get_instances()
+        if not instances:
+            return
+        for project_name, project_detail in list(self.projects.items()):
+            for version_name, version_detail in list(project_detail.items()):
+                if version_detail:
+                    continue
+                host_port = next(iter(instances))
+                spiders = instances[host_port].get_list_spiders(project_name)
+                if spiders:
+                    version_detail.extend(spiders)
+                    SpidersModel.sync_spiders(
+                        project_name, version_name, *spiders)
             pass
         pass
 
-    # 同步任务任务
-    def sync_jobs_status(self):
+    def _reconcile_eggs(self, manifests):
         """
-        同步任务执行状态JobsStatus
+        按节点EGG摘要清单对账并发布缺失或不一致的版本
+        :param manifests: {host_port: manifest}，清单获取失败的节点为None
         :return:
         """
-        for host_port, proxies_detail in self.proxies.items():
-            if not proxies_detail.get("status"):
-                continue
-            instance = proxies_detail.get("instance")
-            if not isinstance(instance, ProxySpider):
-                continue
-            for project_name in self.projects:
-                jobs = instance.get_list_jobs(project_name)
-                for job_status, jobs_detail in jobs.items():
-                    for job_detail in jobs_detail:
-                        start_time = job_detail.get('start_time')
-                        start_time = self.str_to_time(start_time)
-                        end_time = job_detail.get('end_time')
-                        end_time = self.str_to_time(end_time)
-                        running_time = self.time_difference(
-                            start_time, end_time)
-                        JobsModel.merge_one(
-                            job_id=job_detail.get('id'),
-                            host_port=host_port,
-                            project_name=project_name,
-                            spider_name=job_detail.get('spider'),
-                            start_time=start_time,
-                            end_time=end_time,
-                            running_time=running_time,
-                            job_status=job_status)
+        digests = {}  # {(project_name, version_name): sha256}
+        for project_name, project_detail in list(self.projects.items()):
+            for version_name in list(project_detail):
+                digests[(project_name, version_name)] = \
+                    self.egg_storage.digest(project_name, version_name)
+            pass
+
+        deploys = defaultdict(list)  # {(project_name, version_name): []}
+        for host_port, manifest in manifests.items():
+            if manifest is None:
+                continue  # 清单获取失败，下一轮再同步
+            remote = {(m.get("project"), m.get("version")): m.get("sha256")
+                      for m in manifest}
+            slave_detail = {}
+            for (project_name, version_name), sha256 in digests.items():
+                if sha256 is None:
+                    continue
+                if remote.get((project_name, version_name)) == sha256:
+                    slave_detail.setdefault(project_name, set()).add(
+                        version_name)
+                else:
+                    deploys[(project_name, version_name)].append(host_port)
+            self.slaves[host_port] = slave_detail
+            pass
+
+        # 若未部署或内容不一致,重新部署
+        for (project_name, version_name), slave_names in deploys.items():
+            _, egg_path = self.egg_storage.get_path(project_name, version_name)
+            results = self.fan_out("deploy_project", {
+                slave_name: (
+                    slave_name, (egg_path, project_name, version_name), {})
+                for slave_name in slave_names},
+                limit=settings.DEPLOY_CONCURRENCY)
+            for slave_name, flag in results.items():
+                if flag:
+                    self.set_slaves_value(
+                        slave_name, project_name, version_name)
             pass
         pass
 
+    def _apply_job_changes(self, host_port, changes):
+        """
+        按顺序写入节点任务变更并推进游标
+        :param host_port: 节点地址
+        :param changes: job_changes.json返回数据
+        :return: 游标是否有效，无效时清除游标，下一轮全量同步
+        """
+        with self._jobs_lock:
+            cursor = self.job_cursors.get(host_port)
+            if not changes or cursor is None:
+                return False
+            if changes.get("reset") or changes.get("epoch") != cursor[0]:
+                self.job_cursors.pop(host_port, None)
+                return False
+            new_changes = [change for change in changes.get("changes", [])
+                           if change.get("seq", 0) > cursor[1]]  # 跳过已推送写入的变更
+            rows = [self._job_change_row(host_port, change)
+                    for change in new_changes]
+            JobsModel.merge_many(rows)
+            self._merge_jobs_stats(host_port, new_changes)
+            self._update_load(host_port, rows)
+            self.job_cursors[host_port] = (
+                cursor[0], max(cursor[1], changes.get("seq", cursor[1])))
+        return True
+        pass
+
+    def apply_job_events(self, host_port, epoch, events):
+        """
+        写入节点推送的任务变更
+        与游标连续的变更推进游标；出现缺口时仅写入变更，由轮询对账补齐
+        :param host_port: 节点地址
+        :param epoch: 节点变更日志纪元
+        :param events: 变更列表 [{"seq", "job", "state", ...}]
+        :return: 写入的变更数
+        """
+        rows, new_events = [], []
+        with self._jobs_lock:
+            cursor = self.job_cursors.get(host_port)
+            valid = cursor is not None and cursor[0] == epoch
+            for event in sorted(events, key=lambda e: e.get("seq", 0)):
+                seq = event.get("seq", 0)
+                if valid and seq <= cursor[1]:
+                    continue  # 已由轮询写入
+                rows.append(self._job_change_row(host_port, event))
+                new_events.append(event)
+                if valid and seq == cursor[1] + 1:
+                    cursor = (epoch, seq)
+                else:
+                    valid = False
+            JobsModel.merge_many(rows)
+            self._merge_jobs_stats(host_port, new_events)
+            self._update_load(host_port, rows)
+            if cursor is not None and cursor[0] == epoch:
+                self.job_cursors[host_port] = cursor
+        return len(rows)
+        pass
+
+    def _drain_job_changes(self, host_port):
+        """变更数超过单次上限时，继续拉取至最新游标"""
+        instance = self.proxies.get(host_port, {}).get("instance")
+        if not isinstance(instance, ProxySpider):
+            return
+        while host_port in self.job_cursors:
+            changes = instance.get_job_changes(self.job_cursors[host_port][1])
+            if not self._apply_job_changes(host_port, changes):
+                break
+            if changes.get("seq", 0) >= changes.get("last_seq", 0):
+                break
+        pass
+
+    def _job_change_row(self, host_port, change):
+        """
+        任务变更转换为JobsModel数据项
+        :param host_port: 节点地址
+        :param change: {"job", "project", "spider", "state", "time", ...}
+        :return: {}
+        """
+        kwargs = dict(
+            job_id=change.get('job'),
+            host_port=host_port,
+            project_name=change.get('project'),
+            spider_name=change.get('spider'),
+            job_status=change.get('state'),
+        )
+        if change.get('state') == JobStatus.PENDING.value:
+            kwargs["create_time"] = self.str_to_time(change.get('time'))
+        start_time = self.str_to_time(change.get('start_time'))
+        end_time = self.str_to_time(change.get('end_time'))
+        if start_time:
+            kwargs["start_time"] = start_time
+        if end_time:
+            kwargs["end_time"] = end_time
+            kwargs["running_time"] = self.time_difference(start_time, end_time)
+        return kwargs
+        pass
+
+    def _merge_jobs(self, host_port, project_name, jobs):
+        """
+        写入节点项目的任务状态
+        :param host_port: 节点地址
+        :param project_name: 项目名称
+        :param jobs: {"pending": [], "running": [], "finished": []}
+        :return:
+        """
+        rows = []
+        for job_status, jobs_detail in (jobs or {}).items():
+            for job_detail in jobs_detail:
+                start_time = job_detail.get('start_time')
+                start_time = self.str_to_time(start_time)
+                end_time = job_detail.get('end_time')
+                end_time = self.str_to_time(end_time)
+                running_time = self.time_difference(start_time, end_time)
+                rows.append(dict(
+                    job_id=job_detail.get('id'),
+                    host_port=host_port,
+                    project_name=project_name,
+                    spider_name=job_detail.get('spider'),
+                    start_time=start_time,
+                    end_time=end_time,
+                    running_time=running_time,
+                    job_status=job_status))
+        JobsModel.merge_many(rows)
+        self._merge_jobs_stats(
+            host_port, (jobs or {}).get("finished", []), project_name)
+        pass
+
+    def _merge_jobs_stats(self, host_port, jobs, project_name=None):
+        """
+        写入已结束任务的运行统计（节点解析的Scrapy统计信息）
+        :param host_port: 节点地址
+        :param jobs: 任务变更或list_jobs.json任务列表项，含stats的写入
+        :param project_name: 项目名称，默认取任务变更中的project
+        :return:
+        """
+        rows = [dict(
+            host_port=host_port,
+            project_name=project_name or job.get('project'),
+            spider_name=job.get('spider'),
+            job_id=job.get('job') or job.get('id'),
+            finish_time=self.str_to_time(job.get('end_time')),
+            stats=job['stats'],
+        ) for job in jobs if job.get('stats')]
+        JobsStatsModel.merge_many(rows)
+        pass
+
     def sync_jobs_exception(self):
-        result = {}
+        """
+        检索任务日志异常，每个节点按批请求job_exceptions_batch.json，
+        由节点进程池并发扫描
+        """
+        instances = self.get_instances()
+        batches = defaultdict(list)  # {host_port: [model]}
         for model in JobsModel.get_jobs_retrieving():
-            host_port = model.host_port
-            if host_port not in result:
-                result[host_port] = []
-            result[host_port].append(model)
-        for host_port, models in result.items():
-            if host_port not in self.proxies:
-                continue
-            proxies_detail = self.proxies.get(host_port, {})
-            if not proxies_detail.get("status"):
-                continue
-            instance = proxies_detail.get("instance")
-            if not isinstance(instance, ProxySpider):
-                continue
-            for model in models:
-                whence, errors = instance.get_job_exception(
+            if model.host_port in instances:
+                batches[model.host_port].append(model)
+        calls, chunks = {}, {}
+        size = settings.JOB_EXCEPTIONS_BATCH_SIZE
+        for host_port, host_models in batches.items():
+            for i in range(0, len(host_models), size):
+                chunk = chunks[(host_port, i)] = host_models[i:i + size]
+                calls[(host_port, i)] = (host_port, ([dict(
+                    project=model.project_name,
+                    spider=model.spider_name,
+                    job=model.job_id,
+                    offset=model.log_progress or 0
+                ) for model in chunk],), {})
+        results = {}
+        for key, chunk_results in self.fan_out(
+                "get_jobs_exception", calls).items():
+            for model, result in zip(chunks[key], chunk_results or []):
+                results[model.vc_md5] = result
+        models = {model.vc_md5: model for chunk in chunks.values()
+                  for model in chunk}
+        exceptions, jobs = [], []
+        for vc_md5, result in results.items():
+            if not result:
+                continue  # 请求失败，保留检索进度下次重试
+            model = models[vc_md5]
+            whence, eof, errors = result
+            # 日志按字节预算分段检索，任务结束且读到文件末尾才算检索完成
+            is_running = model.job_status == JobStatus.RUNNING.value
+            log_status = 1 if eof and not is_running else 0
+            for (exc_time, exc_level, exc_message) in errors:
+                exceptions.append(dict(
+                    host_port=model.host_port,
                     project_name=model.project_name,
+                    version_name=model.version_name,
                     spider_name=model.spider_name,
+                    plan_name=model.plan_name,
                     job_id=model.job_id,
-                    offset=model.log_progress or 0
-                )
-                # if not whence:
-                #     continue
-                log_status = 0 if model.job_status == JobStatus.RUNNING else 1
-                for (exc_time, exc_level, exc_message) in errors:
-                    JobsExceptionsModel.merge_one(
-                        host_port=model.host_port,
-                        project_name=model.project_name,
-                        version_name=model.version_name,
-                        spider_name=model.spider_name,
-                        plan_name=model.plan_name,
-                        job_id=model.job_id,
-                        exc_time=exc_time,
-                        exc_level=exc_level,
-                        exc_message=exc_message
-                    )
-                    pass
-                JobsModel.update_one(
-                    model=model,
-                    log_status=log_status,
-                    log_progress=whence
-                )
+                    exc_time=exc_time,
+                    exc_level=exc_level,
+                    exc_message=exc_message
+                ))
+                pass
+            jobs.append(dict(
+                host_port=model.host_port,
+                project_name=model.project_name,
+                job_id=model.job_id,
+                log_status=log_status,
+                log_progress=whence
+            ))
             pass
+        JobsExceptionsModel.merge_many(exceptions)
+        JobsModel.merge_many(jobs)
         pass
 
     @property
@@ -927,5 +2003,10 @@ agent = SpiderAgent()
 
 # 注册服务
 def register_server():
+    if aio_agent is not None:
+        aio_agent.start()
+    tsdb.load()
+    atexit.register(tsdb.save)
+    agent.sampler.start()
     agent.register()
     pass
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# @Date  : 2019/1/14
+# @Author: lsj
+# @File  : alerts.py
+# @Desc  : 节点性能告警
+默认Python版本支持：3.6
+按滑动窗口统计值（均值或P95）判断阈值，而非单个瞬时值：
+    统计值 >= 阈值                   --> 开启告警（每个节点+指标最多一个）
+    统计值 <  阈值 * ALERT_CLEAR_RATIO --> 关闭告警
+两者之间保持原状态（迟滞），避免在阈值附近反复开启/关闭；
+告警开启期间只在峰值升高时更新同一条记录
+"""
+
+import math
+import time
+
+import master.settings as settings
+
+OPEN = "open"
+UPDATE = "update"
+CLEAR = "clear"
+
+
+def _mean(values):
+    return sum(values) / len(values)
+
+
+def _p95(values):
+    values = sorted(values)
+    return values[max(int(math.ceil(0.95 * len(values))) - 1, 0)]
+
+
+STATS = {"mean": _mean, "p95": _p95}
+
+
+def window_stats(windows, stat="mean", min_samples=1):
+    """
+    批量计算全部节点全部指标的窗口统计值
+    :param windows: {(node, metric): [value]}，None表示缺失
+    :param stat: 统计方法 mean/p95
+    :param min_samples: 最少有效样本数，不足时不参与判断
+    :return: {(node, metric): value}
+    """
+    func = STATS.get(stat, _mean)
+    results = {}
+    for key, values in windows.items():
+        values = [v for v in values if v is not None and not math.isnan(v)]
+        if len(values) >= max(min_samples, 1):
+            results[key] = func(values)
+    return results
+
+
+def describe_incident(incident, window):
+    """
+    告警信息
+    :param incident: 告警
+    :param window: 统计窗口，单位：秒
+    :return: 例如"cpu mean over 300s is 91.20(>=80), peak 95.00"
+    """
+    message = "{} {} over {}s is {}(>={}), peak {}".format(
+        incident["metric"], incident["stat"], window,
+        _format(incident["value"]), incident["threshold"],
+        _format(incident["peak"]))
+    if incident["clear_time"]:
+        message += ", cleared"
+    return message
+
+
+def _format(value):
+    return "-" if value is None else "{:.2f}".format(value)
+
+
+class AlertEvaluator(object):
+    """
+    告警状态，仅在内存中维护开启中的告警；数据库写入由调用方完成
+    """
+
+    def __init__(self, stat=None, clear_ratio=None, min_samples=None):
+        """
+        初始函数
+        :param stat: 统计方法 mean/p95
+        :param clear_ratio: 关闭比例，统计值低于阈值*比例时关闭
+        :param min_samples: 窗口内最少有效样本数
+        """
+        self.stat = stat or settings.ALERT_STAT
+        self.clear_ratio = settings.ALERT_CLEAR_RATIO \
+            if clear_ratio is None else clear_ratio
+        self.min_samples = min_samples or settings.ALERT_MIN_SAMPLES
+        self.incidents = {}  # 开启中的告警 {(node, metric): incident}
+        self.loaded = False
+        pass
+
+    def load(self, incidents):
+        """
+        加载数据库中未关闭的告警，master重启后继续更新同一条记录
+        :param incidents: [incident]，字段同evaluate返回值
+        :return:
+        """
+        for incident in incidents:
+            key = (incident["host_port"], incident["metric"])
+            self.incidents[key] = incident
+        self.loaded = True
+        pass
+
+    def evaluate(self, thresholds, windows, now=None):
+        """
+        评估窗口数据
+        :param thresholds: {metric: threshold}，0或None表示不告警
+        :param windows: {(node, metric): [value]}
+        :param now: 当前时间戳
+        :return: 变化列表 [(action, incident)]，action为open/update/clear
+        """
+        now = time.time() if now is None else now
+        values = window_stats(windows, self.stat, self.min_samples)
+        changes = []
+        for key, value in values.items():
+            threshold = thresholds.get(key[1])
+            incident = self.incidents.get(key)
+            if incident is None:
+                if threshold and value >= threshold:
+                    incident = self.incidents[key] = {
+                        "host_port": key[0],
+                        "metric": key[1],
+                        "stat": self.stat,
+                        "threshold": threshold,
+                        "open_time": now,
+                        "clear_time": None,
+                        "value": value,
+                        "peak": value,
+                    }
+                    changes.append((OPEN, incident))
+                continue
+            incident["value"] = value
+            if not threshold or value < threshold * self.clear_ratio:
+                incident["clear_time"] = now
+                changes.append((CLEAR, self.incidents.pop(key)))
+            elif value > incident["peak"]:
+                incident["peak"] = value
+                incident["threshold"] = threshold
+                changes.append((UPDATE, incident))
+        # 阈值取消的指标，即使窗口内无数据也关闭
+        for key in [k for k in self.incidents if not thresholds.get(k[1])]:
+            incident = self.incidents.pop(key)
+            incident["clear_time"] = now
+            changes.append((CLEAR, incident))
+        return changes
+
+    def drop(self, node):
+        """删除节点的全部告警状态"""
+        for key in [k for k in self.incidents if k[0] == node]:
+            self.incidents.pop(key)
+        pass
+
+    pass
@@ -8,7 +8,7 @@ from master.config import config
 from master.extensions import bootstrap
 from master.extensions import login_manager
 from master.extensions import mail
-from master.models import db
+from master.models import db, upgrade_schema
 
 
 def create_app(config_name):
@@ -25,6 +25,7 @@ def create_app(config_name):
         db.app = app
         db.init_app(app)  # 初始化db
         db.create_all(app=app)  # 创建所有未创建的table
+        upgrade_schema()  # 已存在的table补充新增字段
         login_manager.init_app(app)
         # page_down.init_app(app)
         if app.config['SSL_REDIRECT']:
@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# @Date  : 2018/12/3
+# @Author: lsj
+# @File  : async_agents.py
+# @Desc  : 异步代理模块
+默认Python版本支持：3.6
+基于aiohttp的异步节点代理，所有节点共享一个长连接ClientSession，
+运行于独立的事件循环线程，调度线程通过submit/run提交协程
+"""
+
+import asyncio
+import logging
+import time
+from threading import Thread, Lock
+from urllib.parse import urljoin
+
+import aiohttp
+
+import master.settings as settings
+from master.health import retry_delay
+from master.utils import async_http_get, async_http_post, read_search_line
+
+
+class AsyncProxySpider(object):
+    """
+    Scrapy爬虫异步操作类，接口与ProxySpider一致，方法均为协程
+    """
+
+    def __init__(self, engine, host='localhost', port=6800, username=None,
+                 password='', timeouts=None, health=None):
+        """
+        实例化后的初始化函数
+        :param engine: 异步引擎 AsyncSpiderAgent
+        :param host: 域名
+        :param port: 端口
+        :param username: 用户
+        :param password: 密码
+        :param timeouts: 接口超时时间，{action: (connect, read)}
+        :param health: 节点健康状态 NodeHealth，与同步代理共用
+        """
+        self.engine = engine
+        self.health = health
+        self._base_url = 'http://{}:{}'.format(host, port)
+        # 创建认证Authorization
+        if username:
+            self.auth = aiohttp.BasicAuth(username, password or '')
+        else:
+            self.auth = None
+        self.timeouts = dict(settings.SLAVE_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        pass
+
+    @staticmethod
+    def __check_data(json_data):
+        if isinstance(json_data, dict) and json_data.get('status') == 'ok':
+            return True
+        return False
+        pass
+
+    def get_timeout(self, action):
+        connect, read = self.timeouts.get(
+            action, self.timeouts.get("default"))
+        return aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+
+    async def __retry_request(self, action, method='get', retries=5,
+                              **kwargs):
+        """
+        重试请求
+        :param action: 链接动作
+        :param method: 请求方法 get/post
+        :param retries: 重试次数
+        :param kwargs: 请求参数 params/data/json/headers
+        :return: response.json()
+        """
+        url = urljoin(self._base_url, action)
+        if method == 'get':
+            func = async_http_get
+        elif method == 'post':
+            func = async_http_post
+        else:
+            raise ValueError('Unsupported request method:{}'.format(method))
+        kwargs["auth"] = self.auth
+        kwargs.setdefault("timeout", self.get_timeout(action))
+        health = self.health
+        if health is not None:
+            # 熔断中的节点直接失败，不再发起请求
+            if not health.allow():
+                return None
+            retries = health.retries or retries
+        error = None
+        for i in range(retries):
+            if i:
+                await asyncio.sleep(retry_delay(i - 1))
+            try:
+                async with self.engine.semaphore:
+                    json_data = await func(
+                        url, session=self.engine.session, **kwargs)
+                if health is not None:
+                    health.record_success()
+                return json_data
+            except Exception as e:
+                error = e
+                logging.warning('request error:{}=>{}, retry {}'.format(
+                    type(e), e, url))
+        if health is not None:
+            health.record_failure('{}: {}'.format(type(error).__name__, error))
+        pass
+
+    async def get_daemon_status(self):
+        action = "daemon_status.json"
+        return await self.__retry_request(action)
+
+    async def get_list_projects(self):
+        action = "list_projects.json"
+        json_data = await self.__retry_request(action)
+        if self.__check_data(json_data):
+            return json_data.get('projects', [])
+        return []
+
+    async def get_list_versions(self, project_name):
+        action = "list_versions.json"
+        params = {'project': project_name}
+        json_data = await self.__retry_request(action, params=params)
+        if self.__check_data(json_data):
+            return json_data.get('versions', [])
+        return []
+
+    async def get_node_snapshot(self, since=None, history_since=None,
+                                history_step=None):
+        action = "node_snapshot.json"
+        params = {}
+        if since is not None:
+            params['since'] = since
+        if history_since is not None:
+            params['history_since'] = history_since
+            if history_step:
+                params['history_step'] = history_step
+        json_data = await self.__retry_request(action, params=params)
+        return json_data if self.__check_data(json_data) else None
+
+    async def get_job_changes(self, since=None, limit=1000):
+        action = "job_changes.json"
+        params = {'since': since, 'limit': limit} if since is not None \
+            else None
+        json_data = await self.__retry_request(action, params=params)
+        return json_data if self.__check_data(json_data) else None
+
+    async def get_list_manifest(self, project_name=None):
+        action = "list_manifest.json"
+        params = {'project': project_name} if project_name else None
+        json_data = await self.__retry_request(action, params=params)
+        if self.__check_data(json_data):
+            return json_data.get('manifest', [])
+        return None
+
+    async def get_list_spiders(self, project_name):
+        action = "list_spiders.json"
+        params = {'project': project_name}
+        json_data = await self.__retry_request(action, params=params)
+        if self.__check_data(json_data):
+            return json_data.get('spiders', [])
+        return []
+
+    async def get_list_jobs(self, project_name):
+        action = "list_jobs.json"
+        params = {'project': project_name}
+        json_data = await self.__retry_request(action, params=params)
+        if self.__check_data(json_data):
+            return {
+                'pending': json_data.get("pending", []),
+                'running': json_data.get("running", []),
+                'finished': json_data.get("finished", []),
+            }
+        return {}
+
+    async def del_project(self, project_name):
+        action = "del_project.json"
+        data = {'project': project_name}
+        json_data = await self.__retry_request(action, method='post',
+                                               data=data)
+        return True if self.__check_data(json_data) else False
+
+    async def del_version(self, project_name, version_name):
+        action = "del_version.json"
+        data = {'project': project_name, 'version': version_name}
+        json_data = await self.__retry_request(action, method='post',
+                                               data=data)
+        return True if self.__check_data(json_data) else False
+
+    async def start_spider(self, project_name, spider_name, **kwargs):
+        action = "schedule.json"
+        data = aiohttp.FormData()
+        data.add_field('project', project_name)
+        data.add_field('spider', spider_name)
+        for k, v in kwargs.items():
+            for value in (v if isinstance(v, (list, tuple)) else [v]):
+                data.add_field(k, str(value))
+        json_data = await self.__retry_request(action, method='post',
+                                               data=data)
+        return json_data.get('job') if self.__check_data(json_data) else None
+
+    async def start_spiders(self, jobs):
+        action = "schedule_batch.json"
+        json_data = await self.__retry_request(
+            action, method='post', json={"jobs": jobs})
+        if self.__check_data(json_data):
+            return json_data.get('jobs', [])
+        return [None] * len(jobs)
+
+    async def cancel_spider(self, project_name, job_id):
+        action = "cancel.json"
+        data = {'project': project_name, 'job': job_id}
+        json_data = await self.__retry_request(action, method='post',
+                                               data=data)
+        return True if self.__check_data(json_data) else False
+
+    async def deploy_project(self, egg_path, project_name, version_name=None):
+        report = await self.deploy_egg(egg_path, project_name, version_name)
+        return report.get("status") == "ok"
+
+    async def deploy_egg(self, egg_path, project_name, version_name=None,
+                         retries=3):
+        action = "add_version.json"
+        version_name = version_name if version_name else str(int(time.time()))
+        start_time = time.time()
+        json_data = None
+        for i in range(retries):
+            # FormData只能发送一次，每次重试重新打开文件流式上传
+            with open(egg_path, 'rb') as f:
+                data = aiohttp.FormData()
+                data.add_field('project', project_name)
+                data.add_field('version', version_name)
+                data.add_field('egg', f,
+                               filename='{}.egg'.format(project_name))
+                json_data = await self.__retry_request(
+                    action, method='post', retries=1, data=data)
+            if json_data is not None:
+                break
+        report = {
+            "status": "error",
+            "spiders": 0,
+            "elapsed": round(time.time() - start_time, 3),
+            "message": "",
+        }
+        if self.__check_data(json_data):
+            report["status"] = "ok"
+            report["spiders"] = json_data.get("spiders", 0)
+        elif isinstance(json_data, dict):
+            report["message"] = json_data.get("message", "")
+        else:
+            report["message"] = "no response"
+        return report
+
+    async def get_jobs_exception(self, jobs):
+        action = "job_exceptions_batch.json"
+        json_data = await self.__retry_request(
+            action, method='post', json={"jobs": jobs})
+        if self.__check_data(json_data):
+            return [(r["whence"], r["eof"], r["errors"]) if (
+                r and "whence" in r) else None
+                for r in json_data.get('results', [])]
+        return [None] * len(jobs)
+
+    async def get_sys_performance(self):
+        action = "sys_performance.json"
+        json_data = await self.__retry_request(action)
+        if self.__check_data(json_data):
+            return json_data.get('performance', [])
+        return []
+
+    async def get_sys_performance_history(self, since=None, step=None):
+        action = "sys_performance_history.json"
+        params = {k: v for k, v in (('since', since), ('step', step))
+                  if v is not None}
+        json_data = await self.__retry_request(action, params=params)
+        return json_data if self.__check_data(json_data) else None
+
+    async def search_logs(self, params):
+        action = "search_logs.json"
+        url = urljoin(self._base_url, action)
+        health = self.health
+        if health is not None and not health.allow():
+            return None
+        result = {"matches": [], "summary": None}
+        try:
+            async with self.engine.semaphore:
+                async with self.engine.session.post(
+                        url, data=params, auth=self.auth,
+                        timeout=self.get_timeout(action)) as response:
+                    async for line in response.content:
+                        read_search_line(result, line)
+        except Exception as e:
+            logging.warning('search logs error:{}=>{}, {}'.format(
+                type(e), e, url))
+            if health is not None:
+                health.record_failure('{}: {}'.format(type(e).__name__, e))
+            return None
+        if health is not None:
+            health.record_success()
+        return result
+
+    def log_url(self, project_name, spider_name, job_id):
+        return self._base_url + '/logs/%s/%s/%s.log' % (
+            project_name, spider_name, job_id)
+
+    pass
+
+
+class AsyncSpiderAgent(object):
+    """
+    异步爬虫代理引擎
+    独立事件循环线程 + 共享ClientSession，单进程即可维持数百个在途节点请求
+    """
+
+    def __init__(self, concurrency=None, pool_size=None):
+        """
+        初始函数
+        :param concurrency: 最大在途请求数
+        :param pool_size: 单节点连接数上限
+        """
+        self.concurrency = concurrency or settings.ASYNC_CONCURRENCY
+        self.pool_size = pool_size or settings.SLAVE_POOL_SIZE
+        self.proxies = {}  # 节点异步代理字典
+        self.loop = None
+        self.session = None
+        self.semaphore = None
+        self._thread = None
+        self._lock = Lock()
+        pass
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """启动事件循环线程（幂等）"""
+        with self._lock:
+            if self.running:
+                return
+            self.loop = asyncio.new_event_loop()
+            self._thread = Thread(target=self._run_loop,
+                                  name="AsyncSpiderAgent", daemon=True)
+            self._thread.start()
+            self.submit(self._open_session()).result()
+        pass
+
+    def stop(self):
+        """关闭共享会话并停止事件循环"""
+        with self._lock:
+            if not self.running:
+                return
+            self.submit(self._close_session()).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+        pass
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+        pass
+
+    async def _open_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.pool_size)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        pass
+
+    async def _close_session(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        pass
+
+    def submit(self, coro):
+        """
+        从其他线程提交协程
+        :param coro: 协程
+        :return: concurrent.futures.Future
+        """
+        if not self.running:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        提交协程并阻塞等待结果
+        :param coro: 协程
+        :param timeout: 等待超时，单位：秒
+        :return: 协程结果
+        """
+        return self.submit(coro).result(timeout)
+
+    def merge_client(self, host_port, username=None, password='',
+                     health=None):
+        host, port = host_port.split(":")
+        self.proxies[host_port] = AsyncProxySpider(
+            self, host=host, port=port, username=username, password=password,
+            health=health)
+        pass
+
+    def delete_client(self, host_port):
+        self.proxies.pop(host_port, None)
+        pass
+
+    async def gather(self, method, calls, limit=None):
+        """
+        并发调用各节点异步代理方法
+        :param method: AsyncProxySpider方法名
+        :param calls: {key: (host_port, args, kwargs)}
+        :param limit: 本次调用的并发节点数上限，默认不限
+        :return: {key: result}，调用失败的结果为None
+        """
+        semaphore = asyncio.Semaphore(limit) if limit else None
+
+        async def call(coro):
+            if semaphore is None:
+                return await coro
+            async with semaphore:
+                return await coro
+
+        keys, coros = [], []
+        for key, (host_port, args, kwargs) in calls.items():
+            instance = self.proxies.get(host_port)
+            if not isinstance(instance, AsyncProxySpider):
+                continue
+            keys.append(key)
+            coros.append(call(getattr(instance, method)(*args, **kwargs)))
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        data = {}
+        for key, result in zip(keys, results):
+            if isinstance(result, Exception):
+                logging.warning('gather error:{}=>{}, {} {}'.format(
+                    type(result), result, method, key))
+                result = None
+            data[key] = result
+        return data
+
+    def fan_out(self, method, calls, limit=None):
+        """阻塞版gather，供调度线程调用"""
+        return self.run(self.gather(method, calls, limit))
+
+    pass
+
+
+# 异步代理
+aio_agent = AsyncSpiderAgent()
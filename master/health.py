@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# @Date  : 2018/12/10
+# @Author: lsj
+# @File  : health.py
+# @Desc  : 节点健康状态（熔断器）
+默认Python版本支持：3.6
+节点健康状态机：
+    healthy   --连续失败>=HEALTH_DEGRADED_FAILURES-->  degraded
+    degraded  --连续失败>=HEALTH_OPEN_FAILURES------>  open
+    open      --退避时间到，放行一次探测------------->  half_open
+    half_open --探测成功--> healthy；探测失败--> open（退避时间翻倍）
+open状态下的请求直接失败，不再发起网络请求
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import master.settings as settings
+
+HEALTHY = "healthy"
+DEGRADED = "degraded"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def retry_delay(attempt):
+    """
+    单次请求内的重试间隔，指数退避+随机抖动
+    :param attempt: 已失败次数，从0开始
+    :return: 秒
+    """
+    delay = min(settings.RETRY_DELAY_BASE * 2 ** attempt,
+                settings.RETRY_DELAY_MAX)
+    return random.uniform(delay / 2, delay)
+
+
+class NodeHealth(object):
+    """
+    单个节点的健康状态，线程安全；同步与异步代理共用同一实例
+    """
+
+    def __init__(self, host_port, degraded_failures=None, open_failures=None,
+                 backoff_base=None, backoff_max=None, on_transition=None):
+        """
+        初始函数
+        :param host_port: 节点地址
+        :param degraded_failures: 进入degraded的连续失败次数
+        :param open_failures: 进入open的连续失败次数
+        :param backoff_base: 熔断退避基数，单位：秒
+        :param backoff_max: 熔断退避上限，单位：秒
+        :param on_transition: 状态变化回调 func(transition)
+        """
+        self.host_port = host_port
+        self.degraded_failures = degraded_failures or \
+            settings.HEALTH_DEGRADED_FAILURES
+        self.open_failures = open_failures or settings.HEALTH_OPEN_FAILURES
+        self.backoff_base = backoff_base or settings.HEALTH_BACKOFF_BASE
+        self.backoff_max = backoff_max or settings.HEALTH_BACKOFF_MAX
+        self.on_transition = on_transition
+        self.state = HEALTHY
+        self.failures = 0  # 连续失败次数
+        self.opens = 0  # 连续熔断次数，决定退避时间
+        self.open_until = 0  # 熔断结束时间
+        self.rejected = 0  # 快速失败的请求数
+        self.transitions = deque(maxlen=settings.HEALTH_TRANSITIONS_KEEP)
+        self._probing = False  # half_open状态下是否已有探测请求
+        self._lock = threading.Lock()
+        pass
+
+    def allow(self):
+        """
+        是否放行请求；open状态到期后转为half_open并只放行一个探测请求
+        :return: True/False
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() < self.open_until:
+                    self.rejected += 1
+                    return False
+                self._transition(HALF_OPEN, "backoff elapsed, probing")
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    return False
+                self._probing = True
+            return True
+        pass
+
+    @property
+    def retries(self):
+        """当前状态允许的请求次数，非healthy状态不再重试"""
+        return None if self.state == HEALTHY else 1
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opens = 0
+            self._probing = False
+            if self.state != HEALTHY:
+                self._transition(HEALTHY, "request succeeded")
+        pass
+
+    def record_failure(self, reason=""):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (
+                    self.state != OPEN and
+                    self.failures >= self.open_failures):
+                self._open(reason)
+            elif self.state == HEALTHY and \
+                    self.failures >= self.degraded_failures:
+                self._transition(DEGRADED, "{} consecutive failures: "
+                                           "{}".format(self.failures, reason))
+        pass
+
+    def _open(self, reason):
+        self.opens += 1
+        backoff = min(self.backoff_base * 2 ** (self.opens - 1),
+                      self.backoff_max)
+        backoff = random.uniform(backoff / 2, backoff)  # 抖动，避免同时探测
+        self.open_until = time.time() + backoff
+        self._transition(OPEN, "{} consecutive failures, retry in {:.1f}s: "
+                               "{}".format(self.failures, backoff, reason))
+        pass
+
+    def _transition(self, state, reason):
+        transition = {
+            "host_port": self.host_port,
+            "time": time.time(),
+            "from": self.state,
+            "to": state,
+            "opens": self.opens,
+            "reason": reason,
+        }
+        self.state = state
+        self.transitions.append(transition)
+        if self.on_transition is not None:
+            self.on_transition(transition)
+        pass
+
+    def flaps(self, seconds=600):
+        """最近一段时间内的状态变化次数，用于发现抖动节点"""
+        since = time.time() - seconds
+        return len([t for t in list(self.transitions) if t["time"] >= since])
+
+    def to_dict(self):
+        return {
+            "host_port": self.host_port,
+            "state": self.state,
+            "failures": self.failures,
+            "opens": self.opens,
+            "open_until": self.open_until if self.state == OPEN else None,
+            "rejected": self.rejected,
+            "flaps": self.flaps(),
+            "transitions": list(self.transitions),
+        }
+        pass
+
+    pass
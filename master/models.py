@@ -8,6 +8,7 @@ from enum import Enum
 from flask import current_app
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -153,6 +154,54 @@ class BaseModel(db.Model):
         return model
         pass
 
+    @classmethod
+    def merge_many(cls, rows, chunk_size=500):
+        """
+        批量新增或更新，一个事务内完成
+        SQLite使用 INSERT ... ON CONFLICT DO UPDATE，字段未变化的行不更新；
+        其他数据库逐条merge后统一提交
+        :param rows: 数据项列表 [{}]，字段同merge_one
+        :param chunk_size: 每批执行行数
+        :return: 行数
+        """
+        if not rows:
+            return 0
+        table = cls.__table__
+        # 相邻且字段集合相同的行分为一组，共用一条语句批量执行，保持行顺序
+        groups = []  # [(keys, values_list)]
+        for kwargs in rows:
+            model = cls(**kwargs)  # 经构造函数计算vc_md5等派生字段
+            values = {k: v for k, v in db.inspect(model).dict.items()
+                      if k in table.c and k not in ('dt_create', 'dt_update')}
+            keys = tuple(sorted(values))
+            if not groups or groups[-1][0] != keys:
+                groups.append((keys, []))
+            groups[-1][1].append(values)
+        bind_key = getattr(cls, '__bind_key__', None)
+        if db.get_engine(bind=bind_key).dialect.name != 'sqlite':
+            for keys, values_list in groups:
+                for values in values_list:
+                    db.session.merge(cls(**values))
+            db.session.commit()
+            return len(rows)
+        for keys, values_list in groups:
+            stmt = sqlite_insert(table)
+            columns = [k for k in keys if k != 'vc_md5']
+            if columns:
+                set_ = {k: stmt.excluded[k] for k in columns}
+                set_['dt_update'] = db.func.current_timestamp()
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['vc_md5'], set_=set_,
+                    where=db.or_(*[
+                        table.c[k].isnot(stmt.excluded[k]) for k in columns]))
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=['vc_md5'])
+            for i in range(0, len(values_list), chunk_size):
+                db.session.execute(stmt, values_list[i:i + chunk_size])
+        db.session.commit()
+        return len(rows)
+        pass
+
     @classmethod
     def update_one(cls, vc_md5=None, model=None, **kwargs):
         # cls.query.filter(cls.vc_md5 == vc_md5).update(kwargs)
@@ -207,6 +256,36 @@ class BaseModel(db.Model):
     pass
 
 
+def upgrade_schema():
+    """
+    为已存在的表补充模型中新增的字段
+    db.create_all()只创建不存在的表，不会修改已存在的表；
+    新增字段均可为空，逐个执行 ALTER TABLE ... ADD COLUMN
+    :return: 新增的字段 ["table.column"]
+    """
+    engine = db.get_engine()
+    inspector = db.inspect(engine)
+    tables = set(inspector.get_table_names())
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue  # 由create_all创建
+        columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable:
+                raise RuntimeError('Cannot add NOT NULL column {}.{}'.format(
+                    table.name, column.name))
+            with engine.begin() as conn:
+                conn.execute(db.text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name,
+                    column.type.compile(dialect=engine.dialect))))
+            added.append('{}.{}'.format(table.name, column.name))
+    return added
+    pass
+
+
 class NodesModel(BaseModel):
     """主机管理"""
     __tablename__ = 'sp_nodes'
@@ -270,11 +349,16 @@ class NodesExceptionsModel(BaseModel):
         db.String(100), db.ForeignKey('sp_nodes.vc_md5'), comment="节点MD5")
 
     # vc_md5 主键，MD5值，md5(host_port#exc_time)
+    # 性能告警 md5(host_port#exc_metric#exc_time)，exc_time为告警开启时间
+    # 健康状态变化 md5(host_port#exc_key#exc_time)，exc_key为状态变化
     host_port = db.Column(db.String(100), nullable=False, comment='节点名称')
     node_type = db.Column(db.String(100), default="slave", comment="节点类型")
     exc_time = db.Column(db.DateTime, nullable=False, comment='异常时间')
     exc_level = db.Column(db.String(100), comment='异常等级')
     exc_message = db.Column(db.Text, comment='异常信息')
+    exc_metric = db.Column(db.String(100), comment='告警指标')
+    exc_value = db.Column(db.Float, comment='告警峰值')
+    clear_time = db.Column(db.DateTime, comment='告警关闭时间')
     remark = db.Column(db.Text, comment='备注')
     is_closed = db.Column(db.Boolean, default=False, comment='是否关闭')
     is_emailed = db.Column(
@@ -282,14 +366,21 @@ class NodesExceptionsModel(BaseModel):
 
     node = db.relationship("NodesModel", back_populates="exceptions")
 
-    def __init__(self, host_port=None, exc_time=None, **kwargs):
+    def __init__(self, host_port=None, exc_time=None, exc_key=None,
+                 **kwargs):
+        """
+        :param exc_key: 附加的主键字段，同一秒内的多条异常以此区分，
+                        如健康状态变化的目标状态
+        """
         super().__init__(**kwargs)
         if exc_time and isinstance(exc_time, str):
             exc_time = datetime.datetime.strptime(exc_time, '%Y-%m-%d %H:%M:%S')
         if host_port:
-            if exc_time:
+            if exc_time and not kwargs.get("vc_md5"):
+                keys = [host_port] + [
+                    k for k in (self.exc_metric, exc_key) if k]
                 self.vc_md5 = get_md5(
-                    host_port, exc_time.strftime('%Y-%m-%d %H:%M:%S'))
+                    *keys, exc_time.strftime('%Y-%m-%d %H:%M:%S'))
             self.node_md5 = get_md5(host_port)
             self.host_port = host_port
         if exc_time:
@@ -304,6 +395,9 @@ class NodesExceptionsModel(BaseModel):
             "exc_time": datetime2str(self.exc_time),
             "exc_level": self.exc_level,
             "exc_message": self.exc_message,
+            "exc_metric": self.exc_metric,
+            "exc_value": self.exc_value,
+            "clear_time": datetime2str(self.clear_time),
             "remark": self.remark,
             "is_closed": self.is_closed,
             "is_emailed": self.is_emailed,
@@ -745,6 +839,228 @@ class JobsExceptionsModel(BaseModel):
     pass
 
 
+class JobsStatsModel(BaseModel):
+    """
+    运行统计
+    爬虫关闭时Scrapy输出到日志的统计信息（Dumping Scrapy stats），
+    由节点在任务结束时解析
+    """
+    __tablename__ = 'sp_jobs_stats'
+
+    job_md5 = db.Column(
+        db.String(100), db.ForeignKey('sp_jobs.vc_md5'), comment="作业MD5")
+
+    # vc_md5 主键，MD5值，与作业相同，md5(host_port#project_name#job_id)
+    host_port = db.Column(db.String(100), nullable=False, comment='域名端口')
+    project_name = db.Column(db.String(100), nullable=False, comment='项目名称')
+    spider_name = db.Column(db.String(100), comment='爬虫名称')
+    job_id = db.Column(db.String(100), nullable=False, comment='作业ID')
+    finish_time = db.Column(db.DateTime, comment='结束时间')
+    finish_reason = db.Column(db.String(100), comment='结束原因')
+    elapsed_time = db.Column(db.Float, comment='运行时间（秒）')
+    items_num = db.Column(db.Integer, comment='Item数')
+    items_dropped = db.Column(db.Integer, comment='丢弃Item数')
+    requests_num = db.Column(db.Integer, comment='请求数')
+    responses_num = db.Column(db.Integer, comment='响应数')
+    response_bytes = db.Column(db.BigInteger, comment='响应字节数')
+    errors_num = db.Column(db.Integer, comment='错误日志数')
+    items_rate = db.Column(db.Float, comment='Item数/秒')
+    requests_rate = db.Column(db.Float, comment='请求数/秒')
+    status_counts = db.Column(db.Text, comment='响应状态码计数（JSON）')
+    stats = db.Column(db.Text, comment='全部统计信息（JSON）')
+
+    # 统计项 --> 字段
+    STATS_COLUMNS = {
+        "finish_reason": "finish_reason",
+        "elapsed_time_seconds": "elapsed_time",
+        "item_scraped_count": "items_num",
+        "item_dropped_count": "items_dropped",
+        "downloader/request_count": "requests_num",
+        "response_received_count": "responses_num",
+        "downloader/response_bytes": "response_bytes",
+        "log_count/ERROR": "errors_num",
+    }
+    STATUS_PREFIX = "downloader/response_status_count/"
+
+    def __init__(self, host_port=None, project_name=None, job_id=None,
+                 stats=None, **kwargs):
+        super().__init__(**kwargs)
+        if host_port and project_name and job_id:
+            self.vc_md5 = self.job_md5 = get_md5(
+                host_port, project_name, job_id)
+        if host_port:
+            self.host_port = host_port
+        if project_name:
+            self.project_name = project_name
+        if job_id:
+            self.job_id = job_id
+        if isinstance(stats, dict):
+            self.set_stats(stats)
+        elif stats:
+            self.stats = stats
+        pass
+
+    def set_stats(self, stats):
+        """
+        由Scrapy统计信息计算各字段
+        :param stats: {stat: value}
+        :return:
+        """
+        for key, column in self.STATS_COLUMNS.items():
+            setattr(self, column, stats.get(key))
+        if self.elapsed_time:
+            self.items_rate = round(
+                (self.items_num or 0) / self.elapsed_time, 4)
+            self.requests_rate = round(
+                (self.requests_num or 0) / self.elapsed_time, 4)
+        self.status_counts = json.dumps({
+            k[len(self.STATUS_PREFIX):]: v for k, v in stats.items()
+            if k.startswith(self.STATUS_PREFIX)}, sort_keys=True)
+        self.stats = json.dumps(stats, sort_keys=True)
+        pass
+
+    def to_dict(self):
+        return {
+            "vc_md5": self.vc_md5,
+            "job_md5": self.job_md5,
+            "host_port": self.host_port,
+            "project_name": self.project_name,
+            "spider_name": self.spider_name,
+            "job_id": self.job_id,
+            "finish_time": datetime2str(self.finish_time),
+            "finish_reason": self.finish_reason,
+            "elapsed_time": self.elapsed_time,
+            "items_num": self.items_num,
+            "items_dropped": self.items_dropped,
+            "requests_num": self.requests_num,
+            "responses_num": self.responses_num,
+            "response_bytes": self.response_bytes,
+            "errors_num": self.errors_num,
+            "items_rate": self.items_rate,
+            "requests_rate": self.requests_rate,
+            "status_counts": json.loads(self.status_counts or "{}"),
+            "stats": json.loads(self.stats or "{}"),
+        }
+        pass
+
+    @classmethod
+    def get_spider_series(cls, project_name, spider_name, hours=24 * 7):
+        """
+        爬虫各次运行的统计，按结束时间排序
+        :param project_name: 项目名称
+        :param spider_name: 爬虫名称
+        :param hours: 最近N小时
+        :return: [model]
+        """
+        since = datetime.datetime.now() - datetime.timedelta(hours=hours)
+        return cls.query.filter(
+            cls.project_name == project_name,
+            cls.spider_name == spider_name,
+            cls.finish_time > since).order_by(cls.finish_time).all()
+        pass
+
+    @classmethod
+    def get_spiders_throughput(cls, hours=24):
+        """
+        统计各爬虫平均吞吐量
+        :param hours: 最近N小时
+        :return: [(project_name, spider_name, runs_num, items_rate_avg,
+                  requests_rate_avg, items_num_sum, requests_num_sum,
+                  elapsed_time_sum)]
+        """
+        since = datetime.datetime.now() - datetime.timedelta(hours=hours)
+        return db.session.query(
+            cls.project_name,
+            cls.spider_name,
+            db.func.count(cls.vc_md5).label("runs_num"),
+            db.func.avg(cls.items_rate).label("items_rate_avg"),
+            db.func.avg(cls.requests_rate).label("requests_rate_avg"),
+            db.func.sum(cls.items_num).label("items_num_sum"),
+            db.func.sum(cls.requests_num).label("requests_num_sum"),
+            db.func.sum(cls.elapsed_time).label("elapsed_time_sum"),
+        ).filter(cls.finish_time > since).group_by(
+            cls.project_name, cls.spider_name).all()
+        pass
+
+    pass
+
+
+class DispatchModel(BaseModel):
+    """调度队列，等待节点空闲进程的运行请求"""
+    __tablename__ = 'sp_dispatch'
+
+    # vc_md5 主键，MD5值，md5(job_id)
+    plan_name = db.Column(db.String(100), comment='计划名称')
+    project_name = db.Column(db.String(100), nullable=False, comment='项目名称')
+    version_name = db.Column(db.String(100), comment='版本名称')
+    spider_name = db.Column(db.String(100), nullable=False, comment='爬虫名称')
+    # 节点地址、auto或auto:<strategy>
+    host_port = db.Column(db.String(100), comment='节点指定')
+    exec_args = db.Column(db.String(1000), comment='运行参数')
+    priority = db.Column(db.Integer, default=0, comment='优先级')
+    job_id = db.Column(db.String(100), nullable=False, comment='作业ID')
+    submit_time = db.Column(db.DateTime, comment='提交时间')
+    dispatch_time = db.Column(db.DateTime, comment='分配时间')
+    dispatch_host_port = db.Column(db.String(100), comment='运行节点')
+    # 调度状态 queued/dispatched/canceled/failed
+    dispatch_status = db.Column(db.String(100), comment='调度状态')
+    attempts = db.Column(db.Integer, default=0, comment='启动失败次数')
+    message = db.Column(db.Text, comment='信息')
+
+    def __init__(self, job_id=None, **kwargs):
+        super().__init__(**kwargs)
+        if job_id:
+            self.vc_md5 = get_md5(job_id)
+            self.job_id = job_id
+        pass
+
+    def to_dict(self):
+        return {
+            "vc_md5": self.vc_md5,
+            "plan_name": self.plan_name,
+            "project_name": self.project_name,
+            "version_name": self.version_name,
+            "spider_name": self.spider_name,
+            "host_port": self.host_port,
+            "exec_args": self.exec_args,
+            "priority": self.priority,
+            "job_id": self.job_id,
+            "submit_time": datetime2str(self.submit_time),
+            "dispatch_time": datetime2str(self.dispatch_time),
+            "dispatch_host_port": self.dispatch_host_port,
+            "dispatch_status": self.dispatch_status,
+            "waiting_time": time_difference(
+                self.submit_time,
+                self.dispatch_time or datetime.datetime.now()),
+            "attempts": self.attempts,
+            "message": self.message,
+        }
+        pass
+
+    @classmethod
+    def get_queued(cls, limit=None):
+        """按优先级、提交时间获取排队中的运行请求"""
+        query = cls.query.filter(
+            cls.dispatch_status == DispatchStatus.QUEUED.value).order_by(
+            cls.priority.desc(), cls.submit_time.asc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+        pass
+
+    @classmethod
+    def del_expired(cls, hours=24):
+        """删除已结束（非排队中）且结束超过保留时间的运行请求"""
+        expired = datetime.datetime.now() - datetime.timedelta(hours=hours)
+        cls.query.filter(
+            cls.dispatch_status != DispatchStatus.QUEUED.value,
+            cls.dispatch_time < expired).delete(synchronize_session=False)
+        db.session.commit()
+        pass
+
+    pass
+
+
 class SystemSettingsModel(BaseModel):
     """系统设置"""
     __tablename__ = 'sp_settings'
@@ -1051,6 +1367,15 @@ class JobStatus(Enum):
     pass
 
 
+class DispatchStatus(Enum):
+    """调度状态"""
+    QUEUED = 'queued'
+    DISPATCHED = 'dispatched'
+    CANCELED = 'canceled'
+    FAILED = 'failed'
+    pass
+
+
 class Permission(Enum):
     GUEST = 1
     STANDARD = 2
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# @Date  : 2018/12/12
+# @Author: lsj
+# @File  : placement.py
+# @Desc  : 运行节点选择策略
+默认Python版本支持：3.6
+计划的节点指定为"auto"时使用默认策略PLACEMENT_STRATEGY，
+"auto:<strategy>"指定策略，例如"auto:most_free"
+节点负载 loads = {
+    host_port: {"pending": 0, "running": 1, "max_proc": 16,
+                "free_slots": 15, "cpu": 5.9, "virtual_memory": 83.4},
+}
+新增策略：使用@register_strategy("name")装饰 func(loads) -> host_port
+"""
+
+import random
+
+import master.settings as settings
+
+STRATEGIES = {}  # 节点选择策略 {name: func(loads)}
+
+
+def register_strategy(name):
+    """注册节点选择策略"""
+
+    def decorator(func):
+        STRATEGIES[name] = func
+        return func
+
+    return decorator
+
+
+def parse_strategy(host_port):
+    """
+    解析计划的节点指定
+    :param host_port: 节点地址、"auto"或"auto:<strategy>"
+    :return: 策略名称，指定具体节点时返回None
+    """
+    if not host_port or host_port == "auto":
+        return settings.PLACEMENT_STRATEGY
+    if host_port.startswith("auto:"):
+        return host_port.split(":", 1)[1] or settings.PLACEMENT_STRATEGY
+    return None
+
+
+def select_node(loads, strategy=None):
+    """
+    按策略选择运行节点
+    :param loads: 候选节点负载
+    :param strategy: 策略名称，未知策略使用默认策略
+    :return: host_port，无候选节点时返回None
+    """
+    if not loads:
+        return None
+    func = STRATEGIES.get(strategy) or \
+        STRATEGIES[settings.PLACEMENT_STRATEGY]
+    return func(loads)
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def busy_slots(load):
+    """运行中及等待中的任务数"""
+    return _int(load.get("running")) + _int(load.get("pending"))
+
+
+def free_slots(load):
+    """空闲进程数，未上报max_proc的旧版节点按DEFAULT_MAX_PROC计算"""
+    max_proc = _int(load.get("max_proc"), settings.DEFAULT_MAX_PROC)
+    return max_proc - busy_slots(load)
+
+
+@register_strategy("random")
+def random_node(loads):
+    """随机选择"""
+    return random.choice(list(loads))
+
+
+@register_strategy("least_jobs")
+def least_jobs(loads):
+    """运行中+等待中任务最少，相同时随机"""
+    return min(loads, key=lambda k: (busy_slots(loads[k]), random.random()))
+
+
+@register_strategy("most_free")
+def most_free(loads):
+    """空闲进程数（max_proc - running - pending）最多，相同时随机"""
+    return max(loads, key=lambda k: (free_slots(loads[k]), random.random()))
+
+
+@register_strategy("weighted")
+def weighted(loads):
+    """
+    按空闲进程数与CPU/内存余量加权随机，负载低的节点被选中的概率高
+    没有空闲进程的节点不参与，全部节点均无空闲时按least_jobs选择
+    """
+    keys, weights = [], []
+    for host_port, load in loads.items():
+        free = free_slots(load)
+        if free <= 0:
+            continue
+        cpu = load.get("cpu")
+        memory = load.get("virtual_memory")
+        cpu = 50 if cpu is None else min(max(cpu, 0), 99)
+        memory = 50 if memory is None else min(max(memory, 0), 99)
+        keys.append(host_port)
+        weights.append(free * (100 - cpu) * (100 - memory))
+    if not keys:
+        return least_jobs(loads)
+    return random.choices(keys, weights=weights)[0]
@@ -7,13 +7,20 @@
 # @Desc  : 
 默认Python版本支持：3.6
 """
-import requests
-from flask import Blueprint
+import json
+import time
+
+from flask import Blueprint, Response, stream_with_context
 from flask import jsonify, redirect, render_template, request, flash
 from flask_login import login_required
 
+import master.settings as settings
 from master.agents import agent
-from master.models import JobsModel, JobsExceptionsModel
+from master.models import DispatchModel, DispatchStatus
+from master.models import JobStatus, JobsModel, JobsExceptionsModel
+from master.models import JobsStatsModel
+from master.models import NodesModel
+from master.utils import is_host_address
 
 blueprint_job = Blueprint('job', __name__)
 
@@ -38,16 +45,215 @@ def job_search():
     pass
 
 
+@blueprint_job.route("/events", methods=['post'])
+def job_events():
+    """
+    接收节点推送的任务状态变更（批量），使用节点的用户密码进行Basic认证
+    节点未设置用户时只接受来自节点地址的推送
+    {"host_port": "host:6800", "epoch": "...", "events": [{"seq": 1, ...}]}
+    :return:
+    """
+    data = request.get_json(silent=True) or {}
+    host_port = data.get("host_port")
+    node = NodesModel.get_first(host_port=host_port, node_type="slave")
+    if not node or host_port not in agent.proxies:
+        return jsonify({"status": "error", "message": "unknown node"}), 404
+    auth = request.authorization
+    if node.username:
+        authorized = auth and auth.username == node.username and (
+                auth.password or '') == (node.password or '')
+    else:
+        authorized = is_host_address(
+            host_port.rsplit(':', 1)[0], request.remote_addr)
+    if not authorized:
+        return jsonify(
+            {"status": "error", "message": "Authentication exception!"}), 401
+    applied = agent.apply_job_events(
+        host_port, data.get("epoch"), data.get("events", []))
+    return jsonify({"status": "ok", "applied": applied})
+    pass
+
+
+@blueprint_job.route("/queue", methods=['post'])
+@login_required
+def job_queue():
+    """调度队列，排队中的运行请求按分配顺序（优先级、提交时间）返回"""
+    page_index = request.form.get('pageNum', 1)
+    page_size = request.form.get('pageSize', 10)
+    dispatch_status = request.form.get(
+        'dataType', DispatchStatus.QUEUED.value)
+    if dispatch_status == DispatchStatus.QUEUED.value:
+        items = [m.to_dict() for m in DispatchModel.get_queued()]
+        return jsonify({"total": len(items), "items": items})
+    pagination = DispatchModel.get_pagination(
+        page_index=page_index, page_size=page_size,
+        dispatch_status=dispatch_status,
+        keywords=request.form.get('keywords'))
+    return jsonify(pagination)
+    pass
+
+
+@blueprint_job.route("/batch", methods=['post'])
+@login_required
+def job_batch():
+    """
+    批量提交运行请求至调度队列
+    {"jobs": [{"project_name", "spider_name", "version_name", "exec_args",
+               "host_port", "priority", "plan_name"}]}
+    """
+    data = request.get_json(silent=True) or {}
+    items = [job for job in data.get("jobs", [])
+             if job.get("project_name") and job.get("spider_name")]
+    job_ids = agent.submit_spiders(items) if items else []
+    return jsonify({"status": "ok", "jobs": job_ids})
+    pass
+
+
+@blueprint_job.route("/queue/cancel/<dispatch_md5>")
+@login_required
+def job_queue_cancel(dispatch_md5):
+    if agent.cancel_queued(dispatch_md5):
+        flash('Cancel success!')
+    return redirect(request.referrer, code=302)
+
+
 @blueprint_job.route("/log/<execution_id>")
 @login_required
 def job_log(execution_id):
+    """日志查看页，内容由/log/<execution_id>/range按窗口加载"""
+    job = JobsModel.get_first(vc_md5=execution_id)
+    if not job:
+        return redirect(request.referrer or "/job/manage", code=302)
+    return render_template(
+        "jobs/log.html", job=job.to_dict(),
+        window_size=settings.LOG_WINDOW_SIZE // 1024)
+
+
+def _log_window(window, align_lines=False):
+    """
+    日志窗口字节解码，丢弃窗口两端不完整的UTF-8字符，
+    align_lines时从窗口内第一个完整行开始（文件开头除外）
+    """
+    data, start, end = window["data"], window["start"], window["end"]
+    head = 0
+    if align_lines and start > 0:
+        head = data.find(b'\n') + 1
+        if head == 0:
+            head = len(data)  # 窗口内没有完整行
+    for _ in range(3):
+        if head < len(data) and 0x80 <= data[head] < 0xC0:
+            head += 1  # UTF-8续字节
+    tail = len(data)
+    for i in range(1, min(4, len(data) - head) + 1):
+        byte = data[-i]
+        if byte < 0x80:
+            break
+        if byte >= 0xC0:
+            # 多字节字符起始字节，之后的字节数不足时丢弃
+            need = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            if i < need:
+                tail = len(data) - i
+            break
+    return {
+        "start": start + head,
+        "end": end - (len(data) - tail),
+        "size": window["size"],
+        "text": data[head:tail].decode('utf-8', errors='replace'),
+    }
+
+
+@blueprint_job.route("/log/<execution_id>/range", methods=['post'])
+@login_required
+def job_log_range(execution_id):
+    """
+    按窗口读取日志
+    start/length：从start字节开始读取length字节（KB）；
+    tail：读取最后tail KB，从第一个完整行开始
+    :return: {"start": 0, "end": 1024, "size": 4096, "text": ""}
+    """
+    job = JobsModel.get_first(vc_md5=execution_id)
+    if not job:
+        return jsonify({"status": "error", "message": "unknown job"}), 404
+    tail = request.form.get("tail", type=int)
+    length = request.form.get("length", type=int)
+    window = agent.read_log(
+        job.host_port, job.project_name, job.spider_name, job.job_id,
+        start=request.form.get("start", 0, type=int),
+        length=length * 1024 if length else None,
+        tail=tail * 1024 if tail else None)
+    if window is None:
+        return jsonify({"status": "error", "message": "log unavailable"})
+    data = _log_window(window, align_lines=bool(tail))
+    data.update(status="ok", job_status=job.job_status)
+    return jsonify(data)
+
+
+@blueprint_job.route("/log/<execution_id>/follow")
+@login_required
+def job_log_follow(execution_id):
+    """
+    跟踪日志（Server-Sent Events），推送offset之后新写入的内容；
+    每个事件的id为下次读取的开始字节，断线重连时由Last-Event-ID继续。
+    推送一批新内容或等待LOG_FOLLOW_TIMEOUT秒后即结束响应，由浏览器重连，
+    同步worker（gunicorn默认）不会被跟踪页面长期占用；
+    任务结束且无新内容时发送end事件
+    """
     job = JobsModel.get_first(vc_md5=execution_id)
-    url = agent.log_url(
-        job.host_port, job.project_name, job.spider_name, job.job_id)
-    res = requests.get(url)
-    res.encoding = 'utf8'
-    raw = res.text
-    return render_template("jobs/log.html", log_lines=raw.split('\n'))
+    if not job:
+        return jsonify({"status": "error", "message": "unknown job"}), 404
+    host_port, project_name = job.host_port, job.project_name
+    spider_name, job_id = job.spider_name, job.job_id
+    offset = request.headers.get("Last-Event-ID", type=int)
+    if offset is None:
+        offset = request.args.get("offset", 0, type=int)
+
+    def events(offset):
+        deadline = time.time() + settings.LOG_FOLLOW_TIMEOUT
+        yield "retry: {}\n\n".format(int(settings.LOG_FOLLOW_INTERVAL * 1000))
+        while time.time() < deadline:
+            window = agent.read_log(
+                host_port, project_name, spider_name, job_id, start=offset)
+            if window is None:
+                yield "event: failure\ndata: {}\n\n"
+            elif window["data"]:
+                data = _log_window(window)
+                if data["end"] > offset:
+                    yield "id: {}\ndata: {}\n\n".format(
+                        data["end"], json.dumps(data))
+                    return  # 浏览器以Last-Event-ID重连，继续读取
+            else:
+                model = JobsModel.get_first(vc_md5=execution_id)
+                if model is None or model.job_status not in (
+                        JobStatus.PENDING.value, JobStatus.RUNNING.value):
+                    yield "event: end\ndata: {}\n\n"
+                    return
+            time.sleep(settings.LOG_FOLLOW_INTERVAL)
+
+    return Response(
+        stream_with_context(events(offset)), mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@blueprint_job.route("/log/search", methods=['post'])
+@login_required
+def job_log_search():
+    """
+    跨节点检索运行日志，各节点并发检索、按行返回匹配结果
+    参数：pattern 正则表达式或字符串，literal=1 按字符串检索，
+    ignore_case=1 忽略大小写，project/spider 项目/爬虫名称，
+    since/until 日志最后修改时间范围（时间戳），limit 每个节点的最大匹配行数，
+    nodes 节点地址（逗号分隔），默认全部节点
+    :return: {"status": "ok", "items": [match], "nodes": {host_port: summary}}
+    """
+    if not request.form.get("pattern"):
+        return jsonify({"status": "error", "message": "pattern required"})
+    params = {k: request.form[k] for k in (
+        "pattern", "literal", "ignore_case", "project", "spider", "since",
+        "until", "limit") if request.form.get(k)}
+    nodes = [x.strip() for x in request.form.get("nodes", "").split(",")
+             if x.strip()]
+    matches, summaries = agent.search_logs(params, nodes)
+    return jsonify({"status": "ok", "items": matches, "nodes": summaries})
 
 
 @blueprint_job.route("/stop/<execution_id>")
@@ -65,10 +271,67 @@ def job_stop(execution_id):
 def job_delete(execution_id):
     model = JobsModel.del_one(vc_md5=execution_id)
     if model:
+        JobsStatsModel.del_many(execution_id)
         flash('Delete success!')
     return redirect(request.referrer, code=302)
 
 
+'''========= stats ========='''
+
+
+# 任务运行统计
+@blueprint_job.route("/stats/<execution_id>")
+@login_required
+def job_stats(execution_id):
+    model = JobsStatsModel.get_first(vc_md5=execution_id)
+    if not model:
+        return jsonify({"status": "error", "message": "no stats"})
+    return jsonify(dict(model.to_dict(), status="ok"))
+
+
+# 各爬虫吞吐量
+@blueprint_job.route("/stats/spiders", methods=['post'])
+@login_required
+def job_stats_spiders():
+    """
+    最近hours小时各爬虫的平均吞吐量
+    :return: {"status": "ok", "items": [{"project_name", "spider_name",
+              "runs_num", "items_rate", "requests_rate", ...}]}
+    """
+    hours = request.form.get("hours", 24, type=float)
+    items = [{
+        "project_name": row.project_name,
+        "spider_name": row.spider_name,
+        "runs_num": row.runs_num,
+        "items_rate": round(row.items_rate_avg or 0, 4),
+        "requests_rate": round(row.requests_rate_avg or 0, 4),
+        "items_num": row.items_num_sum or 0,
+        "requests_num": row.requests_num_sum or 0,
+        "elapsed_time": row.elapsed_time_sum or 0,
+    } for row in JobsStatsModel.get_spiders_throughput(hours)]
+    return jsonify({"status": "ok", "items": items})
+
+
+# 爬虫吞吐量趋势
+@blueprint_job.route("/stats/spider", methods=['post'])
+@login_required
+def job_stats_spider():
+    """
+    爬虫最近hours小时每次运行的统计，按结束时间排序，用于观察吞吐量变化
+    :return: {"status": "ok", "items": [{"finish_time", "items_rate",
+              "requests_rate", ...}]}
+    """
+    models = JobsStatsModel.get_spider_series(
+        request.form.get("project_name"), request.form.get("spider_name"),
+        request.form.get("hours", 24 * 7, type=float))
+    items = []
+    for model in models:
+        item = model.to_dict()
+        item.pop("stats")
+        items.append(item)
+    return jsonify({"status": "ok", "items": items})
+
+
 '''========= exception ========='''
 
 
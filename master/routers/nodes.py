@@ -8,12 +8,14 @@
 默认Python版本支持：3.6
 """
 import re
+import time
 
 from flask import Blueprint
 from flask import flash, jsonify, redirect, render_template, request, session
 from flask_login import login_required
 
 from master.agents import agent
+from master.timeseries import tsdb
 from master.extensions import send_emails
 from master.models import NodesModel, NodesExceptionsModel
 from master.models import SystemSettingsModel
@@ -101,6 +103,50 @@ def node_detail_status():
     pass
 
 
+@blueprint_node.route("/detail/history", methods=['post'])
+@login_required
+def node_detail_history():
+    """
+    节点性能指标历史
+    :param id: 节点MD5
+    :param metrics: 指标，逗号分隔，默认全部
+    :param range: 查询最近N秒，默认3600；或start/end时间戳
+    :param resolution: 分辨率（秒）5/60/900，默认自动选择
+    """
+    model = NodesModel.get_first(
+        vc_md5=request.form.get('id', request.form.get('vc_md5')))
+    if not model:
+        return jsonify({})
+    end = request.form.get('end', type=float)
+    start = request.form.get('start', type=float)
+    if start is None:
+        end = end or time.time()
+        start = end - request.form.get('range', 3600, type=float)
+    metrics = request.form.get('metrics')
+    return jsonify(tsdb.query(
+        model.host_port,
+        metrics=metrics.split(",") if metrics else None,
+        start=start, end=end,
+        resolution=request.form.get('resolution', type=int)))
+    pass
+
+
+@blueprint_node.route("/pools", methods=['post'])
+@login_required
+def node_pool_stats():
+    """节点连接池统计"""
+    return jsonify(agent.get_pool_stats())
+    pass
+
+
+@blueprint_node.route("/health", methods=['post'])
+@login_required
+def node_health():
+    """节点健康状态（熔断状态及最近状态变化）"""
+    return jsonify(agent.get_health())
+    pass
+
+
 @blueprint_node.route("/exception")
 @login_required
 def node_exception_manage():
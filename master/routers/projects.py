@@ -75,12 +75,27 @@ def project_deploy():
         return redirect(request.referrer)
     project_name = request.form.get('project_name')
     version_name = request.form.get('version_name')
-    agent.deploy_project(file, project_name, version_name)
-    flash('deploy success!')
+    task_id = agent.submit_deploy(file, project_name, version_name)
+    flash('deploy submitted! task id: {}'.format(task_id))
     return redirect(request.referrer)
     pass
 
 
+@blueprint_project.route("/deploy/status/<task_id>")
+@login_required
+def project_deploy_status(task_id):
+    """
+    查询后台发布任务状态及各节点发布报告
+    :param task_id: 任务ID
+    :return:
+    """
+    task = agent.get_task(task_id)
+    if not task:
+        return jsonify({"status": "error", "message": "task not found"})
+    return jsonify(task)
+    pass
+
+
 @blueprint_project.route("/delete/<project_name>")
 @blueprint_project.route("/delete/<project_name>/<version_name>")
 @login_required
@@ -147,8 +162,22 @@ def project_exception_send():
 @blueprint_project.route("/start/<project_name>/<spider_name>/<version_name>")
 @login_required
 def project_spider_start(project_name, spider_name, version_name=None):
-    job_id = agent.start_spider(
+    job_id = agent.submit_spider(
         project_name=project_name, spider_name=spider_name,
         version_name=version_name)
-    flash('Start success! {}'.format(job_id))
+    flash('Queued! {}'.format(job_id))
+    return redirect(request.referrer)
+
+
+@blueprint_project.route("/start/<project_name>/<version_name>")
+@login_required
+def project_start_all(project_name, version_name):
+    """运行项目版本的全部爬虫"""
+    spider_names = agent.projects.get(project_name, {}).get(version_name, [])
+    job_ids = agent.submit_spiders([dict(
+        project_name=project_name,
+        spider_name=spider_name,
+        version_name=version_name,
+    ) for spider_name in spider_names])
+    flash('Queued {} jobs!'.format(len(job_ids)))
     return redirect(request.referrer)
@@ -54,7 +54,7 @@ def system_detail_manage():
 @blueprint_system.route("/detail/status", methods=['post'])
 @login_required
 def system_detail_status():
-    return jsonify(agent.get_master_performance())
+    return jsonify(dict(agent.get_master_performance()))
     pass
 
 
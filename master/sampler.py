@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# @Date  : 2019/1/15
+# @Author: lsj
+# @File  : sampler.py
+# @Desc  : 主节点性能指标采样
+默认Python版本支持：3.6
+后台线程按固定间隔调用psutil生成只读快照，读取方直接取最新快照，
+系统调用次数与页面刷新、接口调用次数无关
+"""
+
+import threading
+import time
+from types import MappingProxyType
+
+import psutil
+
+
+class PerformanceSampler(object):
+    """
+    性能指标采样器，每个进程一个
+    快照为只读映射，整体替换引用，读取无需加锁
+    """
+
+    def __init__(self, interval=5, on_sample=None):
+        """
+        初始函数
+        :param interval: 采样间隔，单位：秒
+        :param on_sample: 采样回调 func(t, snapshot)，例如写入时序存储
+        """
+        self.interval = interval
+        self.on_sample = on_sample
+        self.time = None  # 最新快照时间
+        self.snapshot = None  # 最新快照
+        self._last_time = None
+        self._last_disk_io = None
+        self._last_net_io = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()  # 采样本身串行，读取不加锁
+        pass
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.sample()
+        self._thread = threading.Thread(
+            target=self._run, name="PerformanceSampler", daemon=True)
+        self._thread.start()
+        pass
+
+    def stop(self):
+        self._stopped.set()
+        pass
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception:
+                pass  # 单次采样失败不影响后续采样
+        pass
+
+    def latest(self):
+        """最新快照，尚未采样时立即采样一次"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            snapshot = self.sample()
+        return snapshot
+
+    def sample(self):
+        """
+        采样一次，计算磁盘IO读写速度及网络IO收发速度
+        :return: 快照
+        """
+        with self._lock:
+            curr_time = time.time()  # 当前时间
+            disk_io = psutil.disk_io_counters()  # 磁盘IO状态
+            net_io = psutil.net_io_counters()  # 网络IO状态
+            speeds = dict.fromkeys(
+                ('disk_io_read', 'disk_io_write', 'net_io_sent',
+                 'net_io_receive'))
+            timedelta = curr_time - self._last_time \
+                if self._last_time else None
+            if timedelta:
+                # 分母 单位：KB/s
+                denominator = 1024 * timedelta
+                speeds['disk_io_read'] = round((
+                    disk_io.read_bytes - self._last_disk_io.read_bytes
+                ) / denominator, 2)
+                speeds['disk_io_write'] = round((
+                    disk_io.write_bytes - self._last_disk_io.write_bytes
+                ) / denominator, 2)
+                # 分母 单位：Kb/s
+                denominator = 1000 * timedelta
+                speeds['net_io_sent'] = round((
+                    net_io.bytes_sent - self._last_net_io.bytes_sent
+                ) / denominator, 2)
+                speeds['net_io_receive'] = round((
+                    net_io.bytes_recv - self._last_net_io.bytes_recv
+                ) / denominator, 2)
+            self._last_time = curr_time
+            self._last_disk_io = disk_io
+            self._last_net_io = net_io
+            snapshot = dict(
+                # 距上次采样的平均值，采样器是唯一调用方
+                cpu=psutil.cpu_percent(),
+                virtual_memory=psutil.virtual_memory().percent,
+                swap_memory=psutil.swap_memory().percent,
+                disk_usage=psutil.disk_usage('/').percent,
+                **speeds)
+            self.time = curr_time
+            self.snapshot = snapshot = MappingProxyType(snapshot)
+        if self.on_sample is not None:
+            self.on_sample(curr_time, snapshot)
+        return snapshot
+
+    pass
@@ -16,6 +16,8 @@ from apscheduler.schedulers.background import BackgroundScheduler
 
 import master.settings as settings
 from master.agents import agent
+from master.timeseries import tsdb
+from master.models import DispatchModel
 from master.models import JobsModel, JobsExceptionsModel
 from master.models import NodesModel, NodesExceptionsModel
 from master.models import PlansModel
@@ -32,19 +34,19 @@ logger = get_logger('Scheduler',
 '''========= Scheduler ========='''
 
 
-# 通过调度同步节点状态
-def sync_sys_performance_job():
-    logger.info('Start sync sys performance job')
-    agent.poll_system_performance()
-    logger.info('End sync sys performance job')
+# 通过调度保存节点性能指标时序数据
+def save_timeseries_job():
+    logger.info('Start save timeseries job')
+    tsdb.save()
+    logger.info('End save timeseries job')
     pass
 
 
-# 通过调度同步节点状态
-def sync_slaves_status_job():
-    logger.info('Start sync slaves status job')
-    agent.sync_slaves_status()
-    logger.info('End sync slaves status job')
+# 通过调度同步节点快照（节点状态、任务状态、性能指标、项目部署）
+def sync_nodes_snapshot_job():
+    logger.info('Start sync nodes snapshot job')
+    agent.sync_nodes_snapshot()
+    logger.info('End sync nodes snapshot job')
     pass
 
 
@@ -82,16 +84,12 @@ def sync_spiders_list_job():
     pass
 
 
-# 通过调度同步爬虫运行状态
-def sync_jobs_status_job():
-    """
-    sync job execution running status
-    通过调度同步爬虫运行状态
-    :return:
-    """
-    logger.info('Start sync jobs status job')
-    agent.sync_jobs_status()
-    logger.info('End sync jobs status job')
+# 通过调度分配排队中的运行请求
+def dispatch_queue_job():
+    logger.info('Start dispatch queue job')
+    dispatched = agent.dispatch_queue()
+    DispatchModel.del_expired(settings.DISPATCH_KEEP_HOURS)
+    logger.info('End dispatch queue job, {} dispatched'.format(dispatched))
     pass
 
 
@@ -194,15 +192,16 @@ def reload_runnable_spider_job_execution():
     def run_spider_job(project_name, spider_name, **spider_settings):
         """
         run spider by scheduler
-        通过调度运行爬虫任务
+        通过调度运行爬虫任务，提交至调度队列，节点有空闲进程时启动
         :param project_name: 项目名称
         :param spider_name: 爬虫名称
         :return:
         """
         msg = "{}-{}".format(project_name, spider_name)
         logger.info('Start run spider job:{}'.format(msg))
-        agent.start_spider(project_name, spider_name, **spider_settings)
-        logger.info('End run spider job:{}'.format(msg))
+        job_id = agent.submit_spider(
+            project_name, spider_name, **spider_settings)
+        logger.info('End run spider job:{}, queued {}'.format(msg, job_id))
         pass
 
     logger.info('Start reload runnable spider job execution')
@@ -274,16 +273,14 @@ def my_listener(event):
 
 scheduler.add_listener(my_listener, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
 # max_instances=10,
-scheduler.add_job(sync_sys_performance_job, 'interval',
-                  seconds=5, id="sync_sys_performance_job")
-scheduler.add_job(sync_slaves_status_job, 'interval',
-                  seconds=30, id="sync_slaves_status_job")
+scheduler.add_job(save_timeseries_job, 'interval',
+                  seconds=settings.TSDB_SAVE_INTERVAL, id="save_timeseries_job")
+scheduler.add_job(sync_nodes_snapshot_job, 'interval',
+                  seconds=20, id="sync_nodes_snapshot_job")
 scheduler.add_job(sync_nodes_exception_job, 'interval',
                   seconds=60, id="sync_nodes_exception_job")
-scheduler.add_job(sync_projects_list_job, 'interval',
-                  seconds=20, id="sync_projects_list_job")
-scheduler.add_job(sync_jobs_status_job, 'interval',
-                  seconds=20, id="sync_jobs_status_job")
+scheduler.add_job(dispatch_queue_job, 'interval',
+                  seconds=settings.DISPATCH_INTERVAL, id="dispatch_queue_job")
 scheduler.add_job(sync_jobs_exception_job, 'interval',
                   seconds=20, id="sync_jobs_exception_job")
 scheduler.add_job(sync_spider_statistics_job, 'interval',
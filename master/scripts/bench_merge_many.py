@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# @Date  : 2019/1/8
+# @Author: lsj
+# @File  : bench_merge_many.py
+# @Desc  : merge_one与merge_many写入性能对比
+默认Python版本支持：3.6
+python -m master.scripts.bench_merge_many --rows 10000
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from flask import Flask
+
+from master.models import db, JobsModel
+
+
+def make_rows(count, job_status='running'):
+    now = datetime.datetime.now()
+    return [dict(
+        job_id='job{:06d}'.format(i),
+        host_port='127.0.0.1:6800',
+        project_name='bench',
+        spider_name='spider{}'.format(i % 10),
+        start_time=now,
+        job_status=job_status,
+    ) for i in range(count)]
+
+
+def bench(name, func, rows):
+    start_time = time.time()
+    func(rows)
+    elapsed = time.time() - start_time
+    print('{:<36}{:>8} rows {:>8.2f}s {:>10.0f} rows/s'.format(
+        name, len(rows), elapsed, len(rows) / elapsed))
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    options = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + db_path
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    with app.app_context():
+        db.init_app(app)
+        db.create_all()
+
+        def merge_one(rows):
+            for row in rows:
+                JobsModel.merge_one(**row)
+
+        rows = make_rows(options.rows)
+        bench('merge_one (insert)', merge_one, rows)
+        bench('merge_one (unchanged)', merge_one, rows)
+        JobsModel.query.delete()
+        db.session.commit()
+        bench('merge_many (insert)', JobsModel.merge_many, rows)
+        bench('merge_many (unchanged)', JobsModel.merge_many, rows)
+        bench('merge_many (changed)', JobsModel.merge_many,
+              make_rows(options.rows, job_status='finished'))
+        assert JobsModel.query.count() == options.rows
+        assert JobsModel.query.filter_by(
+            job_status='finished').count() == options.rows
+    pass
+
+
+if __name__ == '__main__':
+    main()
@@ -18,6 +18,62 @@ DIR_LOGS = os.path.join(DIR_EXEC, "logs")  # 日志目录
 
 LOG_LEVEL = "INFO"  # DEBUG/INFO/WARNING/ERROR/CRITICAL
 
+# 节点请求参数
+SLAVE_POOL_SIZE = 10  # 单节点keep-alive连接池大小
+SLAVE_CONCURRENCY = 16  # 节点请求并发数（线程池大小）
+DEPLOY_CONCURRENCY = 8  # 项目发布并发节点数
+TASKS_KEEP = 100  # 保留的已结束后台任务数
+# 节点请求引擎 thread：线程池；asyncio：aiohttp事件循环线程
+AGENT_ENGINE = "thread"
+ASYNC_CONCURRENCY = 256  # asyncio引擎最大在途请求数
+SAMPLER_INTERVAL = 5  # 主节点性能指标采样间隔，单位：秒
+SNAPSHOT_CACHE_SECONDS = 60  # 节点快照性能指标缓存有效期，单位：秒
+# 运行节点选择策略 least_jobs/most_free/weighted/random，见placement.py
+PLACEMENT_STRATEGY = "least_jobs"
+DEFAULT_MAX_PROC = 4  # 未上报max_proc的节点默认最大进程数
+# 调度队列：运行请求在节点有空闲进程时才分配启动
+DISPATCH_INTERVAL = 5  # 调度间隔，单位：秒
+DISPATCH_BATCH_SIZE = 200  # 每轮最多检查的排队请求数
+DISPATCH_MAX_ATTEMPTS = 3  # 启动失败次数达到后不再重试
+DISPATCH_KEEP_HOURS = 24  # 已结束运行请求的保留时间，单位：小时
+# 节点健康状态（熔断）
+HEALTH_DEGRADED_FAILURES = 1  # 连续失败次数达到后降级，不再重试
+HEALTH_OPEN_FAILURES = 3  # 连续失败次数达到后熔断，请求直接失败
+HEALTH_BACKOFF_BASE = 5  # 熔断退避基数，逐次翻倍，单位：秒
+HEALTH_BACKOFF_MAX = 300  # 熔断退避上限，单位：秒
+HEALTH_TRANSITIONS_KEEP = 50  # 每个节点保留的状态变化记录数
+RETRY_DELAY_BASE = 0.2  # 请求重试间隔基数，逐次翻倍，单位：秒
+RETRY_DELAY_MAX = 2  # 请求重试间隔上限，单位：秒
+# 节点性能指标时序存储（SQLite文件）及写入间隔，单位：秒
+TSDB_PATH = os.path.join(DIR_ROOT, "timeseries.sqlite")
+TSDB_SAVE_INTERVAL = 300
+SLAVE_HISTORY_STEP = 5  # 拉取节点性能指标历史的聚合间隔，单位：秒
+# 节点性能告警：按滑动窗口统计值判断阈值，低于阈值*关闭比例时关闭
+ALERT_WINDOW = 300  # 统计窗口，单位：秒
+ALERT_STAT = "mean"  # 统计方法 mean/p95
+ALERT_CLEAR_RATIO = 0.9  # 关闭比例（迟滞）
+ALERT_MIN_SAMPLES = 3  # 窗口内最少有效样本数
+JOB_EXCEPTIONS_BATCH_SIZE = 200  # 每次批量检索日志异常的任务数
+# 运行日志查看：每次读取的窗口大小及上限，跟踪模式轮询间隔及单次连接时长
+LOG_WINDOW_SIZE = 64 * 1024  # 单位：字节
+LOG_WINDOW_MAX = 1024 * 1024  # 单位：字节
+LOG_FOLLOW_INTERVAL = 1  # 单位：秒
+LOG_FOLLOW_TIMEOUT = 20  # 单位：秒，单次跟踪请求最长等待，超时后浏览器自动重连
+# 节点接口超时时间 (连接超时, 读取超时)，单位：秒
+SLAVE_TIMEOUTS = {
+    "default": (3, 10),
+    "daemon_status.json": (2, 5),
+    "sys_performance.json": (2, 5),
+    "node_snapshot.json": (3, 15),
+    "schedule.json": (3, 30),
+    "schedule_batch.json": (3, 120),
+    "add_version.json": (3, 120),
+    "job_exception.json": (3, 30),
+    "job_exceptions_batch.json": (3, 120),
+    "search_logs.json": (3, 90),
+    "logs": (3, 30),
+}
+
 # MySQL配置 from urllib.parse import quote_plus
 # 数据库+数据库驱动://数据库用户名:密码@主机地址:端口/数据库?编码
 # mysql+pymysql://{}:{}@{}:{}/{}?charset={}
@@ -147,6 +147,56 @@ function getNodeStatus() {
         });
 }
 
+let historyChart = null;
+
+function getNodeHistory() {
+    let ajaxUrl = "/node/detail/history";
+    let id = $("#tBodyStatus").attr("data-id");
+    let metric = $("#historyMetric").val();
+    let metricName = $("#historyMetric option:selected").text();
+    if (!historyChart) {
+        historyChart = echarts.init(document.getElementById('chartHistory'));
+    }
+    $.ajax(
+        {
+            type: "POST",
+            async: true,
+            url: ajaxUrl,
+            data: {"id": id, "metrics": metric, "range": $("#historyRange").val()},
+            cache: false,
+            dataType: 'json',
+            beforeSend: function () {
+                return true;
+            },
+            success: function (data) {
+                if (!data || !data.series) {
+                    return  // 失败，请重试
+                }
+                let points = $.map(data.series[metric] || [], function (p) {
+                    return [[p[0] * 1000, p[1]]];  // 秒转毫秒
+                });
+                historyChart.setOption({
+                    title: {text: metricName, subtext: 'resolution: ' + data.resolution + 's'},
+                    tooltip: {trigger: 'axis'},
+                    xAxis: {type: 'time', splitLine: {show: false}},
+                    yAxis: {type: 'value', splitLine: {show: false}},
+                    series: [{
+                        name: metricName,
+                        type: 'line',
+                        showSymbol: false,
+                        connectNulls: false,
+                        data: points
+                    }]
+                }, true);
+            },
+            error: function (XMLHttpRequest, textStatus, errorThrown) {
+                alert("请求数据失败\r\n" + textStatus + "\r\n" + errorThrown);
+            },
+            complete: function (XMLHttpRequest, textStatus) {
+            }
+        });
+}
+
 function initDataException(dataList, pageSize, pageNum) {
     let tBody = $("#tBody");
     let is_closed = parseInt($("#dataType").val());
@@ -123,7 +123,10 @@ function setClients(event, clientAddress) {
                 return true;
             },
             success: function (dataList) {
-                let html = '<option value="auto">Auto</option>';
+                let html = '<option value="auto">Auto</option>' +
+                    '<option value="auto:least_jobs">Auto (least jobs)</option>' +
+                    '<option value="auto:most_free">Auto (most free slots)</option>' +
+                    '<option value="auto:weighted">Auto (weighted by CPU/memory)</option>';
                 $.each(dataList, function (key, value) {
                     html += '<option value="' + value + '">' + value + '</option>';
                 });
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+# @Date  : 2018/12/17
+# @Author: lsj
+# @File  : timeseries.py
+# @Desc  : 内置时序存储
+默认Python版本支持：3.6
+节点性能指标历史，无需外部InfluxDB：
+每个节点每个指标按分辨率各一个定长环形缓冲区（array('d')），
+原始5秒、1分钟、15分钟三级，低分辨率由高分辨率按时间桶求均值降采样；
+内存常驻，定期整体写入独立的SQLite文件，启动时加载
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from array import array
+
+import master.settings as settings
+
+# (分辨率秒数, 保留点数)：5秒×1小时、1分钟×1天、15分钟×31天
+RESOLUTIONS = ((5, 720), (60, 1440), (900, 2976))
+
+
+class RingBuffer(object):
+    """定长环形缓冲区，时间与数值分别保存在两个array('d')中"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.values = array('d', [math.nan]) * capacity
+        self.head = 0  # 下一个写入位置
+        self.count = 0
+        pass
+
+    def append(self, t, value):
+        self.times[self.head] = t
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        pass
+
+    @property
+    def oldest(self):
+        if not self.count:
+            return None
+        return self.times[(self.head - self.count) % self.capacity]
+
+    @property
+    def latest(self):
+        if not self.count:
+            return None
+        return self.times[(self.head - 1) % self.capacity]
+
+    def range(self, start=None, end=None):
+        """
+        按时间顺序返回[start, end]内的数据点
+        :return: [(t, value)]
+        """
+        points = []
+        first = (self.head - self.count) % self.capacity
+        for i in range(self.count):
+            index = (first + i) % self.capacity
+            t = self.times[index]
+            if (start is not None and t < start) or (
+                    end is not None and t > end):
+                continue
+            value = self.values[index]
+            points.append((t, None if math.isnan(value) else value))
+        return points
+
+    def dump(self):
+        return self.head, self.count, \
+            self.times.tobytes(), self.values.tobytes()
+
+    def load(self, head, count, times, values):
+        times_array, values_array = array('d'), array('d')
+        times_array.frombytes(times)
+        values_array.frombytes(values)
+        if len(times_array) != self.capacity:
+            # 保留点数配置变化，按时间顺序重新写入
+            old = RingBuffer(len(times_array))
+            old.head, old.count = head, count
+            old.times, old.values = times_array, values_array
+            for t, value in old.range():
+                self.append(t, math.nan if value is None else value)
+            return
+        self.head, self.count = head, count
+        self.times, self.values = times_array, values_array
+        pass
+
+    pass
+
+
+class Series(object):
+    """单个指标的多分辨率序列"""
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.rings = {r: RingBuffer(n) for r, n in resolutions}
+        self.buckets = {r: None for r, _ in resolutions[1:]}  # 降采样累加
+        self.raw = resolutions[0][0]
+        pass
+
+    def add(self, t, value):
+        self.rings[self.raw].append(t, value)
+        for resolution, bucket in self.buckets.items():
+            bucket_time = t - t % resolution
+            if bucket is not None and bucket[0] != bucket_time:
+                _, total, num = bucket
+                self.rings[resolution].append(
+                    bucket[0], total / num if num else math.nan)
+                bucket = None
+            if bucket is None:
+                bucket = [bucket_time, 0.0, 0]
+            if not math.isnan(value):
+                bucket[1] += value
+                bucket[2] += 1
+            self.buckets[resolution] = bucket
+        pass
+
+    def choose_resolution(self, start):
+        """覆盖起始时间的最高分辨率，均不覆盖时使用数据最早的分辨率"""
+        resolutions = sorted(self.rings)
+        best, best_oldest = resolutions[0], None
+        for resolution in resolutions:
+            oldest = self.rings[resolution].oldest
+            if oldest is None:
+                continue
+            if oldest <= start:
+                return resolution
+            if best_oldest is None or oldest < best_oldest:
+                best, best_oldest = resolution, oldest
+        return best
+
+    pass
+
+
+class TimeSeriesStore(object):
+    """
+    节点性能指标时序存储，线程安全
+    写入：调度线程 add()；查询：请求线程 query()
+    """
+
+    def __init__(self, path=None, resolutions=RESOLUTIONS):
+        self.path = path
+        self.resolutions = resolutions
+        self.series = {}  # {(node, metric): Series}
+        self._lock = threading.Lock()
+        pass
+
+    def add(self, node, metrics, t=None):
+        """
+        写入一个时间点的多个指标
+        :param node: 节点，例如"Master"、"127.0.0.1:6800"
+        :param metrics: {metric: value}，None表示缺失
+        :param t: 时间戳，默认当前时间
+        :return:
+        """
+        t = time.time() if t is None else t
+        with self._lock:
+            for metric, value in metrics.items():
+                key = (node, metric)
+                series = self.series.get(key)
+                if series is None:
+                    series = self.series[key] = Series(self.resolutions)
+                latest = series.rings[series.raw].latest
+                if latest is not None and t <= latest:
+                    continue  # 时间倒退或重复的点
+                series.add(t, math.nan if value is None else float(value))
+        pass
+
+    def add_columns(self, node, times, samples):
+        """
+        按列批量写入
+        :param node: 节点
+        :param times: [t]
+        :param samples: {metric: [value]}，与times一一对应
+        :return:
+        """
+        for index, t in enumerate(times):
+            self.add(node, {metric: values[index] for metric, values
+                            in samples.items() if index < len(values)}, t)
+        pass
+
+    def query(self, node, metrics=None, start=None, end=None,
+              resolution=None):
+        """
+        查询节点指标历史
+        :param node: 节点
+        :param metrics: 指标列表，默认全部
+        :param start: 开始时间戳，默认1小时前
+        :param end: 结束时间戳，默认当前时间
+        :param resolution: 分辨率，默认自动选择覆盖开始时间的最高分辨率
+        :return: {"resolution": 5, "series": {metric: [[t, value]]}}
+        """
+        end = time.time() if end is None else end
+        start = end - 3600 if start is None else start
+        with self._lock:
+            keys = [k for k in self.series if k[0] == node and (
+                not metrics or k[1] in metrics)]
+            if resolution not in dict(self.resolutions):
+                resolution = max([self.series[k].choose_resolution(start)
+                                  for k in keys] or [self.resolutions[0][0]])
+            resolution = int(resolution)
+            series = {
+                k[1]: [list(p) for p in
+                       self.series[k].rings[resolution].range(start, end)]
+                for k in keys}
+        return {"resolution": resolution, "series": series}
+
+    def window(self, start, end=None, metrics=None):
+        """
+        一次取出全部节点的原始分辨率窗口数据，用于批量告警评估
+        :param start: 开始时间戳
+        :param end: 结束时间戳，默认当前时间
+        :param metrics: 指标列表，默认全部
+        :return: {(node, metric): [value]}，None表示缺失
+        """
+        with self._lock:
+            return {key: [v for _, v in series.rings[series.raw].range(
+                start, end)] for key, series in self.series.items()
+                if not metrics or key[1] in metrics}
+
+    def nodes(self):
+        with self._lock:
+            return sorted(set(k[0] for k in self.series))
+
+    def drop(self, node):
+        """删除节点的全部指标"""
+        with self._lock:
+            for key in [k for k in self.series if k[0] == node]:
+                self.series.pop(key)
+        pass
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "create table if not exists ts_rings (node text, metric text, "
+            "resolution integer, head integer, count integer, "
+            "times blob, vals blob, primary key (node, metric, resolution))")
+        return conn
+
+    def save(self):
+        """整体写入SQLite，一个事务内完成"""
+        if not self.path:
+            return
+        with self._lock:
+            rows = [
+                (node, metric, resolution) + ring.dump()
+                for (node, metric), series in self.series.items()
+                for resolution, ring in series.rings.items()]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("delete from ts_rings")
+                conn.executemany(
+                    "insert into ts_rings (node, metric, resolution, head, "
+                    "count, times, vals) values (?,?,?,?,?,?,?)", rows)
+        finally:
+            conn.close()
+        pass
+
+    def load(self):
+        """从SQLite加载，未配置的分辨率忽略"""
+        if not self.path:
+            return
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "select node, metric, resolution, head, count, times, vals "
+                "from ts_rings").fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            for node, metric, resolution, head, count, times, values in rows:
+                key = (node, metric)
+                series = self.series.get(key)
+                if series is None:
+                    series = self.series[key] = Series(self.resolutions)
+                ring = series.rings.get(resolution)
+                if ring is not None:
+                    ring.load(head, count, times, values)
+        pass
+
+    pass
+
+
+# 节点性能指标时序存储
+tsdb = TimeSeriesStore(settings.TSDB_PATH)
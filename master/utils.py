@@ -4,6 +4,8 @@ import datetime
 import functools
 import hashlib
 import inspect
+import io
+import json
 import logging
 import mimetypes
 import netrc
@@ -14,6 +16,7 @@ import smtplib
 import socket
 import time
 import traceback
+import uuid
 from base64 import urlsafe_b64encode
 from email.encoders import encode_base64
 from email.mime.base import MIMEBase
@@ -748,6 +751,23 @@ def get_host_ip():
     return ip
 
 
+def is_host_address(host, address):
+    """
+    判断地址是否属于主机（主机名解析后的任一地址）
+    :param host: 主机名或ip
+    :param address: ip地址，如request.remote_addr
+    :return: True/False
+    """
+    if not host or not address:
+        return False
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except (socket.error, UnicodeError):
+        return False
+    return address in set(info[4][0] for info in infos)
+    pass
+
+
 def auth_header(usr, pwd, url=None):
     def _basic_auth_header(username, password):
         auth = "%s:%s" % (username, password)
@@ -771,17 +791,129 @@ def auth_header(usr, pwd, url=None):
     pass
 
 
-async def async_http_get(url, **kwargs):
+async def async_http_get(url, session=None, **kwargs):
+    if session is not None:
+        async with session.get(url, **kwargs) as response:
+            return await response.json(content_type=None)
     async with aiohttp.ClientSession() as session:
         async with session.get(url, **kwargs) as response:
-            print(time.time())
-            return await response.json()
+            return await response.json(content_type=None)
     pass
 
 
-async def async_http_post(url, **kwargs):
+async def async_http_post(url, session=None, **kwargs):
+    if session is not None:
+        async with session.post(url, **kwargs) as response:
+            return await response.json(content_type=None)
     async with aiohttp.ClientSession() as session:
         async with session.post(url, **kwargs) as response:
-            print(time.time())
-            return await response.json()
+            return await response.json(content_type=None)
+    pass
+
+
+def read_search_line(result, line):
+    """
+    合并search_logs.json返回的一行NDJSON
+    :param result: {"matches": [], "summary": None}
+    :param line: 一行，最后一行为检索摘要
+    :return:
+    """
+    line = line.strip()
+    if not line:
+        return
+    record = json.loads(line)
+    if "status" in record:
+        result["summary"] = record
+    else:
+        result["matches"].append(record)
+    pass
+
+
+class MultipartFileStream(object):
+    """
+    流式multipart/form-data请求体
+    文件内容按块从磁盘读取，长度预先计算，requests据此设置Content-Length
+    并分块发送，大文件无需整体读入内存；支持seek(0)以便失败重试
+    """
+
+    def __init__(self, fields, file_field, file_path, file_name=None,
+                 chunk_size=64 * 1024):
+        """
+        :param fields: 普通表单字段 {name: value}
+        :param file_field: 文件字段名
+        :param file_path: 文件路径
+        :param file_name: 上传文件名，默认取文件路径的文件名
+        :param chunk_size: 读取块大小
+        """
+        self.boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary={}'.format(
+            self.boundary)
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        file_name = file_name or os.path.basename(file_path)
+        head = b''
+        for name, value in fields.items():
+            head += self._part_header(name) + str(value).encode() + b'\r\n'
+        head += self._part_header(file_field, file_name)
+        self._head = head
+        self._tail = '\r\n--{}--\r\n'.format(self.boundary).encode()
+        self.len = (len(self._head) + os.path.getsize(file_path) +
+                    len(self._tail))
+        self._file = None
+        self._stage = 0  # 0：头部，1：文件，2：已结束
+        self._position = 0
+        pass
+
+    def _part_header(self, name, file_name=None):
+        disposition = 'form-data; name="{}"'.format(name)
+        if file_name:
+            disposition += '; filename="{}"'.format(file_name)
+        header = '--{}\r\nContent-Disposition: {}\r\n'.format(
+            self.boundary, disposition)
+        if file_name:
+            header += 'Content-Type: application/octet-stream\r\n'
+        return (header + '\r\n').encode()
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        pass
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise io.UnsupportedOperation('can only seek to the beginning')
+        self.close()
+        self._stage = 0
+        self._position = 0
+        return 0
+
+    def read(self, size=-1):
+        size = self.chunk_size if size is None or size < 0 else size
+        data = b''
+        if self._stage == 0:
+            data, self._stage = self._head, 1
+            self._file = open(self.file_path, 'rb')
+        elif self._stage == 1:
+            data = self._file.read(size)
+            if not data:
+                self.close()
+                data, self._stage = self._tail, 2
+        self._position += len(data)
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        pass
+
     pass
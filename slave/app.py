@@ -7,12 +7,16 @@ from twisted.python import log
 from twisted.web import server
 
 from slave.implementations import Environment
+from slave.implementations import ErrorIndex
 from slave.implementations import FilesystemEggStorage
+from slave.implementations import JobChanges
 from slave.implementations import Performance
 from slave.implementations import QueuePoller
 from slave.implementations import SpiderScheduler
 from slave.interfaces import IEggStorage
 from slave.interfaces import IEnvironment
+from slave.interfaces import IErrorIndex
+from slave.interfaces import IJobChanges
 from slave.interfaces import IPerformance
 from slave.interfaces import IPoller
 from slave.interfaces import ISpiderScheduler
@@ -25,26 +29,40 @@ def application(config):
     poll_interval = config.getfloat('poll_interval', 5)
 
     poller = QueuePoller(config)
-    performance = Performance()
+    performance = Performance(config.getint('performance_history', 600))
     egg_storage = FilesystemEggStorage(config)
-    scheduler = SpiderScheduler(config)
+    job_changes = JobChanges(config)
+    scheduler = SpiderScheduler(config, job_changes)
     environment = Environment(config)
+    error_index = ErrorIndex(config)
 
     app.setComponent(IPoller, poller)
     app.setComponent(IPerformance, performance)
     app.setComponent(IEggStorage, egg_storage)
     app.setComponent(ISpiderScheduler, scheduler)
     app.setComponent(IEnvironment, environment)
+    app.setComponent(IJobChanges, job_changes)
+    app.setComponent(IErrorIndex, error_index)
 
     lau_path = config.get('launcher', 'slave.launcher.Launcher')
     lau_cls = load_object(lau_path)
     launcher = lau_cls(config, app)
 
+    pusher_path = config.get('pusher', 'slave.pusher.EventPusher')
+    pusher_cls = load_object(pusher_path)
+    pusher = pusher_cls(config, app)
+
+    archiver_path = config.get('archiver', 'slave.archiver.LogArchiver')
+    archiver_cls = load_object(archiver_path)
+    archiver = archiver_cls(config, app)
+
     web_path = config.get('web_root', 'slave.website.Root')
     web_cls = load_object(web_path)
 
     timer_queue = TimerService(poll_interval, poller.poll)
     timer_performance = TimerService(1, performance.poll)
+    timer_error_index = TimerService(
+        config.getfloat('log_index_interval', 5), error_index.tail)
     webservice = TCPServer(http_port, server.Site(web_cls(config, app)),
                            interface=bind_address)
     log.msg(
@@ -53,8 +71,11 @@ def application(config):
         bind_address=bind_address, http_port=http_port)
 
     launcher.setServiceParent(app)
+    pusher.setServiceParent(app)
+    archiver.setServiceParent(app)
     timer_queue.setServiceParent(app)
     timer_performance.setServiceParent(app)
+    timer_error_index.setServiceParent(app)
     webservice.setServiceParent(app)
 
     return app
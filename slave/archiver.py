@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from twisted.application.service import IServiceCollection, Service
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+from twisted.python import log
+
+from slave.interfaces import IErrorIndex
+from slave.logfiles import archive_log
+
+
+class LogArchiver(Service):
+    """
+    Compress the logs of finished jobs into seekable block archives.
+    A log is archived once no process writes it, the error index is done
+    tailing it and it was not modified for `log_archive_delay` seconds.
+    Compression runs in a thread, one log after the other.
+    """
+    name = 'archiver'
+
+    def __init__(self, config, app):
+        self.app = app
+        self.enabled = config.getboolean('log_archive', True)
+        self.logs_dir = config.get('logs_dir', 'logs')
+        self.interval = config.getfloat('log_archive_interval', 300)
+        self.delay = config.getfloat('log_archive_delay', 600)
+        self.block_size = config.getint('log_archive_block_size', 1048576)
+        self._loop = None
+        self._archiving = False
+
+    def startService(self):
+        Service.startService(self)
+        if not self.enabled or not self.logs_dir:
+            return
+        self._loop = LoopingCall(self.archive)
+        self._loop.start(self.interval, now=False)
+
+    def stopService(self):
+        Service.stopService(self)
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+
+    def _busy_logs(self):
+        """Logs still written by a process or tailed by the error index"""
+        launcher = IServiceCollection(self.app, self.app).getServiceNamed(
+            'launcher')
+        busy = {p.logfile for p in launcher.processes.values()}
+        error_index = self.app.getComponent(IErrorIndex, None)
+        if error_index is not None:
+            busy.update(t[0] for t in error_index.tailers.values())
+        return {os.path.abspath(x) for x in busy if x}
+
+    def candidates(self):
+        busy = self._busy_logs()
+        expired = time.time() - self.delay
+        logs = []
+        for root, _, files in os.walk(self.logs_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if not name.endswith('.log') or \
+                        os.path.abspath(path) in busy:
+                    continue
+                try:
+                    if os.path.getmtime(path) < expired:
+                        logs.append(path)
+                except OSError:
+                    pass  # removed meanwhile
+        return logs
+
+    @inlineCallbacks
+    def archive(self):
+        if self._archiving:
+            return
+        self._archiving = True
+        try:
+            for path in self.candidates():
+                try:
+                    size, archived = yield deferToThread(
+                        archive_log, path, self.block_size)
+                    log.msg(format='Archived %(path)r: %(size)d -> '
+                                   '%(archived)d bytes', path=path,
+                            size=size, archived=archived, system='Archiver')
+                except Exception as e:
+                    log.msg(format='Failed to archive %(path)r: %(error)s',
+                            path=path, error=e, system='Archiver')
+        finally:
+            self._archiving = False
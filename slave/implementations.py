@@ -1,12 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import hashlib
+import math
 import os
 import re
 import time
+from array import array
+from datetime import datetime
 from distutils.version import LooseVersion
 from glob import glob
 from os import path, makedirs, remove
 from shutil import copyfileobj, rmtree
+from types import MappingProxyType
 
 import psutil
 from six import iteritems
@@ -14,15 +19,21 @@ from six.moves.configparser import NoSectionError
 from six.moves.urllib.parse import urlparse, urlunparse
 from twisted.internet.defer import DeferredQueue, maybeDeferred
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.threads import deferToThread
+from twisted.python import log
 from w3lib.url import path_to_file_uri
 from zope.interface import implementer
 
 from slave.interfaces import IEggStorage
 from slave.interfaces import IEnvironment
+from slave.interfaces import IErrorIndex
+from slave.interfaces import IJobChanges
 from slave.interfaces import IPoller, IPerformance
 from slave.interfaces import ISpiderQueue
 from slave.interfaces import ISpiderScheduler
-from slave.sqlite import JsonSqlitePriorityQueue
+from slave.logfiles import LogScanner, log_exists
+from slave.sqlite import JsonSqliteLog, JsonSqlitePriorityQueue
+from slave.sqlite import SqliteErrorIndex
 
 
 def get_project_list(config):
@@ -58,6 +69,7 @@ class FilesystemEggStorage(object):
 
     def __init__(self, config):
         self.basedir = config.get('eggs_dir', 'eggs')
+        self._digests = {}  # {egg_path: (mtime, size, sha256)}
 
     def put(self, egg_file, project, version):
         egg_path = self._egg_path(project, version)
@@ -89,6 +101,42 @@ class FilesystemEggStorage(object):
             if not self.list(project):  # remove project if no versions left
                 self.delete(project)
 
+    def digest(self, project, version):
+        egg_path = self._egg_path(project, version)
+        stat = os.stat(egg_path)
+        cached = self._digests.get(egg_path)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2], stat.st_size
+        sha256 = hashlib.sha256()
+        with open(egg_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha256.update(chunk)
+        self._digests[egg_path] = (
+            stat.st_mtime, stat.st_size, sha256.hexdigest())
+        return sha256.hexdigest(), stat.st_size
+
+    def manifest(self, project=None):
+        if project:
+            projects = [project]
+        elif path.exists(self.basedir):
+            projects = sorted(os.listdir(self.basedir))
+        else:
+            projects = []
+        items = []
+        for project_name in projects:
+            for version in self.list(project_name):
+                try:
+                    sha256, size = self.digest(project_name, version)
+                except OSError:  # version deleted while listing
+                    continue
+                items.append({
+                    "project": project_name,
+                    "version": version,
+                    "sha256": sha256,
+                    "size": size,
+                })
+        return items
+
     def _egg_path(self, project, version):
         sanitized_version = re.sub(r'[^a-zA-Z0-9_-]', '_', version)
         x = path.join(self.basedir, project, "%s.egg" % sanitized_version)
@@ -147,13 +195,33 @@ class Environment(object):
             file_dir, message['_project'], message['_spider'])
         if not os.path.exists(logs_dir):
             os.makedirs(logs_dir)
+        # count by job, deleting archived logs with their index
+        # (<job>.log.gz[.idx]); *.tmp files are archives being written
+        jobs = {}
+        for x in os.listdir(logs_dir):
+            if x.endswith('.tmp'):
+                continue
+            jobs.setdefault(x.split('.', 1)[0], []).append(
+                os.path.join(logs_dir, x))
         to_delete = sorted(
-            (os.path.join(logs_dir, x) for x in os.listdir(logs_dir)),
-            key=os.path.getmtime)[:-self.jobs_to_keep]
-        for x in to_delete:
-            os.remove(x)
+            jobs.values(),
+            key=lambda files: max(map(self._getmtime, files))
+        )[:-self.jobs_to_keep]
+        for files in to_delete:
+            for x in files:
+                try:
+                    os.remove(x)
+                except OSError:
+                    pass  # replaced or removed meanwhile by archive_log
         return os.path.join(logs_dir, "%s.%s" % (message['_job'], ext))
 
+    @staticmethod
+    def _getmtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return 0
+
 
 @implementer(IPoller)
 class QueuePoller(object):
@@ -187,9 +255,27 @@ class QueuePoller(object):
 
 @implementer(IPerformance)
 class Performance(object):
-    """Statistical system performance."""
+    """Statistical system performance.
 
-    def __init__(self):
+    Every poll is kept in a fixed-size ring buffer: one array('d') of
+    timestamps and one array('f') per metric, so the last `history_size`
+    samples cost a fixed amount of memory and can be fetched at once.
+    The latest poll is also published as a read-only `snapshot`, so the
+    web services never call psutil themselves.
+    """
+
+    metrics = ('cpu', 'virtual_memory', 'swap_memory', 'disk_usage',
+               'disk_io_read', 'disk_io_write', 'net_io_sent',
+               'net_io_receive')
+
+    def __init__(self, history_size=600):
+        self.history_size = max(int(history_size), 1)
+        self._times = array('d', [0.0]) * self.history_size
+        self._values = {m: array('f', [math.nan]) * self.history_size
+                        for m in self.metrics}
+        self._head = 0  # next write position
+        self._count = 0
+        self.snapshot = MappingProxyType(dict.fromkeys(self.metrics))
         self.disk_io_read_speed = None
         self.disk_io_write_speed = None
         self.net_io_sent_speed = None
@@ -230,26 +316,93 @@ class Performance(object):
         self._last_net_io_sent_bytes = net_io.bytes_sent
         self._last_net_io_receive_bytes = net_io.bytes_recv
 
+        sample = MappingProxyType({
+            'cpu': psutil.cpu_percent(),
+            'virtual_memory': psutil.virtual_memory().percent,
+            'swap_memory': psutil.swap_memory().percent,
+            'disk_usage': psutil.disk_usage('/').percent,
+            'disk_io_read': self.disk_io_read_speed,
+            'disk_io_write': self.disk_io_write_speed,
+            'net_io_sent': self.net_io_sent_speed,
+            'net_io_receive': self.net_io_receive_speed,
+        })
+        self._record(curr_time, sample)
+        self.snapshot = sample
+        pass
+
+    def _record(self, t, sample):
+        self._times[self._head] = t
+        for metric, values in self._values.items():
+            value = sample.get(metric)
+            values[self._head] = math.nan if value is None else value
+        self._head = (self._head + 1) % self.history_size
+        self._count = min(self._count + 1, self.history_size)
         pass
 
+    def history(self, since=None, step=None):
+        """
+        Samples newer than `since`, oldest first, in columns.
+        With `step` (seconds) the samples are averaged per step-aligned
+        bucket and only complete buckets are returned, so `since` can be
+        the last bucket time returned by the previous call.
+        :return: {"times": [t], "samples": {metric: [value]}}
+        """
+        first = (self._head - self._count) % self.history_size
+        indexes = [(first + i) % self.history_size
+                   for i in range(self._count)]
+        if not step:
+            if since is not None:
+                indexes = [i for i in indexes if self._times[i] > since]
+            return {
+                "times": [self._times[i] for i in indexes],
+                "samples": {m: [None if math.isnan(v[i]) else round(v[i], 2)
+                                for i in indexes]
+                            for m, v in self._values.items()},
+            }
+        latest = self._times[(self._head - 1) % self.history_size] \
+            if self._count else 0
+        buckets = []  # [(bucket_time, [index])]
+        for i in indexes:
+            t = self._times[i]
+            bucket_time = t - t % step
+            if since is not None and bucket_time <= since:
+                continue
+            if bucket_time + step > latest:
+                break  # incomplete bucket
+            if not buckets or buckets[-1][0] != bucket_time:
+                buckets.append((bucket_time, []))
+            buckets[-1][1].append(i)
+        samples = {}
+        for metric, values in self._values.items():
+            column = samples[metric] = []
+            for _, bucket in buckets:
+                points = [values[i] for i in bucket
+                          if not math.isnan(values[i])]
+                column.append(round(sum(points) / len(points), 2)
+                              if points else None)
+        return {
+            "times": [bucket_time for bucket_time, _ in buckets],
+            "samples": samples,
+        }
+
     @property
     def cpu_percent(self):
-        return psutil.cpu_percent()
+        return self.snapshot['cpu']
         pass
 
     @property
     def virtual_memory_percent(self):
-        return psutil.virtual_memory().percent
+        return self.snapshot['virtual_memory']
         pass
 
     @property
     def swap_memory_percent(self):
-        return psutil.swap_memory().percent
+        return self.snapshot['swap_memory']
         pass
 
     @property
     def disk_usage_percent(self):
-        return psutil.disk_usage('/').percent
+        return self.snapshot['disk_usage']
         pass
 
     pass
@@ -258,14 +411,26 @@ class Performance(object):
 @implementer(ISpiderScheduler)
 class SpiderScheduler(object):
 
-    def __init__(self, config):
+    def __init__(self, config, changes=None):
         self.config = config
+        self.changes = changes
         self.queues = dict()
         self.update_projects()
 
     def schedule(self, project, spider_name, **spider_args):
         q = self.queues[project]
         q.add(spider_name, **spider_args)
+        if self.changes is not None:
+            self.changes.record(project, spider_name, spider_args.get('_job'),
+                                'pending')
+
+    def schedule_many(self, project, jobs):
+        q = self.queues[project]
+        q.add_many(jobs)
+        if self.changes is not None:
+            self.changes.record_many([
+                (project, spider_name, spider_args.get('_job'), 'pending')
+                for spider_name, spider_args in jobs])
 
     def list_projects(self):
         return self.queues.keys()
@@ -274,6 +439,154 @@ class SpiderScheduler(object):
         self.queues = get_spider_queues(self.config)
 
 
+@implementer(IErrorIndex)
+class ErrorIndex(object):
+    """
+    Tail the log of every running job and index its error blocks.
+
+    Each `tail()` scans at most `log_index_budget` new bytes per log, from
+    where the previous pass stopped, so every byte of a log is scanned
+    once while the crawl runs. Scans run in a thread, one log after the
+    other, so the reactor is never blocked. A log is tailed until its
+    process ended and the end of file was reached, then the job is
+    marked done.
+
+    Jobs left incomplete by a previous run of the slave have no process
+    any more: they are tailed as ended, from the stored offset, so they
+    are completed by the next passes.
+    """
+
+    def __init__(self, config):
+        dbs_dir = config.get('dbs_dir', 'dbs')
+        if not os.path.exists(dbs_dir):
+            os.makedirs(dbs_dir)
+        self.logs_dir = config.get('logs_dir', 'logs')
+        self.jobs_to_keep = config.getint('log_index_jobs_to_keep', 1000)
+        self.index = SqliteErrorIndex(os.path.join(dbs_dir, 'error_index.db'))
+        self.scanner = LogScanner(
+            config.getint('log_index_budget', 1024 * 1024))
+        self.tailers = {}  # {(project, spider, job): [path, offset, ended]}
+        self._resume()
+
+    def _resume(self):
+        """Tail the jobs a previous run did not complete as ended"""
+        for project, spider, job, offset in self.index.pending():
+            if self.logs_dir:
+                path = os.path.join(
+                    self.logs_dir, project, spider, '%s.log' % job)
+                self.tailers[(project, spider, job)] = [path, offset, True]
+            else:
+                self.index.update(project, spider, job, offset, done=True)
+
+    def watch(self, project, spider, job, path):
+        self.tailers[(project, spider, job)] = [path, 0, False]
+        self.index.update(project, spider, job, 0)
+        if len(self.index) > self.jobs_to_keep + 100:
+            self.index.trim(self.jobs_to_keep)
+
+    def ended(self, project, spider, job):
+        tailer = self.tailers.get((project, spider, job))
+        if tailer is not None:
+            tailer[2] = True
+
+    @inlineCallbacks
+    def tail(self):
+        for key, tailer in list(self.tailers.items()):
+            path, offset, ended = tailer
+            try:
+                if not log_exists(path):
+                    result = {"offset": offset, "eof": True, "offsets": [],
+                              "errors": []}
+                else:
+                    result = yield deferToThread(
+                        self.scanner.scan, path, offset)
+                if self.tailers.get(key) is not tailer:
+                    continue  # watched again meanwhile
+                done = ended and result["eof"]
+                if result["offset"] != offset or result["errors"] or done:
+                    self.index.update(
+                        *key, offset=result["offset"], done=done,
+                        errors=[(o,) + tuple(e) for o, e in zip(
+                            result["offsets"], result["errors"])])
+                tailer[1] = result["offset"]
+                if done:
+                    self.tailers.pop(key)
+            except Exception as e:
+                log.msg(format='Failed to tail %(path)r: %(error)s',
+                        path=path, error=e, system='ErrorIndex')
+
+    def get(self, project, spider, job, offset=0):
+        return self.index.get(project, spider, job, offset)
+
+
+@implementer(IJobChanges)
+class JobChanges(object):
+
+    def __init__(self, config):
+        dbs_dir = config.get('dbs_dir', 'dbs')
+        if not os.path.exists(dbs_dir):
+            os.makedirs(dbs_dir)
+        self.changes_to_keep = config.getint('changes_to_keep', 10000)
+        self.log = JsonSqliteLog(os.path.join(dbs_dir, 'job_changes.db'))
+        self.listeners = []  # called with (seq, change) after each record
+
+    @property
+    def epoch(self):
+        return self.log.epoch
+
+    def record(self, project, spider, job, state, **details):
+        change = {
+            "project": project,
+            "spider": spider,
+            "job": job,
+            "state": state,
+            "time": datetime.now().isoformat(' '),
+        }
+        change.update(details)
+        seq = self.log.append(change)
+        if seq % 1000 == 0:
+            self.log.trim(self.changes_to_keep)
+        for listener in self.listeners:
+            listener(seq, change)
+        return seq
+
+    def record_many(self, records):
+        """Record (project, spider, job, state) tuples in one transaction"""
+        now = datetime.now().isoformat(' ')
+        changes = [{
+            "project": project,
+            "spider": spider,
+            "job": job,
+            "state": state,
+            "time": now,
+        } for project, spider, job, state in records]
+        seqs = self.log.append_many(changes)
+        if seqs and seqs[-1] // 1000 != (seqs[0] - 1) // 1000:
+            self.log.trim(self.changes_to_keep)
+        for seq, change in zip(seqs, changes):
+            for listener in self.listeners:
+                listener(seq, change)
+        return seqs
+
+    def since(self, seq=0, limit=1000):
+        last_seq = self.log.last_seq()
+        # the cursor is invalid when ahead of the log (rebuilt) or when the
+        # changes it needs were already cleaned up
+        reset = seq > last_seq or (
+                len(self.log) > 0 and seq < self.log.first_seq() - 1)
+        changes = []
+        for change_seq, change in self.log.since(0 if reset else seq, limit):
+            change["seq"] = change_seq
+            changes.append(change)
+        return {
+            "changes": changes,
+            "seq": changes[-1]["seq"] if changes else last_seq,
+            "last_seq": last_seq,
+            "epoch": self.log.epoch,
+            "reset": reset,
+        }
+
+
 @implementer(ISpiderQueue)
 class SqliteSpiderQueue(object):
 
@@ -286,6 +599,14 @@ class SqliteSpiderQueue(object):
         priority = float(d.pop('priority', 0))
         self.q.put(d, priority)
 
+    def add_many(self, jobs):
+        items = []
+        for name, spider_args in jobs:
+            d = spider_args.copy()
+            d['name'] = name
+            items.append((d, float(d.pop('priority', 0))))
+        self.q.put_many(items)
+
     def pop(self):
         return self.q.pop()
 
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from zope.interface import Interface
+from zope.interface import Attribute, Interface
 
 
 class IEggStorage(Interface):
@@ -24,6 +24,14 @@ class IEggStorage(Interface):
         """Delete the egg stored for the given project and version. If should
         also delete the project if no versions are left"""
 
+    def digest(project, version):
+        """Return a tuple (sha256, size) of the egg stored for the given
+        project and version"""
+
+    def manifest(project=None):
+        """Return a list of dicts (project, version, sha256, size) describing
+        every stored egg, or only the eggs of the given project"""
+
 
 class IPoller(Interface):
     """A component that polls for projects that need to run"""
@@ -57,6 +65,10 @@ class ISpiderQueue(Interface):
 
         This method can return a deferred. """
 
+    def add_many(jobs):
+        """Add a list of (name, spider_args) to the queue in a single
+        transaction."""
+
     def pop():
         """Pop the next mesasge from the queue. The messages is a dict
         conaining a key 'name' with the spider name and other keys as spider
@@ -93,6 +105,10 @@ class ISpiderScheduler(Interface):
     def schedule(project, spider_name, **spider_args):
         """Schedule a spider for the given project"""
 
+    def schedule_many(project, jobs):
+        """Schedule a list of (spider_name, spider_args) for the given
+        project in a single queue transaction"""
+
     def list_projects():
         """Return the list of available projects"""
 
@@ -101,6 +117,48 @@ class ISpiderScheduler(Interface):
         projects"""
 
 
+class IJobChanges(Interface):
+    """A component that records job state transitions in a monotonically
+    increasing change sequence"""
+
+    listeners = Attribute("""Callables invoked with (seq, change) after
+    each recorded change""")
+
+    def record(project, spider, job, state, **details):
+        """Record a job state transition (pending, running, finished or
+        canceled) and return its sequence number"""
+
+    def record_many(records):
+        """Record a list of (project, spider, job, state) transitions in a
+        single transaction and return their sequence numbers"""
+
+    def since(seq=0, limit=1000):
+        """Return a dict with the changes after the given sequence number
+        (`changes`), the last sequence number (`seq`), the log epoch
+        (`epoch`) and whether the cursor is no longer valid (`reset`)"""
+
+
+class IErrorIndex(Interface):
+    """A component that tails the logs of running jobs and indexes their
+    ERROR/CRITICAL blocks"""
+
+    def watch(project, spider, job, path):
+        """Start tailing the log file of a job that was just started"""
+
+    def ended(project, spider, job):
+        """Called when the process of a job ended; the log is tailed until
+        its end of file and the job is then marked done"""
+
+    def tail():
+        """Called periodically to scan the new bytes of the watched logs;
+        may return a Deferred, the next call waits for it"""
+
+    def get(project, spider, job, offset=0):
+        """Return {"offset", "done", "errors": [(offset, exc_time,
+        exc_level, message)]} with the error blocks at or after the byte
+        `offset`, or None if the job is not indexed"""
+
+
 class IEnvironment(Interface):
     """A component to generate the environment of crawler processes"""
 
@@ -120,3 +178,11 @@ class IPerformance(Interface):
 
     def poll():
         """Called periodically to poll for projects"""
+
+    snapshot = Attribute("""Read-only mapping of the latest poll, replaced
+    as a whole on every poll""")
+
+    def history(since=None, step=None):
+        """Return the samples recorded after `since`, optionally averaged
+        per `step` seconds, as {"times": [...], "samples": {metric: [...]}}
+        """
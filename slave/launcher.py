@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
 import sys
+import time
 from datetime import datetime
 from multiprocessing import cpu_count
 
@@ -9,7 +11,11 @@ from twisted.internet import reactor, defer, protocol, error
 from twisted.python import log
 
 from slave import __version__
-from slave.interfaces import IPoller, IEnvironment
+from slave.interfaces import IPoller, IEnvironment, IJobChanges
+from slave.interfaces import IErrorIndex
+from slave.logfiles import parse_stats
+from slave.telemetry import TelemetryChannel, FIELDS
+from slave.telemetry import ENV_FILE, ENV_SLOT, ENV_INTERVAL
 from slave.utils import get_crawl_args, native_stringify_dict
 
 
@@ -23,8 +29,20 @@ class Launcher(Service):
         self.max_proc = self._get_max_proc(config)
         self.runner = config.get('runner', 'slave.runner')
         self.app = app
+        self.live_stats = config.getboolean('live_stats', True)
+        self.live_stats_interval = config.getfloat('live_stats_interval', 5)
+        self.live_stats_file = os.path.join(
+            config.get('dbs_dir', 'dbs'), 'live_stats.mmap')
+        self.telemetry = None
 
     def startService(self):
+        if self.live_stats:
+            try:
+                self.telemetry = TelemetryChannel(
+                    self.live_stats_file, self.max_proc, create=True)
+            except (OSError, ValueError) as e:
+                log.msg(format='Live stats disabled: %(error)s', error=e,
+                        system='Launcher')
         for slot in range(self.max_proc):
             self._wait_for_project(slot)
         fmt = 'Spider Platform Slave %(version)s started: ' \
@@ -46,20 +64,87 @@ class Launcher(Service):
         e = self.app.getComponent(IEnvironment)
         env = e.get_environment(msg, slot)
         env = native_stringify_dict(env, keys_only=False)
+        if self.telemetry is not None:
+            self.telemetry.reset(slot)
+            env[ENV_FILE] = self.live_stats_file
+            env[ENV_SLOT] = str(slot)
+            env[ENV_INTERVAL] = str(self.live_stats_interval)
         pp = ScrapyProcessProtocol(
             slot, project, msg['_spider'], msg['_job'], env)
         pp.deferred.addBoth(self._process_finished, slot)
         reactor.spawnProcess(pp, sys.executable, args=args, env=env)
         self.processes[slot] = pp
+        self._record_change(pp, 'running')
+        error_index = self.app.getComponent(IErrorIndex, None)
+        if error_index is not None and pp.logfile:
+            error_index.watch(pp.project, pp.spider, pp.job, pp.logfile)
 
     def _process_finished(self, _, slot):
         process = self.processes.pop(slot)
         process.end_time = datetime.now()
+        process.stats = self._parse_stats(process)
+        if self.telemetry is not None:
+            self.telemetry.reset(slot)
         self.finished.append(process)
         # keep last 100 finished jobs
         del self.finished[:-self.finished_to_keep]
+        self._record_change(process, 'finished')
+        error_index = self.app.getComponent(IErrorIndex, None)
+        if error_index is not None:
+            error_index.ended(process.project, process.spider, process.job)
         self._wait_for_project(slot)
 
+    def _record_change(self, process, state):
+        changes = self.app.getComponent(IJobChanges, None)
+        if changes is None:
+            return
+        details = {"pid": process.pid,
+                   "start_time": process.start_time.isoformat(' ')}
+        if process.end_time:
+            details["end_time"] = process.end_time.isoformat(' ')
+        if process.stats:
+            details["stats"] = process.stats
+        changes.record(process.project, process.spider, process.job, state,
+                       **details)
+
+    def get_live_stats(self):
+        """
+        Latest telemetry of the running processes, read from the channel
+        :return: [{"project", "spider", "job", "pid", "age", field: value}],
+                 the fields are None until the process wrote them
+        """
+        now = time.time()
+        jobs = []
+        for slot, process in sorted(self.processes.items()):
+            record = self.telemetry.read(slot) \
+                if self.telemetry is not None else None
+            if record is not None and record[0] != process.pid:
+                record = None  # left over by the previous process
+            values = record[1] if record else dict.fromkeys(FIELDS)
+            job = {
+                "project": process.project,
+                "spider": process.spider,
+                "job": process.job,
+                "pid": process.pid,
+                "start_time": process.start_time.isoformat(' '),
+                # seconds since the last write, a stalled process grows it
+                "age": round(now - values['time'], 3) if record else None,
+            }
+            job.update(values)
+            jobs.append(job)
+        return jobs
+
+    def _parse_stats(self, process):
+        """Crawl stats dumped to the log by Scrapy, None if not found"""
+        if not process.logfile:
+            return None
+        try:
+            return parse_stats(process.logfile)
+        except Exception as e:
+            log.msg(format='Failed to parse stats of %(log)r: %(error)s',
+                    log=process.logfile, error=e, system='Launcher')
+            return None
+
     def _get_max_proc(self, config):
         max_proc = config.getint('max_proc', 0)
         if not max_proc:
@@ -81,6 +166,7 @@ class ScrapyProcessProtocol(protocol.ProcessProtocol):
         self.job = job
         self.start_time = datetime.now()
         self.end_time = None
+        self.stats = None  # crawl stats parsed from the log when finished
         self.env = env
         self.logfile = env.get('SCRAPY_LOG_FILE')
         self.items_file = env.get('SCRAPY_FEED_URI')
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import bisect
+import datetime
+import gzip
+import os
+import re
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from twisted.internet import defer, reactor
+
+# log level：CRITICAL > ERROR > WARNING > INFO > DEBUG,NOTSET
+LOG_HEADER = re.compile(
+    br'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \[.*?\] '
+    br'(CRITICAL|ERROR|WARNING|INFO|DEBUG|NOTSET):', flags=re.I)
+ERROR_LEVELS = (b'CRITICAL', b'ERROR')
+STATS_HEADER = b'Dumping Scrapy stats:'
+STATS_LINE = re.compile(r"^[{ ]'(?P<key>[^']+)': (?P<value>.*?),?$")
+STATS_DATETIME = re.compile(r'^datetime\.datetime\(([\d, ]+)')
+ARCHIVE_EXT = '.gz'  # archived log: <job>.log.gz
+INDEX_EXT = '.idx'  # block index: <job>.log.gz.idx
+
+
+def archive_log(path, block_size=1024 * 1024, level=6):
+    """
+    Compress a finished log into `path`.gz and remove it.
+
+    Every `block_size` bytes of the log are compressed as an independent
+    gzip member, so the archive is still a valid gzip file (zcat works)
+    and any byte range can be read by decompressing only the members
+    that cover it. The `path`.gz.idx sidecar holds the (log offset,
+    archive offset) of every member plus the end of both files, as
+    unsigned 64-bit integers.
+    :return: (log size, archive size)
+    """
+    gz_path = path + ARCHIVE_EXT
+    index = array('Q')
+    with open(path, 'rb') as src, open(gz_path + '.tmp', 'wb') as dst:
+        offset = 0
+        while True:
+            block = src.read(block_size)
+            if not block:
+                break
+            index.extend((offset, dst.tell()))
+            dst.write(gzip.compress(block, level))
+            offset += len(block)
+        index.extend((offset, dst.tell()))
+    with open(gz_path + INDEX_EXT + '.tmp', 'wb') as f:
+        f.write(index.tobytes())
+    os.replace(gz_path + INDEX_EXT + '.tmp', gz_path + INDEX_EXT)
+    stat = os.stat(path)
+    # keep the time the job stopped writing, used to find logs by time
+    os.utime(gz_path + '.tmp', (stat.st_atime, stat.st_mtime))
+    os.replace(gz_path + '.tmp', gz_path)
+    os.remove(path)
+    return index[-2], index[-1]
+
+
+class ArchivedLog(object):
+    """
+    Read-only binary file object over an archived log: seek/tell/read use
+    offsets of the original log and only the gzip members covering the
+    requested bytes are decompressed (the last one is kept).
+    """
+
+    def __init__(self, gz_path):
+        index = array('Q')
+        with open(gz_path + INDEX_EXT, 'rb') as f:
+            index.frombytes(f.read())
+        self.offsets = index[0::2]  # log offset of every member, and end
+        self.positions = index[1::2]  # archive offset of every member
+        self.size = self.offsets[-1]
+        self._file = open(gz_path, 'rb')
+        self._pos = 0
+        self._block = (None, b'')
+
+    def _read_block(self, i):
+        if self._block[0] != i:
+            self._file.seek(self.positions[i])
+            data = self._file.read(self.positions[i + 1] - self.positions[i])
+            self._block = (i, zlib.decompress(data, 16 + zlib.MAX_WBITS))
+        return self._block[1]
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else \
+            min(self._pos + size, self.size)
+        parts = []
+        while self._pos < end:
+            i = bisect.bisect_right(self.offsets, self._pos) - 1
+            start = self._pos - self.offsets[i]
+            data = self._read_block(i)[start:start + end - self._pos]
+            parts.append(data)
+            self._pos += len(data)
+        return b''.join(parts)
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_log(path):
+    """Open a job log for binary reading, archived or not"""
+    if not os.path.exists(path) and \
+            os.path.exists(path + ARCHIVE_EXT + INDEX_EXT):
+        return ArchivedLog(path + ARCHIVE_EXT)
+    return open(path, 'rb')
+
+
+def log_exists(path):
+    return os.path.exists(path) or \
+        os.path.exists(path + ARCHIVE_EXT + INDEX_EXT)
+
+
+def log_size(path):
+    """Size of the original log, 0 if it does not exist"""
+    if not log_exists(path):
+        return 0
+    with open_log(path) as f:
+        return f.seek(0, 2)
+
+
+class LogScanner(object):
+    """
+    Find the error blocks of a Scrapy log without reading it whole.
+
+    The log is read in binary chunks and split into lines. A line starting
+    with a log header opens a block, the following lines without a header
+    (tracebacks) belong to it. Only CRITICAL/ERROR blocks are kept, each
+    capped at `max_message` bytes, so memory does not depend on the log
+    size. A call reads at most `budget` bytes and returns a byte offset
+    cursor to resume from: it always points at the start of a line, and
+    at the header of an error block that may still grow.
+    """
+
+    def __init__(self, budget=4 * 1024 * 1024, chunk_size=64 * 1024,
+                 max_message=64 * 1024):
+        self.budget = budget
+        self.chunk_size = chunk_size
+        self.max_message = max_message
+
+    def scan(self, path, offset=0, budget=None):
+        """
+        :param path: the log file path
+        :param offset: byte offset returned by the previous call
+        :param budget: max bytes to read in this call
+        :return: {"offset": cursor, "eof": True when the end of the file
+                  was reached, "size": file size,
+                  "errors": [(exc_time, exc_level, exc_message)],
+                  "offsets": [byte offset of each error block]}
+        """
+        budget = budget or self.budget
+        blocks = []
+        with open_log(path) as f:
+            f.seek(0, 2)
+            size = f.tell()
+            if offset > size:
+                offset = 0  # log file truncated, start over
+            f.seek(offset)
+            state = _ScanState(offset, self.max_message, blocks)
+            buf = b''
+            read = 0
+            eof = False
+            while read < budget:
+                chunk = f.read(min(self.chunk_size, budget - read))
+                if not chunk:
+                    eof = True
+                    break
+                read += len(chunk)
+                lines = (buf + chunk).split(b'\n')
+                buf = lines.pop()
+                for line in lines:
+                    state.feed(line)
+            else:
+                eof = f.read(1) == b''
+        if eof:
+            if buf:
+                state.feed(buf, complete=False)
+            state.flush()
+        elif state.cursor == offset:
+            # a single block or line larger than the budget: give up on
+            # completing it rather than rereading it forever
+            state.flush()
+            state.cursor = offset + read - len(buf)
+            if state.cursor == offset:
+                state.cursor = offset + read
+        return {
+            "offset": state.cursor,
+            "eof": eof,
+            "size": size,
+            "errors": [block[1:] for block in blocks],
+            "offsets": [block[0] for block in blocks],
+        }
+
+    pass
+
+
+class _ScanState(object):
+    """Line-oriented state machine of LogScanner.scan"""
+
+    def __init__(self, offset, max_message, blocks):
+        self.pos = offset  # start of the next line
+        self.cursor = offset  # where the next scan resumes
+        self.max_message = max_message
+        self.blocks = blocks
+        # current error block [start, time, level, size, lines]
+        self.block = None
+
+    def feed(self, line, complete=True):
+        start = self.pos
+        self.pos += len(line) + (1 if complete else 0)
+        match = LOG_HEADER.match(line)
+        if match:
+            self.flush()
+            if match.group(2).upper() in ERROR_LEVELS:
+                self.block = [start, match.group(1), match.group(2), 0, []]
+                self.cursor = start
+        if self.block is not None:
+            self.block[3] += len(line) + 1
+            if self.block[3] <= self.max_message:
+                self.block[4].append(line)
+        elif complete:
+            self.cursor = self.pos
+
+    def flush(self):
+        """Emit the current error block, if any"""
+        if self.block is None:
+            return
+        start, exc_time, exc_level, _, lines = self.block
+        self.block = None
+        message = b'\n'.join(lines).rstrip()
+        self.blocks.append((
+            start,
+            exc_time.decode('ascii'),
+            exc_level.decode('ascii'),
+            message.decode('utf-8', errors='replace')))
+
+
+def parse_stats(path, tail=256 * 1024, max_keys=200):
+    """
+    Parse the stats Scrapy dumps to the log when the spider closes.
+
+    Only the last `tail` bytes of the log are read. Numbers and strings
+    are kept as they are, datetimes become 'YYYY-MM-DD HH:MM:SS' strings
+    and other values are dropped. `elapsed_time_seconds` is computed from
+    start_time/finish_time for Scrapy versions that do not dump it.
+    :param path: the log path, archived or not
+    :return: {stat: value}, None when the log has no stats dump (the
+             process was killed, or the log is missing)
+    """
+    if not log_exists(path):
+        return None
+    with open_log(path) as f:
+        size = f.seek(0, 2)
+        f.seek(max(size - tail, 0))
+        data = f.read()
+    start = data.rfind(STATS_HEADER)
+    if start < 0:
+        return None
+    stats = {}
+    times = {}
+    for line in data[start:].split(b'\n')[1:]:
+        line = line.decode('utf-8', errors='replace').rstrip()
+        match = STATS_LINE.match(line)
+        if match is None:
+            if LOG_HEADER.match(line.encode('utf-8')):
+                break  # next log record, end of the dump
+            continue  # value continued from the previous line
+        key, value = match.group('key'), match.group('value')
+        if value.endswith('}') and not value.startswith('{'):
+            value = value[:-1]  # last stat, closes the dump
+        value = _stats_value(value)
+        if isinstance(value, datetime.datetime):
+            times[key] = value
+            value = value.strftime('%Y-%m-%d %H:%M:%S')
+        if value is not None and len(stats) < max_keys:
+            stats[key] = value
+        if line.endswith('}'):
+            break
+    if 'elapsed_time_seconds' not in stats and \
+            'start_time' in times and 'finish_time' in times:
+        stats['elapsed_time_seconds'] = (
+                times['finish_time'] - times['start_time']).total_seconds()
+    return stats or None
+
+
+def _stats_value(value):
+    """A stat value as printed by pprint, None if not supported"""
+    if value[:1] in ('"', "'") and value[-1:] == value[:1]:
+        return value[1:-1]
+    match = STATS_DATETIME.match(value)
+    if match:
+        try:
+            return datetime.datetime(
+                *[int(x) for x in match.group(1).split(',') if x.strip()])
+        except (TypeError, ValueError):
+            return None
+    for type_ in (int, float):
+        try:
+            return type_(value)
+        except ValueError:
+            pass
+    return None
+
+
+def find_logs(logs_dir, project=None, spider=None, since=None, until=None):
+    """
+    Find job logs, archived or not, newest first.
+    :param logs_dir: the logs directory, <project>/<spider>/<job>.log
+    :param project: only the logs of this project
+    :param spider: only the logs of this spider
+    :param since: only logs last modified at or after this timestamp
+    :param until: only logs last modified at or before this timestamp
+    :return: [(mtime, project, spider, job_id, path)], path is the log path
+             as passed to open_log
+    :raises ValueError: when project or spider is not a plain name
+    """
+    for name in (project, spider):
+        if name and (name == '.' or '..' in name or '/' in name or
+                     os.sep in name or (os.altsep and os.altsep in name)):
+            raise ValueError("invalid name: %r" % name)
+    logs = []
+    projects = [project] if project else _listdir(logs_dir)
+    for project_name in projects:
+        project_dir = os.path.join(logs_dir, project_name)
+        spiders = [spider] if spider else _listdir(project_dir)
+        for spider_name in spiders:
+            spider_dir = os.path.join(project_dir, spider_name)
+            for name in _listdir(spider_dir):
+                if name.endswith('.log'):
+                    path = os.path.join(spider_dir, name)
+                    file_path = path
+                elif name.endswith('.log' + ARCHIVE_EXT):
+                    path = os.path.join(spider_dir, name[:-len(ARCHIVE_EXT)])
+                    file_path = path + ARCHIVE_EXT
+                else:
+                    continue
+                try:
+                    mtime = os.path.getmtime(file_path)
+                except OSError:
+                    continue  # removed or archived meanwhile
+                if (since is not None and mtime < since) or (
+                        until is not None and mtime > until):
+                    continue
+                logs.append((mtime, project_name, spider_name,
+                             os.path.basename(path)[:-len('.log')], path))
+    logs.sort(reverse=True)
+    return logs
+
+
+def _listdir(path):
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
+
+
+def search_log(path, pattern, flags=0, limit=100, deadline=None,
+               max_line=1024, chunk_size=64 * 1024):
+    """
+    Search a log line by line, in a worker process.
+
+    Stops at `limit` matches or at the `deadline` timestamp, whichever
+    comes first; only the first `max_line` bytes of a matching line are
+    returned.
+    :param path: the log path, archived or not
+    :param pattern: bytes regular expression
+    :param flags: re flags
+    :return: {"matches": [(line number, byte offset, line)],
+              "truncated": True when the search stopped early,
+              "size": log size}
+    """
+    regex = re.compile(pattern, flags)
+    matches = []
+    truncated = False
+    with open_log(path) as f:
+        size = f.seek(0, 2)
+        f.seek(0)
+        line_no = 0
+        offset = 0
+        buf = b''
+        while True:
+            chunk = f.read(chunk_size)
+            if chunk:
+                lines = (buf + chunk).split(b'\n')
+                buf = lines.pop()
+            else:
+                lines = [buf] if buf else []  # last line without newline
+            for line in lines:
+                line_no += 1
+                if regex.search(line):
+                    matches.append((line_no, offset, line[:max_line].decode(
+                        'utf-8', errors='replace').rstrip('\r')))
+                offset += len(line) + 1
+                if len(matches) >= limit:
+                    break
+            if not chunk or len(matches) >= limit:
+                truncated = len(matches) >= limit and bool(chunk)
+                break
+            if deadline is not None and time.time() > deadline:
+                truncated = True
+                break
+    return {"matches": matches, "truncated": truncated, "size": size}
+
+
+def scan_log(path, offset=0, budget=None, chunk_size=64 * 1024,
+             max_message=64 * 1024):
+    """LogScanner.scan in a worker process"""
+    scanner = LogScanner(budget or 4 * 1024 * 1024, chunk_size, max_message)
+    return scanner.scan(path, offset)
+
+
+class LogScanPool(object):
+    """
+    Run log scans in a bounded process pool, off the reactor thread.
+    The pool is created on first use and shut down with the reactor.
+    """
+
+    def __init__(self, scanner, workers=2):
+        self.scanner = scanner
+        self.workers = max(int(workers), 1)
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            reactor.addSystemEventTrigger(
+                'before', 'shutdown', self._executor.shutdown, False)
+        return self._executor
+
+    def scan(self, path, offset=0):
+        """Return a Deferred firing with the LogScanner.scan result"""
+        return self._submit(
+            scan_log, path, offset, self.scanner.budget,
+            self.scanner.chunk_size, self.scanner.max_message)
+
+    def search(self, path, pattern, flags=0, limit=100, deadline=None):
+        """Return a Deferred firing with the search_log result"""
+        return self._submit(
+            search_log, path, pattern, flags, limit, deadline)
+
+    def _submit(self, func, *args):
+        d = defer.Deferred()
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(
+            lambda f: reactor.callFromThread(self._fire, d, f))
+        return d
+
+    @staticmethod
+    def _fire(d, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            d.errback(e)
+        else:
+            d.callback(result)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import base64
+import json
+import os
+import socket
+import time
+from io import BytesIO
+
+from twisted.application.service import Service
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+from twisted.web.client import Agent, FileBodyProducer, readBody
+from twisted.web.http_headers import Headers
+
+from slave.interfaces import IJobChanges
+from slave.sqlite import JsonSqliteDict
+
+
+class EventPusher(Service):
+    """
+    Push the job state changes to the master callback url in batches.
+    The change log is the outbox: the pushed cursor is only advanced after
+    the master acknowledged a batch, so nothing is lost while the master
+    is down, and failed pushes are retried with exponential backoff.
+    """
+    name = 'pusher'
+
+    def __init__(self, config, app):
+        self.app = app
+        self.url = config.get('master_callback_url', '')
+        http_port = config.getint('http_port', 6800)
+        self.host_port = config.get('callback_host_port', '') or '%s:%s' % (
+            socket.gethostbyname(socket.gethostname()), http_port)
+        self.node_name = config.get('node_name', socket.gethostname())
+        self.interval = config.getfloat('push_interval', 5)
+        self.delay = config.getfloat('push_delay', 0.5)
+        self.batch_size = config.getint('push_batch_size', 500)
+        self.max_backoff = config.getfloat('push_max_backoff', 300)
+        usr, pwd = config.get("username", ""), config.get("password", "")
+        if usr or pwd:
+            bytes_auth = "{}:{}".format(usr, pwd).encode("utf-8")
+            self.auth = b"Basic " + base64.encodebytes(bytes_auth).strip()
+        else:
+            self.auth = None
+        dbs_dir = config.get('dbs_dir', 'dbs')
+        if not os.path.exists(dbs_dir):
+            os.makedirs(dbs_dir)
+        self.state = JsonSqliteDict(
+            os.path.join(dbs_dir, 'pusher.db'), table='state')
+        self.agent = Agent(reactor)
+        self._loop = None
+        self._wake_call = None
+        self._pushing = False
+        self._backoff = 0
+        self._next_try = 0
+
+    @property
+    def changes(self):
+        return self.app.getComponent(IJobChanges)
+
+    def startService(self):
+        Service.startService(self)
+        if not self.url:
+            return
+        self.changes.listeners.append(self.wake)
+        self._loop = LoopingCall(self.push)
+        self._loop.start(self.interval, now=True)
+        log.msg(format='Pushing job changes to %(url)r as %(host_port)r',
+                url=self.url, host_port=self.host_port, system='EventPusher')
+
+    def stopService(self):
+        Service.stopService(self)
+        if self._loop is not None and self._loop.running:
+            self._loop.stop()
+        if self._wake_call is not None and self._wake_call.active():
+            self._wake_call.cancel()
+
+    def wake(self, *args):
+        """Push soon, coalescing the changes recorded in the meantime"""
+        if self._wake_call is None or not self._wake_call.active():
+            self._wake_call = reactor.callLater(self.delay, self.push)
+
+    def _get_cursor(self):
+        cursor = self.state.get('cursor') or {}
+        if cursor.get('epoch') != self.changes.epoch:
+            return 0  # change log recreated, start over
+        return cursor.get('seq', 0)
+
+    def _set_cursor(self, seq):
+        self.state['cursor'] = {'epoch': self.changes.epoch, 'seq': seq}
+
+    @inlineCallbacks
+    def push(self):
+        if self._pushing or time.time() < self._next_try:
+            return
+        self._pushing = True
+        try:
+            while True:
+                rows = self.changes.log.since(
+                    self._get_cursor(), self.batch_size)
+                if not rows:
+                    break
+                events = []
+                for seq, change in rows:
+                    change["seq"] = seq
+                    events.append(change)
+                yield self._post(events)
+                self._set_cursor(rows[-1][0])
+                if len(rows) < self.batch_size:
+                    break
+            self._backoff = 0
+        except Exception as e:
+            self._backoff = min(max(self._backoff * 2, self.interval),
+                                self.max_backoff)
+            self._next_try = time.time() + self._backoff
+            log.msg(format='Push failed, retry in %(backoff)ss: %(error)s',
+                    backoff=self._backoff, error=e, system='EventPusher')
+        finally:
+            self._pushing = False
+
+    @inlineCallbacks
+    def _post(self, events):
+        body = json.dumps({
+            "node_name": self.node_name,
+            "host_port": self.host_port,
+            "epoch": self.changes.epoch,
+            "events": events,
+        }).encode('utf-8')
+        headers = Headers({b'Content-Type': [b'application/json']})
+        if self.auth:
+            headers.addRawHeader(b'Authorization', self.auth)
+        response = yield self.agent.request(
+            b'POST', self.url.encode('utf-8'), headers,
+            FileBodyProducer(BytesIO(body)))
+        data = yield readBody(response)
+        if response.code != 200:
+            raise ValueError('HTTP %s' % response.code)
+        result = json.loads(data.decode('utf-8'))
+        if result.get('status') != 'ok':
+            raise ValueError(result.get('message', 'rejected'))
@@ -10,6 +10,7 @@ import pkg_resources
 
 from slave import get_application
 from slave.interfaces import IEggStorage
+from slave.telemetry import enable_telemetry
 
 
 def activate_egg(egg_path):
@@ -53,7 +54,10 @@ def main():
     project = os.environ['SCRAPY_PROJECT']
     with project_environment(project):
         from scrapy.cmdline import execute
-        execute()
+        from scrapy.utils.project import get_project_settings
+        settings = get_project_settings()
+        enable_telemetry(settings)
+        execute(settings=settings)
 
 
 if __name__ == '__main__':
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import json
 import sqlite3
+import uuid
 
 try:  # PY2
     import cPickle as pickle
@@ -124,6 +125,13 @@ class JsonSqlitePriorityQueue(object):
         self.conn.execute(q, args)
         self.conn.commit()
 
+    def put_many(self, items):
+        """Insert (message, priority) pairs in a single transaction"""
+        q = "insert into %s (priority, message) values (?,?)" % self.table
+        with self.conn:
+            self.conn.executemany(
+                q, [(priority, self.encode(m)) for m, priority in items])
+
     def pop(self):
         q = "select id, message from %s order by priority desc limit 1" \
             % self.table
@@ -173,6 +181,160 @@ class JsonSqlitePriorityQueue(object):
         return json.loads(bytes(text).decode('ascii'))
 
 
+class JsonSqliteLog(object):
+    """SQLite append-only log. Every record gets a monotonically increasing
+    sequence number, so readers can fetch the records after a cursor.
+    The log epoch changes whenever the database is recreated, which tells
+    readers that their cursors are no longer valid.
+    """
+
+    def __init__(self, database=None, table="log"):
+        self.database = database or ':memory:'
+        self.table = table
+        # about check_same_thread: http://twistedmatrix.com/trac/ticket/4040
+        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        q = "create table if not exists %s (seq integer primary key " \
+            "autoincrement, message blob)" % table
+        self.conn.execute(q)
+        q = "create table if not exists %s_meta (key text primary key, " \
+            "value text)" % table
+        self.conn.execute(q)
+        q = "insert or ignore into %s_meta (key, value) values (?,?)" % table
+        self.conn.execute(q, ("epoch", uuid.uuid4().hex))
+        self.conn.commit()
+        q = "select value from %s_meta where key=?" % table
+        self.epoch = self.conn.execute(q, ("epoch",)).fetchone()[0]
+
+    def append(self, message):
+        q = "insert into %s (message) values (?)" % self.table
+        c = self.conn.execute(q, (self.encode(message),))
+        self.conn.commit()
+        return c.lastrowid
+
+    def append_many(self, messages):
+        """Append messages in a single transaction, return their seqs"""
+        q = "insert into %s (message) values (?)" % self.table
+        with self.conn:
+            return [self.conn.execute(q, (self.encode(m),)).lastrowid
+                    for m in messages]
+
+    def since(self, seq=0, limit=1000):
+        q = "select seq, message from %s where seq>? order by seq limit ?" \
+            % self.table
+        return [(x, self.decode(y)) for x, y in
+                self.conn.execute(q, (seq, limit))]
+
+    def first_seq(self):
+        q = "select min(seq) from %s" % self.table
+        return self.conn.execute(q).fetchone()[0] or 0
+
+    def last_seq(self):
+        # sqlite_sequence keeps the last seq even if all records are trimmed
+        q = "select seq from sqlite_sequence where name=?"
+        row = self.conn.execute(q, (self.table,)).fetchone()
+        return row[0] if row else 0
+
+    def trim(self, keep):
+        q = "delete from %s where seq<=?" % self.table
+        c = self.conn.execute(q, (self.last_seq() - keep,))
+        self.conn.commit()
+        return c.rowcount
+
+    def __len__(self):
+        q = "select count(*) from %s" % self.table
+        return self.conn.execute(q).fetchone()[0]
+
+    def encode(self, obj):
+        return sqlite3.Binary(json.dumps(obj).encode('ascii'))
+
+    def decode(self, text):
+        return json.loads(bytes(text).decode('ascii'))
+
+
+class SqliteErrorIndex(object):
+    """SQLite index of the error blocks found in job logs. Every job keeps
+    the byte offset its log was scanned up to and whether the scan is
+    complete; every error block is keyed by its byte offset in the log, so
+    a block that grew since the last scan is updated in place.
+    """
+
+    def __init__(self, database=None, table="errors"):
+        self.database = database or ':memory:'
+        self.table = table
+        # about check_same_thread: http://twistedmatrix.com/trac/ticket/4040
+        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        q = "create table if not exists %s_jobs (id integer primary key " \
+            "autoincrement, project text, spider text, job text, " \
+            "offset integer, done integer, unique (project, spider, job))" \
+            % table
+        self.conn.execute(q)
+        q = "create table if not exists %s (job_id integer, offset integer, " \
+            "exc_time text, exc_level text, message text, " \
+            "primary key (job_id, offset))" % table
+        self.conn.execute(q)
+        self.conn.commit()
+
+    def _job_id(self, project, spider, job):
+        q = "select id from %s_jobs where project=? and spider=? and job=?" \
+            % self.table
+        row = self.conn.execute(q, (project, spider, job)).fetchone()
+        return row[0] if row else None
+
+    def update(self, project, spider, job, offset, done=False, errors=()):
+        """Record the scanned offset and the [(offset, exc_time, exc_level,
+        message)] error blocks of a job in a single transaction"""
+        with self.conn:
+            q = "insert or ignore into %s_jobs (project, spider, job, " \
+                "offset, done) values (?,?,?,0,0)" % self.table
+            self.conn.execute(q, (project, spider, job))
+            job_id = self._job_id(project, spider, job)
+            q = "update %s_jobs set offset=?, done=? where id=?" % self.table
+            self.conn.execute(q, (offset, int(done), job_id))
+            q = "insert or replace into %s (job_id, offset, exc_time, " \
+                "exc_level, message) values (?,?,?,?,?)" % self.table
+            self.conn.executemany(q, [(job_id,) + tuple(e) for e in errors])
+
+    def get(self, project, spider, job, offset=0):
+        """Return {"offset", "done", "errors": [(offset, exc_time,
+        exc_level, message)]} with the error blocks at or after `offset`,
+        or None if the job is not indexed"""
+        q = "select id, offset, done from %s_jobs where project=? and " \
+            "spider=? and job=?" % self.table
+        row = self.conn.execute(q, (project, spider, job)).fetchone()
+        if row is None:
+            return None
+        job_id, scanned, done = row
+        q = "select offset, exc_time, exc_level, message from %s where " \
+            "job_id=? and offset>=? order by offset" % self.table
+        return {
+            "offset": scanned,
+            "done": bool(done),
+            "errors": self.conn.execute(q, (job_id, offset)).fetchall(),
+        }
+
+    def pending(self):
+        """Return [(project, spider, job, offset)] of the jobs whose scan
+        is not complete"""
+        q = "select project, spider, job, offset from %s_jobs where " \
+            "done=0 order by id" % self.table
+        return self.conn.execute(q).fetchall()
+
+    def trim(self, keep):
+        """Keep the index of the last `keep` jobs"""
+        with self.conn:
+            q = "select max(id) from %s_jobs" % self.table
+            last = self.conn.execute(q).fetchone()[0] or 0
+            q = "delete from %s where job_id<=?" % self.table
+            self.conn.execute(q, (last - keep,))
+            q = "delete from %s_jobs where id<=?" % self.table
+            c = self.conn.execute(q, (last - keep,))
+        return c.rowcount
+
+    def __len__(self):
+        q = "select count(*) from %s_jobs" % self.table
+        return self.conn.execute(q).fetchone()[0]
+
+
 @deprecate_class
 class PickleSqlitePriorityQueue(JsonSqlitePriorityQueue):
 
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Live crawl telemetry.
+
+The Launcher owns one memory-mapped file with a fixed-size record per
+process slot. The crawler process of a slot runs TelemetryExtension
+(injected by slave.runner), which writes its counters into the record of
+its slot every `live_stats_interval` seconds. Each record is guarded by a
+sequence lock: the writer makes the sequence odd while it writes, so the
+Launcher reads a consistent record without any lock or system call.
+"""
+import mmap
+import os
+import struct
+import time
+
+ENV_FILE = 'SLAVE_LIVE_STATS_FILE'
+ENV_SLOT = 'SLAVE_LIVE_STATS_SLOT'
+ENV_INTERVAL = 'SLAVE_LIVE_STATS_INTERVAL'
+
+# counters, then their rates per second over the last interval
+FIELDS = ('time', 'requests', 'responses', 'items', 'errors', 'scheduled',
+          'requests_rate', 'responses_rate', 'items_rate')
+# the Scrapy stats behind each counter
+STATS_KEYS = (
+    ('requests', 'downloader/request_count'),
+    ('responses', 'response_received_count'),
+    ('items', 'item_scraped_count'),
+    ('errors', 'log_count/ERROR'),
+)
+RECORD = struct.Struct('<QQ%dd' % len(FIELDS))  # seq, pid, fields
+SEQ = struct.Struct('<Q')
+RECORD_SIZE = 128  # one record per slot, padded
+assert RECORD.size <= RECORD_SIZE
+
+
+class TelemetryChannel(object):
+    """
+    The memory-mapped telemetry file, one record per slot.
+    The Launcher creates it and resets a slot around every process;
+    a crawler process opens it to write the record of its own slot.
+    """
+
+    def __init__(self, path, slots, create=False):
+        self.path = path
+        self.slots = slots
+        size = slots * RECORD_SIZE
+        if create:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self._file = open(path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+
+    def reset(self, slot):
+        """Clear the record of a slot, before and after its process"""
+        self._mmap[slot * RECORD_SIZE:(slot + 1) * RECORD_SIZE] = \
+            b'\0' * RECORD_SIZE
+
+    def write(self, slot, pid, values):
+        """
+        Write the record of a slot (single writer per slot)
+        :param values: {field: value}, missing fields are 0
+        """
+        offset = slot * RECORD_SIZE
+        seq, = SEQ.unpack_from(self._mmap, offset)
+        SEQ.pack_into(self._mmap, offset, seq + 1)  # odd: writing
+        RECORD.pack_into(
+            self._mmap, offset, seq + 1, pid,
+            *[float(values.get(f) or 0) for f in FIELDS])
+        SEQ.pack_into(self._mmap, offset, seq + 2)
+
+    def read(self, slot, retries=10):
+        """
+        Read the record of a slot
+        :return: (pid, {field: value}), None if it was never written or
+                 is being written for longer than `retries` attempts
+        """
+        offset = slot * RECORD_SIZE
+        for _ in range(retries):
+            record = RECORD.unpack_from(self._mmap, offset)
+            seq, = SEQ.unpack_from(self._mmap, offset)
+            if seq == 0:
+                return None
+            if seq % 2 == 0 and seq == record[0]:
+                return record[1], dict(zip(FIELDS, record[2:]))
+        return None
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+def enable_telemetry(settings):
+    """
+    Enable TelemetryExtension in the Scrapy settings of a crawler process
+    started by the Launcher. It is added to EXTENSIONS_BASE, so EXTENSIONS
+    set by the project or a spider still merge with it (and may disable it
+    with None).
+    """
+    if not os.environ.get(ENV_FILE):
+        return
+    extensions = settings.getdict('EXTENSIONS_BASE')
+    extensions.setdefault('slave.telemetry.TelemetryExtension', 0)
+    settings.set('EXTENSIONS_BASE', extensions,
+                 priority=settings.getpriority('EXTENSIONS_BASE') or
+                 'default')
+
+
+class TelemetryExtension(object):
+    """
+    Scrapy extension writing the crawl counters of the process to the
+    telemetry channel every `interval` seconds, and once when the spider
+    closes. It only reads the stats collector, so it is cheap enough to
+    run for every job.
+    """
+
+    def __init__(self, crawler, channel, slot, interval):
+        self.crawler = crawler
+        self.channel = channel
+        self.slot = slot
+        self.interval = interval
+        self.pid = os.getpid()
+        self.last = None  # (time, {counter: value}) of the last write
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy import signals
+        from scrapy.exceptions import NotConfigured
+        path = os.environ.get(ENV_FILE)
+        slot = os.environ.get(ENV_SLOT)
+        if not path or slot is None:
+            raise NotConfigured
+        slot = int(slot)
+        try:
+            channel = TelemetryChannel(path, slot + 1)
+        except (OSError, ValueError):
+            raise NotConfigured
+        ext = cls(crawler, channel, slot,
+                  float(os.environ.get(ENV_INTERVAL) or 5))
+        crawler.signals.connect(ext.spider_opened, signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        from twisted.internet.task import LoopingCall
+        self.task = LoopingCall(self.write)
+        self.task.start(self.interval, now=True)
+
+    def spider_closed(self, spider, reason):
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        self.write()
+        self.channel.close()
+
+    def write(self):
+        stats = self.crawler.stats
+        now = time.time()
+        values = {key: stats.get_value(stat, 0) for key, stat in STATS_KEYS}
+        values['time'] = now
+        values['scheduled'] = self._scheduled()
+        if self.last is not None and now > self.last[0]:
+            elapsed = now - self.last[0]
+            for key in ('requests', 'responses', 'items'):
+                values[key + '_rate'] = \
+                    (values[key] - self.last[1][key]) / elapsed
+        self.last = (now, values)
+        self.channel.write(self.slot, self.pid, values)
+
+    def _scheduled(self):
+        """Requests waiting in the scheduler queues"""
+        engine = self.crawler.engine
+        # ExecutionEngine.scheduler since Scrapy 2.19, engine.slot before
+        scheduler = getattr(engine, 'scheduler', None)
+        if scheduler is None:
+            slot = getattr(engine, 'slot', None)
+            scheduler = getattr(slot, 'scheduler', None)
+        try:
+            return len(scheduler) if scheduler is not None else 0
+        except TypeError:
+            return 0  # custom scheduler without __len__
@@ -3,6 +3,7 @@
 import json
 import os
 import re
+import time
 import traceback
 import uuid
 from copy import copy
@@ -12,11 +13,13 @@ try:
 except ImportError:
     from io import BytesIO
 
+from twisted.internet import defer
 from twisted.python import log
-from twisted.web import resource
+from twisted.web import resource, server
 from slave.utils import UtilsCache
 from slave.utils import get_spider_list, native_stringify_dict
 from slave.decorators import decorator_auth
+from slave.logfiles import find_logs, log_exists, log_size
 
 
 class JsonResource(resource.Resource):
@@ -24,8 +27,27 @@ class JsonResource(resource.Resource):
 
     def render(self, request):
         r = resource.Resource.render(self, request)
+        if isinstance(r, defer.Deferred):
+            # deferred result, written to the response when it fires
+            disconnected = []
+            request.notifyFinish().addErrback(disconnected.append)
+            r.addErrback(self.render_failure, request)
+            r.addCallback(self.render_deferred, request, disconnected)
+            return server.NOT_DONE_YET
+        if r is server.NOT_DONE_YET:
+            return r  # streamed by the resource itself
         return self.render_object(r, request)
 
+    def render_deferred(self, obj, request, disconnected=()):
+        if disconnected:
+            return  # client disconnected
+        request.write(self.render_object(obj, request).encode('utf-8'))
+        request.finish()
+
+    def render_failure(self, failure, request):
+        log.err(failure)
+        return {"status": "error", "message": str(failure.value)}
+
     def render_object(self, obj, request):
         r = self.json_encoder.encode(obj) + "\n"
         request.setHeader('Content-Type', 'application/json')
@@ -45,7 +67,10 @@ class WsResource(JsonResource):
 
     def render(self, request):
         try:
-            return JsonResource.render(self, request).encode('utf-8')
+            r = JsonResource.render(self, request)
+            if r is server.NOT_DONE_YET:
+                return r
+            return r.encode('utf-8')
         except Exception as e:
             if self.root.debug:
                 return traceback.format_exc().encode('utf-8')
@@ -57,6 +82,138 @@ class WsResource(JsonResource):
             }
             return self.render_object(r, request).encode('utf-8')
 
+    def render_failure(self, failure, request):
+        log.err(failure)
+        return {
+            "node_name": self.root.node_name,
+            "status": "error",
+            "message": str(failure.value)
+        }
+
+
+def get_daemon_status(root):
+    """Load of the node, max_proc/free_slots let the master place jobs"""
+    pending = sum(q.count() for q in root.poller.queues.values())
+    running = len(root.launcher.processes)
+    max_proc = root.launcher.max_proc
+    return {
+        "pending": pending,
+        "running": running,
+        "finished": len(root.launcher.finished),
+        "max_proc": max_proc,
+        "free_slots": max(max_proc - running - pending, 0),
+    }
+
+
+def get_project_jobs(root, project):
+    """Pending, running and finished jobs of a project"""
+    running = [
+        {
+            "id": s.job,
+            "spider": s.spider,
+            "pid": s.pid,
+            "start_time": s.start_time.isoformat(' ')
+        } for s in root.launcher.processes.values() if s.project == project
+    ]
+    queue = root.poller.queues.get(project)
+    pending = [
+        {
+            "id": x["_job"],
+            "spider": x["name"]
+        } for x in (queue.list() if queue is not None else [])
+    ]
+    finished = [
+        {
+            "id": s.job,
+            "spider": s.spider,
+            "start_time": s.start_time.isoformat(' '),
+            "end_time": s.end_time.isoformat(' '),
+            "stats": s.stats
+        } for s in root.launcher.finished if s.project == project
+    ]
+    return {
+        "pending": pending,
+        "running": running,
+        "finished": finished
+    }
+
+
+def get_known_jobs(root, project):
+    """Ids of the pending, running and finished jobs of a project"""
+    jobs = get_project_jobs(root, project)
+    return set(x["id"] for state in ("pending", "running", "finished")
+               for x in jobs[state])
+
+
+def get_job_changes(root, args):
+    """Job state changes, only the current cursor without `since`"""
+    changes = root.job_changes
+    if 'since' not in args:
+        last_seq = changes.log.last_seq()
+        return {
+            "changes": [],
+            "seq": last_seq,
+            "last_seq": last_seq,
+            "epoch": changes.epoch,
+            "reset": False,
+        }
+    since = int(args['since'][0])
+    limit = int(args.get('limit', [1000])[0])
+    return changes.since(since, limit)
+
+
+def get_log_path(root, project, spider, job_id):
+    """Path of a job log"""
+    return os.path.join(
+        root.logs_dir, project, spider, "{}.log".format(job_id))
+
+
+def get_indexed_exception(root, project, spider, job_id, offset=0):
+    """
+    Errors of a job from the error index built while it runs, an empty
+    result when there is no log, None when the log has to be scanned
+    """
+    log_path = get_log_path(root, project, spider, job_id)
+    error_index = root.error_index
+    indexed = error_index.get(project, spider, job_id, offset) \
+        if error_index is not None else None
+    if indexed is not None:
+        # tailed while the job runs, read the new index entries only
+        return {
+            "whence": indexed["offset"],
+            "eof": indexed["done"],
+            "size": log_size(log_path),
+            "errors": [e[1:] for e in indexed["errors"]],
+        }
+    if not log_exists(log_path):
+        # no log (not started yet, or removed by jobs_to_keep)
+        return {"whence": 0, "eof": True, "size": 0, "errors": []}
+    return None
+
+
+def scan_result(result):
+    """LogScanner.scan result in the job_exception.json format"""
+    return {
+        "whence": result["offset"],
+        "eof": result["eof"],
+        "size": result["size"],
+        "errors": result["errors"],
+    }
+
+
+def get_performance(root):
+    """System performance, the snapshot of the latest sample"""
+    return dict(root.performance.snapshot)
+
+
+def get_performance_history(root, since=None, step=None):
+    """System performance history"""
+    since = float(since) if since not in (None, '') else None
+    step = float(step) if step not in (None, '') else None
+    data = root.performance.history(since=since, step=step)
+    data["step"] = step
+    return data
+
 
 class DaemonStatus(WsResource):
     """
@@ -74,24 +231,21 @@ class DaemonStatus(WsResource):
         "status": "ok",
         "pending": "0",
         "running": "0",
-        "finished": "0"
+        "finished": "0",
+        "max_proc": 16,
+        "free_slots": 16
     }
 
     """
 
     @decorator_auth
     def render_GET(self, request):
-        pending = sum(q.count() for q in self.root.poller.queues.values())
-        running = len(self.root.launcher.processes)
-        finished = len(self.root.launcher.finished)
-
-        return {
+        data = {
             "node_name": self.root.node_name,
             "status": "ok",
-            "pending": pending,
-            "running": running,
-            "finished": finished
         }
+        data.update(get_daemon_status(self.root))
+        return data
 
 
 class Schedule(WsResource):
@@ -146,6 +300,91 @@ class Schedule(WsResource):
         }
 
 
+class ScheduleBatch(WsResource):
+    """
+    schedule_batch.json
+    Schedule a list of spider runs in one request. The spider list of each
+    project/version is checked once and the jobs of a project are queued
+    in a single transaction. Invalid jobs are reported and skipped.
+
+    Supported Request Methods: POST
+    Body (application/json):
+    jobs (list, required) - the jobs, each with the schedule.json parameters:
+        project, spider, setting (list of "NAME=VALUE"), job, _version,
+        priority and spider arguments
+
+    Example request:
+    $ curl -u test:test http://localhost:6800/schedule_batch.json \
+        -H "Content-Type: application/json" \
+        -d '{"jobs": [{"project": "myProject", "spider": "example"}]}'
+    Example response:
+    {
+        "node_name": "nodeName",
+        "status": "ok",
+        "jobs": ["6487ec79947edab326d6db28a2d86511e8247444"],
+        "errors": []
+    }
+    "jobs" follows the order of the request, null for a skipped job.
+    A job whose id is already pending, running or finished on this node is
+    not queued again and its id is returned as is, so retrying a request
+    that timed out does not start the same job twice.
+
+    """
+
+    @decorator_auth
+    def render_POST(self, request):
+        data = json.loads(request.content.read().decode('utf-8') or '{}')
+        jobs = data.get('jobs') or []
+        job_ids = [None] * len(jobs)
+        errors = []
+        spider_lists = {}  # {(project, version): spiders}
+        batches = {}  # {project: [(spider, spider_args)]}
+        known_jobs = {}  # {project: job ids already on this node}
+        for index, job in enumerate(jobs):
+            args = dict((k, v[0] if isinstance(v, list) and k != 'setting'
+                         else v) for k, v in job.items())
+            project = args.pop('project', None)
+            spider = args.pop('spider', None)
+            version = args.get('_version', '')
+            key = (project, version)
+            if key not in spider_lists:
+                try:
+                    spider_lists[key] = get_spider_list(
+                        project, version=version) if project else []
+                except Exception as e:
+                    spider_lists[key] = []
+                    log.msg(format='List spiders of %(project)r failed: '
+                                   '%(error)s', project=project, error=e)
+            if spider not in spider_lists[key]:
+                errors.append({
+                    "index": index,
+                    "message": "spider '%s' not found" % spider
+                })
+                continue
+            settings = args.pop('setting', [])
+            if not isinstance(settings, list):
+                settings = [settings]
+            args['settings'] = dict(x.split('=', 1) for x in settings)
+            job_id = str(args.pop('job', '') or uuid.uuid1().hex)
+            if project not in known_jobs:
+                known_jobs[project] = get_known_jobs(self.root, project)
+            if job_id in known_jobs[project]:
+                job_ids[index] = job_id  # already scheduled, e.g. a retry
+                continue
+            known_jobs[project].add(job_id)
+            args['_job'] = job_id
+            batches.setdefault(project, []).append((spider, args))
+            job_ids[index] = job_id
+        for project, project_jobs in batches.items():
+            self.root.scheduler.schedule_many(project, project_jobs)
+        return {
+            "node_name": self.root.node_name,
+            "status": "ok",
+            "jobs": job_ids,
+            "errors": errors
+        }
+
+
 class Cancel(WsResource):
     """
     cancel.json
@@ -178,14 +417,22 @@ class Cancel(WsResource):
         signal = args.get('signal', 'TERM')
         prev_state = None
         queue = self.root.poller.queues[project]
+        pending = [x for x in queue.list() if x["_job"] == job_id]
         c = queue.remove(lambda x: x["_job"] == job_id)
         if c:
             prev_state = "pending"
+            for x in pending:
+                self.root.job_changes.record(project, x["name"], job_id,
+                                             "canceled", prev_state=prev_state)
         spiders = self.root.launcher.processes.values()
         for s in spiders:
             if s.job == job_id:
                 s.transport.signalProcess(signal)
                 prev_state = "running"
+                self.root.job_changes.record(
+                    project, s.spider, job_id, "canceled",
+                    prev_state=prev_state, pid=s.pid,
+                    start_time=s.start_time.isoformat(' '))
         return {
             "node_name": self.root.node_name,
             "status": "ok",
@@ -298,6 +545,94 @@ class ListVersions(WsResource):
         }
 
 
+class ListManifest(WsResource):
+    """
+    list_manifest.json
+    Get the digest manifest of the stored eggs, so that the master can
+    deploy only the missing or mismatched versions.
+
+    Supported Request Methods: GET
+    Parameters:
+    project (string, optional) - the project name, default all projects
+
+    Example request:
+    $ curl -u test:test http://localhost:6800/list_manifest.json
+    Example response:
+    {
+        "node_name": "nodeName",
+        "status": "ok",
+        "manifest": [
+            {"project": "myProject", "version": "r99",
+             "sha256": "9f86d08...", "size": 10240}
+        ]
+    }
+
+    """
+
+    @decorator_auth
+    def render_GET(self, request):
+        args = native_stringify_dict(copy(request.args), keys_only=False)
+        project = args.get('project', [None])[0]
+        return {
+            "node_name": self.root.node_name,
+            "status": "ok",
+            "manifest": self.root.egg_storage.manifest(project)
+        }
+
+
+class ListJobChanges(WsResource):
+    """
+    job_changes.json
+    Get the job state transitions (pending, running, finished, canceled)
+    recorded after the given sequence number.
+    Without `since` only the current cursor is returned.
+    When `reset` is true the cursor is no longer valid (the change log was
+    recreated or trimmed), and the caller should resync the full job lists.
+
+    Supported Request Methods: GET
+    Parameters:
+    since (integer, optional) - the last sequence number already seen
+    limit (integer, optional) - max changes to return, default 1000
+
+    Example request:
+    $ curl -u test:test http://localhost:6800/job_changes.json?since=41
+    Example response:
+    {
+        "node_name": "nodeName",
+        "status": "ok",
+        "changes": [
+            {
+                "seq": 42,
+                "project": "myProject",
+                "spider": "spider1",
+                "job": "78391cc0fcaf11e1b0090800272a6d06",
+                "state": "running",
+                "time": "2012-09-12 10:14:03.594664",
+                "pid": 1234,
+                "start_time": "2012-09-12 10:14:03.594664"
+            }
+        ],
+        "seq": 42,
+        "last_seq": 42,
+        "epoch": "5f0c2b6e3b8a4a55a5ab3b4b0f1c9d1e",
+        "reset": false
+    }
+    A "finished" change also has "end_time" and "stats", as in
+    list_jobs.json, when the log has a stats dump.
+
+    """
+
+    @decorator_auth
+    def render_GET(self, request):
+        args = native_stringify_dict(copy(request.args), keys_only=False)
+        data = {
+            "node_name": self.root.node_name,
+            "status": "ok",
+        }
+        data.update(get_job_changes(self.root, args))
+        return data
+
+
 class ListSpiders(WsResource):
     """
     list_spiders.json
@@ -367,47 +702,31 @@ class ListJobs(WsResource):
                 "id": "2f16646cfcaf11e1b0090800272a6d06",
                 "spider": "spider3",
                 "start_time": "2012-09-12 10:14:03.594664",
-                "end_time": "2012-09-12 10:24:03.594664"
+                "end_time": "2012-09-12 10:24:03.594664",
+                "stats": {
+                    "item_scraped_count": 100,
+                    "response_received_count": 12,
+                    "downloader/response_status_count/200": 12,
+                    "elapsed_time_seconds": 600.0,
+                    "finish_reason": "finished"
+                }
             }
         ]
     }
+    "stats" is the stats dump Scrapy wrote to the log when the spider
+    closed, null if there is none.
     """
 
     @decorator_auth
     def render_GET(self, request):
         args = native_stringify_dict(copy(request.args), keys_only=False)
         project = args['project'][0]
-        spiders = self.root.launcher.processes.values()
-        running = [
-            {
-                "id": s.job,
-                "spider": s.spider,
-                "pid": s.pid,
-                "start_time": s.start_time.isoformat(' ')
-            } for s in spiders if s.project == project
-        ]
-        queue = self.root.poller.queues[project]
-        pending = [
-            {
-                "id": x["_job"],
-                "spider": x["name"]
-            } for x in queue.list()
-        ]
-        finished = [
-            {
-                "id": s.job,
-                "spider": s.spider,
-                "start_time": s.start_time.isoformat(' '),
-                "end_time": s.end_time.isoformat(' ')
-            } for s in self.root.launcher.finished if s.project == project
-        ]
-        return {
+        data = {
             "node_name": self.root.node_name,
             "status": "ok",
-            "pending": pending,
-            "running": running,
-            "finished": finished
         }
+        data.update(get_project_jobs(self.root, project))
+        return data
 
 
 class DeleteProject(WsResource):
@@ -483,14 +802,18 @@ class DeleteVersion(DeleteProject):
 class JobException(WsResource):
     """
     job_exception.json
-    Get spider job exception by reading the log file.
+    Get spider job exception from the error index built while the job ran,
+    or by scanning the log file for jobs that were not indexed.
+    A scan reads at most `log_scan_budget` bytes from `offset`; call again
+    with the returned `whence` until `eof` is true.
 
     Supported Request Methods: POST
     Parameters:
     project (string, required) - the project name
     spider (string, required) - the spider name
     job (string, required) - the job id
-    offset (string, optional) - seek offset position, default 0
+    offset (string, optional) - byte offset returned as `whence` by the
+                                previous call, default 0
 
     Example request:
     $ curl -u test:test http://localhost:6800/job_exception.json -d project=myProject -d spider=example -d job=8d47b9e2d80311e8b8ba7c67a203577c
@@ -499,20 +822,12 @@ class JobException(WsResource):
         "node_name": "nodeName",
         "status": "ok",
         "whence": 3000,
+        "eof": true,
+        "size": 3000,
         "errors": []
     }
 
     """
-    # log level：CRITICAL > ERROR > WARNING > INFO > DEBUG,NOTSET
-    delimiter = '&' * 10  # Log block delimiter
-    comp_block = re.compile(
-        pattern=r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} \[.*?\] ' +
-                r'(CRITICAL|ERROR|WARNING|INFO|DEBUG|NOTSET):)',
-        flags=re.I)  # log sub RegEx
-    comp_error = re.compile(
-        pattern=r'((\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \[.*?\] ' +
-                r'(CRITICAL|ERROR):[\s\S]+?)([\r\n]+{}|\s*$)'.format(delimiter),
-        flags=re.I)  # log search RegEx
 
     @decorator_auth
     def render_POST(self, request):
@@ -522,31 +837,284 @@ class JobException(WsResource):
             project = args['project']  # project name
             spider = args['spider']  # spider name
             job_id = args['job']  # job id
-            offset = int(args.get('offset', 0))  # seek offset position
-            logs_dir = self.root.logs_dir  # logs directory
-            log_path = os.path.join(
-                logs_dir, project, spider, "{}.log".format(job_id))
-            with open(log_path, "r", encoding='UTF-8') as f:
-                f.seek(offset)  # f.seek(0, 2)
-                lines = f.read()  # Go to the end of file
-                whence = f.tell()  # curr position
-                f.close()
-            errors = self.comp_error.findall(
-                string=self.comp_block.sub(
-                    repl=r'{}\1'.format(self.delimiter), string=lines))
-            errors = [(e[1], e[2], e[0]) for e in errors]
+            offset = int(args.get('offset', 0))  # byte offset
+            result = get_indexed_exception(
+                self.root, project, spider, job_id, offset)
+            if result is None:
+                result = scan_result(self.root.log_scanner.scan(
+                    get_log_path(self.root, project, spider, job_id),
+                    offset))
+            result.update(node_name=self.root.node_name, status="ok")
+            return result
+        except Exception as e:
+            return {
+                "node_name": self.root.node_name,
+                "status": "error",
+                "message": str(e)
+            }
+
+
+class JobExceptionsBatch(WsResource):
+    """
+    job_exceptions_batch.json
+    Get the exceptions of many jobs in one request. Indexed jobs are read
+    from the error index, the other logs are scanned in a process pool
+    (`log_scan_workers`) off the reactor thread.
+
+    Supported Request Methods: POST
+    Body (application/json):
+    jobs (list, required) - the jobs, each with the job_exception.json
+                            parameters: project, spider, job, offset
+
+    Example request:
+    $ curl -u test:test http://localhost:6800/job_exceptions_batch.json \
+        -H "Content-Type: application/json" \
+        -d '{"jobs": [{"project": "myProject", "spider": "example", "job": "8d47b9e2d80311e8b8ba7c67a203577c", "offset": 0}]}'
+    Example response:
+    {
+        "node_name": "nodeName",
+        "status": "ok",
+        "results": [{"whence": 3000, "eof": true, "size": 3000, "errors": []}]
+    }
+    "results" follows the order of the request, {"message": "..."} for a
+    job that failed.
+
+    """
+
+    @decorator_auth
+    def render_POST(self, request):
+        data = json.loads(request.content.read().decode('utf-8') or '{}')
+        jobs = data.get('jobs') or []
+        results = [None] * len(jobs)
+        scans = []  # [(index, Deferred)]
+        for index, job in enumerate(jobs):
+            try:
+                project, spider = job['project'], job['spider']
+                job_id = job['job']
+                offset = int(job.get('offset') or 0)
+                result = get_indexed_exception(
+                    self.root, project, spider, job_id, offset)
+            except Exception as e:
+                results[index] = {"message": str(e)}
+                continue
+            if result is not None:
+                results[index] = result
+                continue
+            d = self.root.log_pool.scan(
+                get_log_path(self.root, project, spider, job_id), offset)
+            d.addCallback(scan_result)
+            scans.append((index, d))
+
+        def done(scanned):
+            for (index, _), (success, result) in zip(scans, scanned):
+                results[index] = result if success else {
+                    "message": str(result.value)}
             return {
                 "node_name": self.root.node_name,
                 "status": "ok",
-                "whence": whence,
-                "errors": errors
+                "results": results,
             }
-        except Exception as e:
+
+        if not scans:
+            return done([])
+        return defer.DeferredList(
+            [d for _, d in scans], consumeErrors=True).addCallback(done)
+
+
+class JobLiveStats(WsResource):
+    """
+    job_live_stats.json
+    Get the live crawl counters of all running jobs in one call. Every
+    crawler process writes its counters to a memory-mapped file every
+    `live_stats_interval` seconds, this only reads the latest values.
+
+    Supported Request Methods: GET
+    Parameters: none
+
+    Example request:
+    $ curl -u test:test http://localhost:6800/job_live_stats.json
+    Example response:
+    {
+        "node_name": "nodeName",
+        "status": "ok",
+        "jobs": [
+            {
+                "project": "myProject",
+                "spider": "spider1",
+                "job": "78391cc0fcaf11e1b0090800272a6d06",
+                "pid": 1234,
+                "start_time": "2012-09-12 10:14:03.594664",
+                "age": 1.2,
+                "time": 1547532000.0,
+                "requests": 1200.0,
+                "responses": 1180.0,
+                "items": 950.0,
+                "errors": 2.0,
+                "scheduled": 340.0,
+                "requests_rate": 12.4,
+                "responses_rate": 12.2,
+                "items_rate": 9.8
+            }
+        ]
+    }
+    "age" is the number of seconds since the process last wrote its
+    counters; the counters are null until the first write.
+
+    """
+
+    @decorator_auth
+    def render_GET(self, request):
+        return {
+            "node_name": self.root.node_name,
+            "status": "ok",
+            "jobs": self.root.launcher.get_live_stats(),
+        }
+
+
+class SearchLogs(WsResource):
+    """
+    search_logs.json
+    Search the job logs of a project/spider/time range for a regular
+    expression or a literal string. Logs are searched newest first in the
+    process pool (`log_scan_workers` logs at a time); the search stops once
+    `limit` lines matched, after `log_search_timeout` seconds or when the
+    client disconnects.
+
+    Matches are streamed as newline delimited JSON (application/x-ndjson),
+    one object per matching line, the last line is a summary.
+
+    Supported Request Methods: POST
+    Parameters:
+    pattern (string, required) - the regular expression, or the string
+    literal (string, optional) - 1 to search `pattern` as a plain string
+    ignore_case (string, optional) - 1 for a case-insensitive search
+    project (string, optional) - only the logs of this project
+    spider (string, optional) - only the logs of this spider
+    since (string, optional) - only logs modified after this timestamp
+    until (string, optional) - only logs modified before this timestamp
+    limit (string, optional) - max matching lines, at most
+                               `log_search_limit`
+
+    Example request:
+    $ curl -u test:test http://localhost:6800/search_logs.json -d project=myProject -d pattern=Traceback -d literal=1
+    Example response:
+    {"project": "myProject", "spider": "example", "job": "8d47b9e2d80311e8b8ba7c67a203577c", "line": 120, "offset": 10240, "text": "Traceback (most recent call last):"}
+    {"node_name": "nodeName", "status": "ok", "logs": 10, "searched": 10, "matches": 1, "truncated": false}
+
+    """
+
+    @decorator_auth
+    def render_POST(self, request):
+        args = native_stringify_dict(copy(request.args), keys_only=False)
+        args = dict((k, v[0]) for k, v in args.items())
+        try:
+            pattern = args['pattern'].encode('utf-8')
+            if args.get('literal') == '1':
+                pattern = re.escape(pattern)
+            flags = re.IGNORECASE if args.get('ignore_case') == '1' else 0
+            re.compile(pattern, flags)
+            limit = min(int(args.get('limit') or self.root.log_search_limit),
+                        self.root.log_search_limit)
+            since, until = [float(args[k]) if args.get(k) else None
+                            for k in ('since', 'until')]
+            if not self.root.logs_dir:
+                raise ValueError("logs_dir is not configured")
+            logs = find_logs(self.root.logs_dir, args.get('project'),
+                             args.get('spider'), since, until)
+        except (KeyError, ValueError, re.error) as e:
             return {
                 "node_name": self.root.node_name,
                 "status": "error",
-                "message": str(e)
+                "message": "{}: {}".format(type(e).__name__, e)
             }
+        search = _LogSearch(self.root, request, pattern, flags, limit, logs)
+        request.setHeader('Content-Type', 'application/x-ndjson')
+        request.setHeader('Access-Control-Allow-Origin', '*')
+        search.start()
+        return server.NOT_DONE_YET
+
+
+class _LogSearch(object):
+    """State of a search_logs.json request"""
+
+    def __init__(self, root, request, pattern, flags, limit, logs):
+        self.root = root
+        self.request = request
+        self.pattern = pattern
+        self.flags = flags
+        self.limit = limit
+        self.logs = logs
+        self.pending = iter(logs)  # shared by the workers
+        self.deadline = time.time() + root.log_search_timeout
+        self.searched = 0
+        self.matches = 0
+        self.truncated = False
+        self.disconnected = False
+        request.notifyFinish().addErrback(self._disconnected)
+
+    def _disconnected(self, failure):
+        self.disconnected = True
+
+    @property
+    def stopped(self):
+        if self.matches >= self.limit or time.time() > self.deadline:
+            self.truncated = True
+        return self.truncated or self.disconnected
+
+    def start(self):
+        workers = [self.work() for _ in range(self.root.log_pool.workers)]
+        defer.DeferredList(workers).addCallback(self.finish)
+
+    @defer.inlineCallbacks
+    def work(self):
+        for _, project, spider, job_id, path in self.pending:
+            if self.stopped:
+                break
+            try:
+                result = yield self.root.log_pool.search(
+                    path, self.pattern, self.flags,
+                    self.limit - self.matches, self.deadline)
+            except Exception as e:
+                log.msg(format='Failed to search %(path)r: %(error)s',
+                        path=path, error=e, system='SearchLogs')
+                continue
+            self.searched += 1
+            if self.disconnected:
+                break
+            lines = []
+            for line_no, offset, text in result["matches"]:
+                if self.matches >= self.limit:
+                    break
+                self.matches += 1
+                lines.append(self.encode({
+                    "project": project,
+                    "spider": spider,
+                    "job": job_id,
+                    "line": line_no,
+                    "offset": offset,
+                    "text": text,
+                }))
+            if result["truncated"]:
+                self.truncated = True
+            if lines:
+                self.request.write(b''.join(lines))
+
+    def finish(self, _):
+        if self.disconnected:
+            return
+        self.request.write(self.encode({
+            "node_name": self.root.node_name,
+            "status": "ok",
+            "logs": len(self.logs),
+            "searched": self.searched,
+            "matches": self.matches,
+            "truncated": self.truncated or self.searched < len(self.logs),
+        }))
+        self.request.finish()
+
+    @staticmethod
+    def encode(obj):
+        return (JsonResource.json_encoder.encode(obj) + "\n").encode('utf-8')
 
 
 class SysPerformance(WsResource):
@@ -580,18 +1148,109 @@ class SysPerformance(WsResource):
 
     @decorator_auth
     def render_GET(self, request):
-        per = self.root.performance
         return {
             "node_name": self.root.node_name,
             "status": "ok",
-            "performance": {
-                'cpu': per.cpu_percent,
-                'virtual_memory': per.virtual_memory_percent,
-                'swap_memory': per.swap_memory_percent,
-                'disk_usage': per.disk_usage_percent,
-                'disk_io_read': per.disk_io_read_speed,
-                'disk_io_write': per.disk_io_write_speed,
-                'net_io_sent': per.net_io_sent_speed,
-                'net_io_receive': per.net_io_receive_speed,
-            }
+            "performance": get_performance(self.root)
+        }
+
+
+class SysPerformanceHistory(WsResource):
+    """
+    sys_performance_history.json
+    Get the system performance samples kept by the slave (one per second,
+    the last `performance_history` samples) in one response.
+
+    Supported Request Methods: GET
+    Parameters:
+    since (float, optional) - only samples after this timestamp
+    step (float, optional) - average the samples per `step` seconds, only
+                             complete buckets are returned
+
+    Example request:
+    curl -u test:test http://localhost:6800/sys_performance_history.json?since=1545000000&step=5
+    Example response:
+    {
+        "node_name": "nodeName",
+        "status": "ok",
+        "step": 5.0,
+        "times": [1545000005.0, 1545000010.0],
+        "samples": {"cpu": [5.9, 6.1], "virtual_memory": [83.4, 83.4], ...}
+    }
+
+    """
+
+    @decorator_auth
+    def render_GET(self, request):
+        args = native_stringify_dict(copy(request.args), keys_only=False)
+        data = {
+            "node_name": self.root.node_name,
+            "status": "ok",
+        }
+        data.update(get_performance_history(
+            self.root, args.get('since', [None])[0],
+            args.get('step', [None])[0]))
+        return data
+
+
+class NodeSnapshot(WsResource):
+    """
+    node_snapshot.json
+    Get the daemon status, the jobs of all projects, system performance
+    and the egg manifest in one response.
+
+    With `since`, the job lists are replaced by the job changes recorded
+    after that sequence number (see job_changes.json).
+
+    Supported Request Methods: GET
+    Parameters:
+    since (integer, optional) - the last job change sequence number seen
+    limit (integer, optional) - max job changes to return, default 1000
+    history_since (float, optional) - include the performance samples after
+                                      this timestamp (see
+                                      sys_performance_history.json)
+    history_step (float, optional) - average the samples per step seconds
+
+    Example request:
+    curl -u test:test http://localhost:6800/node_snapshot.json
+    Example response:
+    {
+        "node_name": "nodeName",
+        "status": "ok",
+        "daemon_status": {"pending": 0, "running": 1, "finished": 3,
+                          "max_proc": 16, "free_slots": 15},
+        "jobs": {
+            "myProject": {"pending": [], "running": [], "finished": []}
+        },
+        "changes": {"changes": [], "seq": 42, "last_seq": 42,
+                    "epoch": "5f0c2b6e...", "reset": false},
+        "performance": {"cpu": 5.9, "virtual_memory": 83.4, ...},
+        "manifest": [
+            {"project": "myProject", "version": "r99",
+             "sha256": "9f86d08...", "size": 10240}
+        ]
+    }
+
+    """
+
+    @decorator_auth
+    def render_GET(self, request):
+        args = native_stringify_dict(copy(request.args), keys_only=False)
+        data = {
+            "node_name": self.root.node_name,
+            "status": "ok",
+            "daemon_status": get_daemon_status(self.root),
+            "changes": get_job_changes(self.root, args),
+            "performance": get_performance(self.root),
+            "manifest": self.root.egg_storage.manifest(),
         }
+        if 'history_since' in args:
+            data["history"] = get_performance_history(
+                self.root, args['history_since'][0],
+                args.get('history_step', [None])[0])
+        if 'since' not in args or data["changes"]["reset"]:
+            data["jobs"] = {
+                project: get_project_jobs(self.root, project)
+                for project in self.root.scheduler.list_projects()
+            }
+        return data
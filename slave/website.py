@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import base64
+import os
 import socket
 from datetime import datetime
 
@@ -10,6 +11,42 @@ from twisted.application.service import IServiceCollection
 from twisted.web import resource, static
 
 from .interfaces import IPoller, IEggStorage, ISpiderScheduler, IPerformance
+from .interfaces import IJobChanges, IErrorIndex
+from .logfiles import ARCHIVE_EXT, INDEX_EXT, ArchivedLog
+from .logfiles import LogScanner, LogScanPool
+
+
+class LogsDirectory(static.File):
+    """
+    The logs directory. A log that was archived is still served at its
+    original url, with Range support, by decompressing only the blocks
+    that cover the requested bytes.
+    """
+
+    def getChild(self, path, request):
+        name = path.decode('utf-8', 'replace') \
+            if isinstance(path, bytes) else path
+        if name.endswith('.log') and '/' not in name and self.isdir():
+            log_path = os.path.join(os.fsdecode(self.path), name)
+            if not os.path.exists(log_path) and \
+                    os.path.exists(log_path + ARCHIVE_EXT + INDEX_EXT):
+                return ArchivedLogFile(log_path + ARCHIVE_EXT)
+        return static.File.getChild(self, path, request)
+
+
+class ArchivedLogFile(static.File):
+    """An archived log, served as the original text/plain log"""
+
+    def __init__(self, path):
+        static.File.__init__(self, path, 'text/plain')
+        self.type, self.encoding = 'text/plain', None
+
+    def openForReading(self):
+        return ArchivedLog(self.path)
+
+    def getFileSize(self):
+        with ArchivedLog(self.path) as f:
+            return f.size
 
 
 class Root(resource.Resource):
@@ -19,6 +56,12 @@ class Root(resource.Resource):
         self.debug = config.getboolean('debug', False)
         self.runner = config.get('runner')
         self.logs_dir = config.get('logs_dir')  # logs directory
+        self.log_scanner = LogScanner(
+            config.getint('log_scan_budget', 4 * 1024 * 1024))
+        self.log_pool = LogScanPool(
+            self.log_scanner, config.getint('log_scan_workers', 2))
+        self.log_search_limit = config.getint('log_search_limit', 1000)
+        self.log_search_timeout = config.getfloat('log_search_timeout', 60)
         items_dir = config.get('items_dir')
         local_items = items_dir and (
                 urlparse(items_dir).scheme.lower() in ['', 'file'])
@@ -28,7 +71,7 @@ class Root(resource.Resource):
         if self.logs_dir:
             self.putChild(
                 b'logs',
-                static.File(
+                LogsDirectory(
                     self.logs_dir.encode('ascii', 'ignore'), 'text/plain')
             )
         if local_items:
@@ -73,6 +116,14 @@ class Root(resource.Resource):
     def performance(self):
         return self.app.getComponent(IPerformance)
 
+    @property
+    def error_index(self):
+        return self.app.getComponent(IErrorIndex, None)
+
+    @property
+    def job_changes(self):
+        return self.app.getComponent(IJobChanges)
+
 
 class Home(resource.Resource):
 